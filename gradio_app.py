@@ -94,6 +94,7 @@ def generate_video(
             slg_layer=slg_layer,
             video_negative_prompt=video_negative_prompt,
             audio_negative_prompt=audio_negative_prompt,
+            output_type="uint8",
         )
 
         tmpfile = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False)
@@ -1,13 +1,27 @@
 import os
-import json
-import subprocess
+import io
+import sys
+import time
+import shutil
+import logging
 import tempfile
 import requests
-from pathlib import Path
 import cloudinary
 import cloudinary.uploader
 from PIL import Image
-import io
+
+# the engine loads its default config relative to the repo root
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import torch
+from omegaconf import OmegaConf
+from ovi.ovi_fusion_engine import OviFusionEngine
+from ovi.utils.io_utils import save_video
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s: %(message)s",
+    handlers=[logging.StreamHandler(stream=sys.stdout)])
 
 # Cloudinary config
 cloudinary.config(
@@ -16,87 +30,89 @@ cloudinary.config(
     api_secret=os.environ["CLOUDINARY_API_SECRET"]
 )
 
+CONFIG = OmegaConf.create({
+    "ckpt_dir": "/workspace/ckpts",
+    "model_name": "960x960_10s",
+    "sp_size": 1,
+    "cpu_offload": False,
+    "fp8": False,
+    "mode": "t2v",
+})
+
+GENERATION_DEFAULTS = {
+    "video_frame_height_width": [960, 960],
+    "solver_name": "unipc",
+    "sample_steps": 50,
+    "shift": 5.0,
+    "video_guidance_scale": 4.0,
+    "audio_guidance_scale": 3.0,
+    "slg_layer": 11,
+    "video_negative_prompt": "jitter, bad hands, blur",
+    "audio_negative_prompt": "robotic, muffled",
+}
+
+
+def load_engine():
+    # loaded once per worker, every request reuses the resident models
+    start = time.time()
+    torch.cuda.set_device(0)
+    engine = OviFusionEngine(config=CONFIG, device=0, target_dtype=torch.bfloat16)
+    logging.info(f"OVI Fusion Engine loaded in {time.time() - start:.1f}s")
+
+    # warm-up: a short generation initializes the CUDA context, kernels and allocator pools
+    start = time.time()
+    engine.generate(text_prompt="warm-up", seed=0, **{**GENERATION_DEFAULTS, "sample_steps": 2})
+    torch.cuda.empty_cache()
+    logging.info(f"Warm-up finished in {time.time() - start:.1f}s")
+    return engine
+
+
+ENGINE = load_engine()
+
+
 def handler(event):
+    request_dir = tempfile.mkdtemp(prefix="ovi_")
     try:
         input_data = event["input"]
         prompt = input_data.get("prompt")
         image_url = input_data.get("image_url")
         seed = input_data.get("seed", 42)
-        
+
         if not prompt:
             return {"error": "prompt required"}
-        
+
         print(f"🚀 OVI 1.1 ({'i2v' if image_url else 't2v'}) - {prompt[:50]}")
-        
-        # Create temp config file (OVI inference.py reads YAML)
-        config_path = "/tmp/inference_config.yaml"
-        mode = "i2v" if image_url else "t2v"
-        
-        config_content = f"""
-output_dir: /tmp
-ckpt_dir: /workspace/ckpts
-model_name: 960x960_10s
-sp_size: 1
-cpu_offload: false
-fp8: false
-text_prompt: "{prompt}"
-mode: {mode}
-video_frame_height_width: [960, 960]
-seed: {seed}
-solver_name: unipc
-sample_steps: 50
-shift: 5.0
-video_guidance_scale: 4.0
-audio_guidance_scale: 3.0
-slg_layer: 11
-video_negative_prompt: "jitter, bad hands, blur"
-audio_negative_prompt: "robotic, muffled"
-"""
-        
-        with open(config_path, "w") as f:
-            f.write(config_content)
-        
-        # i2v: download image to /tmp/input.jpg
+
+        # i2v: download image into this request's directory
         image_path = None
         if image_url:
             resp = requests.get(image_url)
+            resp.raise_for_status()
             img = Image.open(io.BytesIO(resp.content)).convert("RGB")
-            image_path = "/tmp/input.jpg"
+            image_path = os.path.join(request_dir, "input.jpg")
             img.save(image_path)
-        
-        # Run OFFICIAL inference.py (exact repo command)
-        cmd = [
-            "python", "inference.py",
-            "--config-file", config_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd="/workspace/Ovi")
-        
-        if result.returncode != 0:
-            print("inference.py failed:", result.stderr)
-            return {"error": result.stderr}
-        
-        # Find generated video (inference.py saves to output_dir)
-        video_files = list(Path("/tmp").glob("*.mp4"))
-        if not video_files:
-            return {"error": "No video generated"}
-        
-        video_path = video_files[0]
-        
+
+        output = ENGINE.generate(text_prompt=prompt,
+                                 image_path=image_path,
+                                 seed=seed,
+                                 output_type="uint8",
+                                 reuse_output_buffer=True,
+                                 **GENERATION_DEFAULTS)
+        if output is None:
+            return {"error": "Generation failed", "status": "failed"}
+        generated_video, generated_audio, _ = output
+
+        video_path = os.path.join(request_dir, f"ovi_{seed}.mp4")
+        save_video(video_path, generated_video, generated_audio, fps=24, sample_rate=16000)
+
         # Upload to Cloudinary
         upload_result = cloudinary.uploader.upload_large(
-            str(video_path),
+            video_path,
             resource_type="video",
             folder="ovi_1.1",
             public_id=f"ovi_{seed}"
         )
-        
-        # Cleanup
-        Path(config_path).unlink(missing_ok=True)
-        if image_path:
-            Path(image_path).unlink(missing_ok=True)
-        video_path.unlink(missing_ok=True)
-        
+
         return {
             "status": "success",
             "video_url": upload_result["secure_url"],
@@ -104,6 +120,10 @@ audio_negative_prompt: "robotic, muffled"
             "resolution": "960x960",
             "seed": seed
         }
-        
+
     except Exception as e:
         return {"error": str(e), "status": "failed"}
+
+    finally:
+        # Cleanup
+        shutil.rmtree(request_dir, ignore_errors=True)
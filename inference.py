@@ -1,15 +1,19 @@
 import os
 import sys
+import time
 import logging
+import traceback
 import torch
 from tqdm import tqdm
 from omegaconf import OmegaConf
 from ovi.utils.io_utils import save_video
-from ovi.utils.processing_utils import format_prompt_for_filename, validate_and_process_user_prompt
+from ovi.utils.job_utils import JobManifest, job_hash, job_output_path
+from ovi.utils.processing_utils import validate_and_process_user_prompt
 from ovi.utils.utils import get_arguments
 from ovi.distributed_comms.util import get_world_size, get_local_rank, get_global_rank
 from ovi.distributed_comms.parallel_states import initialize_sequence_parallel_state, get_sequence_parallel_state, nccl_info
-from ovi.ovi_fusion_engine import OviFusionEngine
+from ovi.distributed_comms.job_queue import JobQueue
+from ovi.ovi_fusion_engine import OviFusionEngine, GenerationRequest
 
 
 
@@ -81,65 +85,104 @@ def main(config, args):
     if use_sp:
         sp_size = nccl_info.sp_size
         sp_rank = nccl_info.rank_within_group
-        sp_group_id = global_rank // sp_size
-        num_sp_groups = world_size // sp_size
     else:
         # No SP: treat each GPU as its own group
         sp_size = 1
         sp_rank = 0
-        sp_group_id = global_rank
-        num_sp_groups = world_size
 
-    # Data distribution - by SP groups
-    total_files = len(all_eval_data)
-
-    require_sample_padding = False
-    
-    if total_files == 0:
+    if len(all_eval_data) == 0:
         logging.error(f"ERROR: No evaluation files found")
-        this_rank_eval_data = []
-    else:
-        # Pad to match number of SP groups
-        remainder = total_files % num_sp_groups
-        if require_sample_padding and remainder != 0:
-            pad_count = num_sp_groups - remainder
-            all_eval_data += [all_eval_data[0]] * pad_count
-        
-        # Distribute across SP groups
-        this_rank_eval_data = all_eval_data[sp_group_id :: num_sp_groups]
-
-    for _, (text_prompt, image_path) in tqdm(enumerate(this_rank_eval_data)):
-        video_frame_height_width = config.get("video_frame_height_width", None)
-        seed = config.get("seed", 100)
-        solver_name = config.get("solver_name", "unipc")
-        sample_steps = config.get("sample_steps", 50)
-        shift = config.get("shift", 5.0)
-        video_guidance_scale = config.get("video_guidance_scale", 4.0)
-        audio_guidance_scale = config.get("audio_guidance_scale", 3.0)
-        slg_layer = config.get("slg_layer", 11)
-        video_negative_prompt = config.get("video_negative_prompt", "")
-        audio_negative_prompt = config.get("audio_negative_prompt", "")
+
+    video_frame_height_width = config.get("video_frame_height_width", None)
+    seed = config.get("seed", 100)
+    requests = []
+    for text_prompt, image_path in all_eval_data:
         for idx in range(config.get("each_example_n_times", 1)):
-            generated_video, generated_audio, generated_image = ovi_engine.generate(text_prompt=text_prompt,
-                                                                    image_path=image_path,
-                                                                    video_frame_height_width=video_frame_height_width,
-                                                                    seed=seed+idx,
-                                                                    solver_name=solver_name,
-                                                                    sample_steps=sample_steps,
-                                                                    shift=shift,
-                                                                    video_guidance_scale=video_guidance_scale,
-                                                                    audio_guidance_scale=audio_guidance_scale,
-                                                                    slg_layer=slg_layer,
-                                                                    video_negative_prompt=video_negative_prompt,
-                                                                    audio_negative_prompt=audio_negative_prompt)
-            
+            requests.append(dict(text_prompt=text_prompt,
+                                 image_path=image_path,
+                                 video_frame_height_width=video_frame_height_width,
+                                 seed=seed+idx,
+                                 solver_name=config.get("solver_name", "unipc"),
+                                 sample_steps=config.get("sample_steps", 50),
+                                 shift=config.get("shift", 5.0),
+                                 video_guidance_scale=config.get("video_guidance_scale", 4.0),
+                                 audio_guidance_scale=config.get("audio_guidance_scale", 3.0),
+                                 slg_layer=config.get("slg_layer", 11),
+                                 video_negative_prompt=config.get("video_negative_prompt", ""),
+                                 audio_negative_prompt=config.get("audio_negative_prompt", "")))
+
+    # content-hashed jobs: stable output names across runs and world sizes, finished ones are skipped
+    manifest = JobManifest(os.path.join(output_dir, "manifest.jsonl"))
+    pending = {}
+    for request in requests:
+        request_hash = job_hash(request, config)
+        if not manifest.is_done(request_hash):
+            pending.setdefault(request_hash, request)
+    logging.info(f"{len(pending)} of {len(requests)} requests left to generate, the rest are in {manifest.path}")
+    if world_size > 1:
+        # every rank must build the same job list before anyone appends to the manifest
+        torch.distributed.barrier()
+
+    # jobs of up to max_batch_size requests, longest first; requests with the same resolution and mode
+    # are sampled together in one forward
+    requests = sorted(pending.items(), key=lambda item: ovi_engine.estimate_cost(GenerationRequest(**item[1])), reverse=True)
+    chunk_size = ovi_engine.max_batch_size
+    jobs = [requests[start:start + chunk_size] for start in range(0, len(requests), chunk_size)]
+
+    if config.get("pre_encode_texts", False):
+        # encode all prompts up front in large T5 batches, then free T5 for the sampling loop
+        texts = [ovi_engine.text_formatter(r["text_prompt"]) for _, r in requests]
+        texts += [text for _, r in requests for text in (r["video_negative_prompt"], r["audio_negative_prompt"])]
+        # written once by rank 0, every rank memory-maps the same file
+        embeddings_path = os.path.join(output_dir, "text_embeddings.safetensors")
+        if global_rank == 0:
+            ovi_engine.pre_encode_texts(texts, embeddings_path, batch_size=config.get("pre_encode_batch_size", 32))
+        if world_size > 1:
+            torch.distributed.barrier()
+        if global_rank != 0:
+            ovi_engine.pre_encode_texts(texts, embeddings_path, encode=False)
+
+    # every SP group pulls the next job when it is free instead of a fixed stripe of the CSV
+    job_queue = JobQueue(len(jobs))
+    for job_index in tqdm(job_queue, total=len(jobs)):
+        chunk = jobs[job_index]
+        start = time.time()
+        try:
+            outputs = ovi_engine.generate_batch([request for _, request in chunk], output_type="uint8")
+        except Exception:
+            logging.error(traceback.format_exc())
             if sp_rank == 0:
-                formatted_prompt = format_prompt_for_filename(text_prompt)
-                output_path = os.path.join(output_dir, f"{formatted_prompt}_{'x'.join(map(str, video_frame_height_width))}_{seed+idx}_{global_rank}.mp4")
-                save_video(output_path, generated_video, generated_audio, fps=24, sample_rate=16000)
+                for request_hash, request in chunk:
+                    manifest.append(request_hash, "failed", rank=global_rank, prompt=request["text_prompt"], seed=request["seed"])
+            continue
+        elapsed = time.time() - start
+
+        if sp_rank == 0:
+            for (request_hash, request), output in zip(chunk, outputs):
+                if output is None:
+                    # only this request failed, the rest of the job was generated
+                    manifest.append(request_hash, "failed", rank=global_rank, prompt=request["text_prompt"], seed=request["seed"])
+                    continue
+                generated_video, generated_audio, generated_image = output
+                output_path = job_output_path(output_dir, request, request_hash)
+                # written under a temporary name, a preempted save never looks like a finished output
+                tmp_path = output_path.replace(".mp4", ".tmp.mp4")
+                save_video(tmp_path, generated_video, generated_audio, fps=24, sample_rate=16000)
+                os.replace(tmp_path, output_path)
                 if generated_image is not None:
                     generated_image.save(output_path.replace('.mp4', '.png'))
-        
+                manifest.append(request_hash, "done",
+                                output_path=output_path,
+                                bytes=os.path.getsize(output_path),
+                                prompt=request["text_prompt"],
+                                image_path=request["image_path"],
+                                seed=request["seed"],
+                                batch_size=len(chunk),
+                                generation_seconds=elapsed,
+                                total_seconds=time.time() - start,
+                                rank=global_rank,
+                                world_size=world_size)
+    job_queue.close()
 
 
 if __name__ == "__main__":
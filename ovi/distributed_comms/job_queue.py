@@ -0,0 +1,76 @@
+import os
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+
+from ovi.distributed_comms.parallel_states import get_sequence_parallel_state, nccl_info
+from ovi.distributed_comms.util import get_global_rank, get_world_size
+
+
+class JobQueue:
+    """
+    Dynamic distribution of num_jobs job indices over the SP groups.
+
+    Every SP group pulls the next index from an atomic counter in the store of the default process
+    group (or a TCPStore on port / OVI_QUEUE_PORT if one is given) as soon as it is free, so groups that draw cheap jobs simply take more of them. The group leader pulls and
+    broadcasts the index to the rest of its group, all ranks of a group run the same job. Jobs are
+    handed out in index order, sort them longest first for the best balance.
+
+    Usage:
+        queue = JobQueue(len(jobs))
+        for job_id in queue:
+            run(jobs[job_id])
+        queue.close()
+    """
+
+    # queues are created in the same order on every rank, each one gets its own counter
+    num_queues = 0
+
+    def __init__(self, num_jobs, port=None, timeout_minutes=60):
+        self.num_jobs = num_jobs
+        self.world_size = get_world_size()
+        self.store = None
+        self.next_local = 0
+        if self.world_size > 1:
+            port = port or os.environ.get("OVI_QUEUE_PORT")
+            if port is not None:
+                self.store = dist.TCPStore(os.environ["MASTER_ADDR"], int(port), self.world_size,
+                                           is_master=get_global_rank() == 0,
+                                           timeout=timedelta(minutes=timeout_minutes))
+            else:
+                # no extra port to agree on, the rendezvous store of the default process group
+                assert dist.is_initialized(), "JobQueue needs the default process group or an explicit port"
+                self.store = dist.PrefixStore(f"ovi_job_queue/{JobQueue.num_queues}",
+                                              dist.distributed_c10d._get_default_store())
+            JobQueue.num_queues += 1
+
+    def pull(self):
+        """
+        Index of the next job for this SP group, None once all jobs are taken.
+        """
+        if self.store is None:
+            job_id = self.next_local
+            self.next_local += 1
+        elif not get_sequence_parallel_state():
+            job_id = self.store.add("next_job", 1) - 1
+        else:
+            job_id = torch.tensor([self.store.add("next_job", 1) - 1 if nccl_info.rank_within_group == 0 else 0],
+                                  dtype=torch.long, device=torch.cuda.current_device())
+            leader = nccl_info.global_rank - nccl_info.rank_within_group
+            dist.broadcast(job_id, src=leader, group=nccl_info.group)
+            job_id = job_id.item()
+        return job_id if job_id < self.num_jobs else None
+
+    def __iter__(self):
+        while True:
+            job_id = self.pull()
+            if job_id is None:
+                return
+            yield job_id
+
+    def close(self):
+        # rank 0 hosts the store, it must outlive every other rank's last pull
+        if self.store is not None:
+            dist.barrier()
+            self.store = None
@@ -19,43 +19,93 @@ __all__ = [
     'flash_attention',
     'attention',
     'attention_with_weights',
+    'register_attention_backend',
+    'set_attention_backend',
+    'get_attention_backend',
 ]
 
+# name -> (fn, is_available(q)), see register_attention_backend
+ATTENTION_BACKENDS = {}
+# backend forced through set_attention_backend, None selects automatically per call
+_FORCED_BACKEND = None
+# upper bound of the fp32 score block materialized per query chunk by the math backend
+MATH_ATTENTION_CHUNK_BYTES = 256 * 1024 * 1024
 
-def flash_attention(
-    q,
-    k,
-    v,
-    q_lens=None,
-    k_lens=None,
-    dropout_p=0.,
-    softmax_scale=None,
-    q_scale=None,
-    causal=False,
-    window_size=(-1, -1),
-    deterministic=False,
-    dtype=torch.bfloat16,
-    version=None
-):
+
+def register_attention_backend(name, is_available=lambda q: True):
     """
-    q:              [B, Lq, Nq, C1].
-    k:              [B, Lk, Nk, C1].
-    v:              [B, Lk, Nk, C2]. Nq must be divisible by Nk.
-    q_lens:         [B].
-    k_lens:         [B].
-    dropout_p:      float. Dropout probability.
-    softmax_scale:  float. The scaling of QK^T before applying softmax.
-    causal:         bool. Whether to apply causal attention mask.
-    window_size:    (left right). If not (-1, -1), apply sliding window local attention.
-    deterministic:  bool. If True, slightly slower and uses more memory.
-    dtype:          torch.dtype. Apply when dtype of q/k/v is not float16/bfloat16.
+    Register fn(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, q_scale, causal,
+    window_size, deterministic, dtype) -> [B, Lq, Nq, C2] as attention backend `name`.
+    """
+    def register(fn):
+        ATTENTION_BACKENDS[name] = (fn, is_available)
+        return fn
+    return register
+
+
+def set_attention_backend(name=None):
+    """
+    Force all attention() calls onto backend `name`, None or 'auto' restores the automatic selection.
+    """
+    global _FORCED_BACKEND
+    if name in (None, 'auto'):
+        _FORCED_BACKEND = None
+        return
+    assert name in ATTENTION_BACKENDS, f"Unknown attention backend {name}, choose from {['auto'] + list(ATTENTION_BACKENDS)}"
+    _FORCED_BACKEND = name
+
+
+def get_attention_backend(q, dropout_p=0., window_size=(-1, -1), fa_version=None):
+    """
+    Name of the backend attention() uses for q: the forced one if set, otherwise FA3 > FA2 > SDPA on
+    cuda and SDPA on cpu (the chunked math path for padded cpu batches is picked in attention()).
+    """
+    if _FORCED_BACKEND is not None:
+        return _FORCED_BACKEND
+    if fa_version is not None and ATTENTION_BACKENDS[f'fa{fa_version}'][1](q):
+        return f'fa{fa_version}'
+    # Note: dropout_p, window_size are not supported in FA3 now.
+    if tuple(window_size) == (-1, -1) and dropout_p == 0. and ATTENTION_BACKENDS['fa3'][1](q):
+        return 'fa3'
+    if ATTENTION_BACKENDS['fa2'][1](q):
+        return 'fa2'
+    return 'sdpa'
+
+
+def dense_lens(lens, l):
+    """
+    None when lens do not mask anything, so the dense kernels can skip the varlen repack.
+    Only host tensors are inspected, device lens are kept as-is to avoid a sync.
+    """
+    if lens is None:
+        return None
+    if lens.device.type == 'cpu' and bool((lens >= l).all()):
+        return None
+    return lens
+
+
+def cu_seqlens(lens, device):
+    return torch.cat([lens.new_zeros([1]), lens]).cumsum(
+        0, dtype=torch.int32).to(device, non_blocking=True)
+
+
+def pad_packed(x, lens, b, l):
+    """
+    Scatter varlen output x [sum(lens), N, C] back into a zero padded [B, L, N, C].
     """
+    out = x.new_zeros(b, l, *x.shape[1:])
+    for i, (start, n) in enumerate(zip(cu_seqlens(lens, 'cpu')[:-1].tolist(), lens.tolist())):
+        out[i, :n] = x[start:start + n]
+    return out
+
+
+def flash_attention_varlen(flash_fn, q, k, v, q_lens, k_lens, dtype, **kwargs):
     half_dtypes = (torch.float16, torch.bfloat16)
     assert dtype in half_dtypes
     assert q.device.type == 'cuda' and q.size(-1) <= 256
 
     # params
-    b, lq, lk, out_dtype = q.size(0), q.size(1), k.size(1), q.dtype
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
 
     def half(x):
         return x if x.dtype in half_dtypes else x.to(dtype)
@@ -63,11 +113,12 @@ def flash_attention(
     # preprocess query
     if q_lens is None:
         q = half(q.flatten(0, 1))
-        q_lens = torch.tensor(
+        packed_q_lens = torch.tensor(
             [lq] * b, dtype=torch.int32).to(
                 device=q.device, non_blocking=True)
     else:
         q = half(torch.cat([u[:v] for u, v in zip(q, q_lens)]))
+        packed_q_lens = q_lens
 
     # preprocess key, value
     if k_lens is None:
@@ -83,8 +134,202 @@ def flash_attention(
     q = q.to(v.dtype)
     k = k.to(v.dtype)
 
+    x = flash_fn(
+        q=q,
+        k=k,
+        v=v,
+        cu_seqlens_q=cu_seqlens(packed_q_lens, q.device),
+        cu_seqlens_k=cu_seqlens(k_lens, q.device),
+        max_seqlen_q=lq,
+        max_seqlen_k=lk,
+        **kwargs)
+    if isinstance(x, tuple):
+        x = x[0]
+
+    # padded query rows are not computed, return zeros for them
+    if q_lens is None:
+        return x.unflatten(0, (b, lq))
+    return pad_packed(x, q_lens, b, lq)
+
+
+def flash_attention_dense(flash_fn, q, k, v, dtype, **kwargs):
+    half_dtypes = (torch.float16, torch.bfloat16)
+    assert dtype in half_dtypes
+    assert q.device.type == 'cuda' and q.size(-1) <= 256
+
+    def half(x):
+        return x if x.dtype in half_dtypes else x.to(dtype)
+
+    v = half(v)
+    x = flash_fn(half(q).to(v.dtype), half(k).to(v.dtype), v, **kwargs)
+    if isinstance(x, tuple):
+        x = x[0]
+    return x
+
+
+@register_attention_backend(
+    'fa3', lambda q: FLASH_ATTN_3_AVAILABLE and q.device.type == 'cuda')
+def fa3_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale,
+                  q_scale, causal, window_size, deterministic, dtype):
+    if q_scale is not None:
+        q = q * q_scale
+    # Note: dropout_p, window_size are not supported in FA3 now.
+    if q_lens is None and k_lens is None:
+        return flash_attention_dense(
+            flash_attn_interface.flash_attn_func, q, k, v, dtype,
+            softmax_scale=softmax_scale,
+            causal=causal,
+            deterministic=deterministic)
+    return flash_attention_varlen(
+        flash_attn_interface.flash_attn_varlen_func, q, k, v, q_lens, k_lens, dtype,
+        seqused_q=None,
+        seqused_k=None,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        deterministic=deterministic)
+
+
+@register_attention_backend(
+    'fa2', lambda q: FLASH_ATTN_2_AVAILABLE and q.device.type == 'cuda')
+def fa2_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale,
+                  q_scale, causal, window_size, deterministic, dtype):
+    if q_scale is not None:
+        q = q * q_scale
+    kwargs = dict(
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic)
+    if q_lens is None and k_lens is None:
+        return flash_attention_dense(flash_attn.flash_attn_func, q, k, v, dtype, **kwargs)
+    return flash_attention_varlen(
+        flash_attn.flash_attn_varlen_func, q, k, v, q_lens, k_lens, dtype, **kwargs)
+
+
+def key_padding_mask(k_lens, b, lk, device):
+    """
+    Boolean [B, 1, 1, Lk] mask, True for the keys each sample attends to.
+    """
+    if k_lens is None:
+        return None
+    k_lens = k_lens.to(device)
+    return (torch.arange(lk, device=device).unsqueeze(0) < k_lens.unsqueeze(1)).view(b, 1, 1, lk)
+
+
+def zero_padded_queries(x, q_lens):
+    """
+    Zero the query rows beyond q_lens in x [B, Lq, N, C], matching the flash varlen output.
+    """
+    if q_lens is None:
+        return x
+    q_lens = q_lens.to(x.device)
+    keep = torch.arange(x.size(1), device=x.device).unsqueeze(0) < q_lens.unsqueeze(1)
+    return x * keep.view(*keep.shape, 1, 1).to(x.dtype)
+
+
+def repeat_kv_heads(q, k, v):
+    # [B, L, N, C] with Nq divisible by Nk
+    if k.size(2) != q.size(2):
+        k = k.repeat_interleave(q.size(2) // k.size(2), dim=2)
+        v = v.repeat_interleave(q.size(2) // v.size(2), dim=2)
+    return k, v
+
+
+@register_attention_backend('sdpa')
+def sdpa_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale,
+                   q_scale, causal, window_size, deterministic, dtype):
+    assert tuple(window_size) == (-1, -1), 'window_size is only supported by the flash attention backends'
+    out_dtype = q.dtype
+    if q_scale is not None:
+        q = q * q_scale
+    k, v = repeat_kv_heads(q, k, v)
+    b, lk = q.size(0), k.size(1)
+
+    q = q.transpose(1, 2).to(dtype)
+    k = k.transpose(1, 2).to(dtype)
+    v = v.transpose(1, 2).to(dtype)
+
+    out = torch.nn.functional.scaled_dot_product_attention(
+        q, k, v,
+        attn_mask=key_padding_mask(k_lens, b, lk, q.device),
+        is_causal=causal,
+        dropout_p=dropout_p,
+        scale=softmax_scale)
+
+    out = out.transpose(1, 2).contiguous()
+    return zero_padded_queries(out, q_lens).to(out_dtype)
+
+
+@register_attention_backend('math')
+def math_attention(q, k, v, q_lens, k_lens, dropout_p, softmax_scale,
+                   q_scale, causal, window_size, deterministic, dtype):
+    """
+    Reference attention in fp32 that processes the queries in chunks, so only a
+    [B, N, chunk, Lk] score block is alive at a time. Runs on any device.
+    """
+    assert tuple(window_size) == (-1, -1), 'window_size is only supported by the flash attention backends'
+    out_dtype = q.dtype
     if q_scale is not None:
         q = q * q_scale
+    k, v = repeat_kv_heads(q, k, v)
+    b, lq, n, lk = q.size(0), q.size(1), q.size(2), k.size(1)
+    scale = softmax_scale if softmax_scale is not None else q.size(-1)**-0.5
+
+    # [B, N, L, C]
+    k = k.transpose(1, 2).float()
+    v = v.transpose(1, 2).float()
+    mask = key_padding_mask(k_lens, b, lk, q.device)
+
+    chunk = max(1, MATH_ATTENTION_CHUNK_BYTES // (b * n * lk * 4))
+    out = []
+    for start in range(0, lq, chunk):
+        q_i = q[:, start:start + chunk].transpose(1, 2).float()
+        scores = torch.matmul(q_i, k.transpose(-1, -2)).mul_(scale)
+        if mask is not None:
+            scores.masked_fill_(~mask, float('-inf'))
+        if causal:
+            rows = torch.arange(start, start + q_i.size(2), device=q.device)
+            causal_mask = torch.arange(lk, device=q.device).unsqueeze(0) > rows.unsqueeze(1)
+            scores.masked_fill_(causal_mask, float('-inf'))
+        scores = scores.softmax(dim=-1)
+        if dropout_p > 0.:
+            scores = torch.nn.functional.dropout(scores, p=dropout_p)
+        out.append(torch.matmul(scores, v).transpose(1, 2))
+    out = torch.cat(out, dim=1)
+    return zero_padded_queries(out, q_lens).to(out_dtype)
+
+
+def flash_attention(
+    q,
+    k,
+    v,
+    q_lens=None,
+    k_lens=None,
+    dropout_p=0.,
+    softmax_scale=None,
+    q_scale=None,
+    causal=False,
+    window_size=(-1, -1),
+    deterministic=False,
+    dtype=torch.bfloat16,
+    version=None
+):
+    """
+    q:              [B, Lq, Nq, C1].
+    k:              [B, Lk, Nk, C1].
+    v:              [B, Lk, Nk, C2]. Nq must be divisible by Nk.
+    q_lens:         [B].
+    k_lens:         [B].
+    dropout_p:      float. Dropout probability.
+    softmax_scale:  float. The scaling of QK^T before applying softmax.
+    causal:         bool. Whether to apply causal attention mask.
+    window_size:    (left right). If not (-1, -1), apply sliding window local attention.
+    deterministic:  bool. If True, slightly slower and uses more memory.
+    dtype:          torch.dtype. Apply when dtype of q/k/v is not float16/bfloat16.
+    """
+    assert q.device.type == 'cuda' and q.size(-1) <= 256
+    out_dtype = q.dtype
 
     if version is not None and version == 3 and not FLASH_ATTN_3_AVAILABLE:
         warnings.warn(
@@ -93,44 +338,12 @@ def flash_attention(
 
     # apply attention
     if (version is None or version == 3) and FLASH_ATTN_3_AVAILABLE:
-        # Note: dropout_p, window_size are not supported in FA3 now.
-        x = flash_attn_interface.flash_attn_varlen_func(
-            q=q,
-            k=k,
-            v=v,
-            cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            seqused_q=None,
-            seqused_k=None,
-            max_seqlen_q=lq,
-            max_seqlen_k=lk,
-            softmax_scale=softmax_scale,
-            causal=causal,
-            deterministic=deterministic)
-            
-        if isinstance(x, tuple):
-            x = x[0]
-        x = x.unflatten(0, (b, lq))
-        
+        backend = fa3_attention
     else:
         assert FLASH_ATTN_2_AVAILABLE
-        x = flash_attn.flash_attn_varlen_func(
-            q=q,
-            k=k,
-            v=v,
-            cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            max_seqlen_q=lq,
-            max_seqlen_k=lk,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic).unflatten(0, (b, lq))
+        backend = fa2_attention
+    x = backend(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, q_scale,
+                causal, window_size, deterministic, dtype)
 
     # output
     return x.type(out_dtype)
@@ -262,35 +475,21 @@ def attention(
     dtype=torch.bfloat16,
     fa_version=None,
 ):
-    if FLASH_ATTN_2_AVAILABLE or FLASH_ATTN_3_AVAILABLE:
-        return flash_attention(
-            q=q,
-            k=k,
-            v=v,
-            q_lens=q_lens,
-            k_lens=k_lens,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            q_scale=q_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic,
-            dtype=dtype,
-            version=fa_version,
-        )
-    else:
-        if q_lens is not None or k_lens is not None:
-            warnings.warn(
-                'Padding mask is disabled when using scaled_dot_product_attention. It can have a significant impact on performance.'
-            )
-        attn_mask = None
-
-        q = q.transpose(1, 2).to(dtype)
-        k = k.transpose(1, 2).to(dtype)
-        v = v.transpose(1, 2).to(dtype)
+    """
+    Same arguments as flash_attention, dispatched to the backend from get_attention_backend.
+    Lens that cover the whole sequence are dropped so the dense kernels skip the varlen repack.
+    """
+    out_dtype = q.dtype
+    q_lens = dense_lens(q_lens, q.size(1))
+    k_lens = dense_lens(k_lens, k.size(1))
 
-        out = torch.nn.functional.scaled_dot_product_attention(
-            q, k, v, attn_mask=attn_mask, is_causal=causal, dropout_p=dropout_p)
+    name = get_attention_backend(q, dropout_p, window_size, fa_version)
+    # sdpa falls back to a fully materialized score matrix with a mask on cpu
+    if _FORCED_BACKEND is None and name == 'sdpa' and q.device.type == 'cpu' and k_lens is not None:
+        name = 'math'
+    fn, is_available = ATTENTION_BACKENDS[name]
+    assert is_available(q), f"Attention backend {name} is not available for {q.device.type} tensors"
 
-        out = out.transpose(1, 2).contiguous()
-        return out
+    x = fn(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, q_scale,
+           causal, window_size, deterministic, dtype)
+    return x.type(out_dtype)
@@ -1,11 +1,116 @@
 
 import torch
+import torch.distributed as dist
 import torch.nn as nn
-from ovi.modules.model import WanLayerNorm, WanModel, WanRMSNorm, gradient_checkpointing, rope_apply
-from ovi.modules.attention import flash_attention
+from ovi.modules.model import TextConditioning, WanLayerNorm, WanModel, WanRMSNorm, gradient_checkpointing, rope_apply, modulate, gated_residual, check_time_embedding
+from ovi.modules.attention import attention
 from ovi.distributed_comms.communications import all_gather, all_to_all_4D
 from ovi.distributed_comms.parallel_states import nccl_info, get_sequence_parallel_state
 
+class FusionConditioningCache:
+    """
+    Text conditioning of both towers for every CFG branch, built once per generation.
+
+    Maps a branch name (e.g. 'pos', 'neg') to a (vid_cond, audio_cond) pair of
+    TextConditioning, which FusionModel.forward takes as text_cond.
+    """
+
+    def __init__(self):
+        self.branches = {}
+
+    def __getitem__(self, branch):
+        return self.branches[branch]
+
+    def __contains__(self, branch):
+        return branch in self.branches
+
+    def add(self, branch, vid_cond, audio_cond):
+        self.branches[branch] = (vid_cond, audio_cond)
+
+    def nbytes(self):
+        return sum(c.nbytes() for conds in self.branches.values() for c in conds if c is not None)
+
+
+class FusionPrefix:
+    """
+    Text-independent start of a FusionModel forward: patch and time embeddings of both towers and
+    the first fusion block's modulated self-attention. It only depends on the latents and timesteps,
+    so the CFG branches of a step share one prefix and fork at the first cross-attention.
+    Built by FusionModel.forward_prefix, passed to FusionModel.forward as prefix.
+    """
+
+    def __init__(self, vid, vid_e, vid_kwargs, audio, audio_e, audio_kwargs, self_attn_out):
+        self.vid, self.vid_e, self.vid_kwargs = vid, vid_e, vid_kwargs
+        self.audio, self.audio_e, self.audio_kwargs = audio, audio_e, audio_kwargs
+        self.self_attn_out = self_attn_out      # (vid, audio, vid_e, audio_e) after block 0's self-attention
+
+    def repeat(self, n):
+        """
+        The prefix of a batch repeated n times, e.g. for a batched CFG forward.
+        """
+        if n == 1:
+            return self
+
+        def cat(x):
+            if isinstance(x, (tuple, list)):
+                return type(x)(cat(u) for u in x)
+            return torch.cat([x] * n)
+
+        def cat_kwargs(kwargs):
+            # freqs and segments are shared by all samples
+            return dict(kwargs, e=cat(kwargs['e']), seq_lens=cat(kwargs['seq_lens']), grid_sizes=cat(kwargs['grid_sizes']))
+
+        return FusionPrefix(cat(self.vid), cat(self.vid_e), cat_kwargs(self.vid_kwargs),
+                            cat(self.audio), cat(self.audio_e), cat_kwargs(self.audio_kwargs),
+                            cat(self.self_attn_out))
+
+
+class StepCache:
+    """
+    TeaCache-style residual cache of the fusion block stack for one CFG branch.
+
+    The change indicator is the relative L1 change of the timestep-modulated input of the first
+    block of each tower (the larger of the two) since the previous call. It is accumulated over
+    calls, and while the sum stays below `threshold` the blocks are skipped and the residual of the
+    last computed call (block stack output - input) is added instead.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.prev_vid = None
+        self.prev_audio = None
+        self.accumulated = 0.
+        self.vid_residual = None
+        self.audio_residual = None
+        self.num_computed = 0
+        self.num_skipped = 0
+
+    def should_compute(self, vid_mod, audio_mod, group=None):
+        if self.prev_vid is None or self.vid_residual is None:
+            compute = True
+        else:
+            stats = torch.stack([
+                (vid_mod - self.prev_vid).abs().float().mean(), self.prev_vid.abs().float().mean(),
+                (audio_mod - self.prev_audio).abs().float().mean(), self.prev_audio.abs().float().mean(),
+            ])
+            if group is not None:
+                # every rank of the SP group holds a shard, they have to agree on skipping
+                dist.all_reduce(stats, group=group)
+            vid_change, audio_change = (stats[0] / stats[1]).item(), (stats[2] / stats[3]).item()
+            self.accumulated += max(vid_change, audio_change)
+            compute = self.accumulated >= self.threshold
+        self.prev_vid, self.prev_audio = vid_mod, audio_mod
+        if compute:
+            self.accumulated = 0.
+            self.num_computed += 1
+        else:
+            self.num_skipped += 1
+        return compute
+
+    def store(self, vid_residual, audio_residual):
+        self.vid_residual, self.audio_residual = vid_residual, audio_residual
+
+
 class FusionModel(nn.Module):
     def __init__(self, video_config=None, audio_config=None):
         super().__init__()
@@ -35,6 +140,9 @@ class FusionModel(nn.Module):
                 self.sp_rank = nccl_info.rank_within_group
             self.inject_cross_attention_kv_projections()
 
+        # set by the engine for sequential offload, see ovi.utils.offload_utils.BlockOffloader
+        self.block_offloader = None
+
         self.init_weights()
         
     def inject_cross_attention_kv_projections(self):
@@ -61,6 +169,7 @@ class FusionModel(nn.Module):
         freqs
         context
         context_lens
+        segments
         """
         merged_kwargs = {}
         for key in vid_kwargs:
@@ -79,15 +188,16 @@ class FusionModel(nn.Module):
                                             target_grid_sizes,
                                             target_freqs,
                                             context,
-                                            context_lens
+                                            context_lens,
+                                            context_kv=None
                                             ):
         b, n, d = src_seq.size(0), cross_attn_block.num_heads, cross_attn_block.head_dim
         if hasattr(cross_attn_block, "k_img"):
             ## means is i2v block
-            q, k, v, k_img, v_img = cross_attn_block.qkv_fn(src_seq, context)
+            q, k, v, k_img, v_img = cross_attn_block.qkv_fn(src_seq, context, context_kv)
         else:
             ## means is t2v block
-            q, k, v = cross_attn_block.qkv_fn(src_seq, context)
+            q, k, v = cross_attn_block.qkv_fn(src_seq, context, context_kv)
             k_img = v_img = None
 
         
@@ -100,10 +210,10 @@ class FusionModel(nn.Module):
             if v_img is not None:
                 v_img = torch.chunk(v_img, self.sp_size, dim=2)[self.sp_rank]
             
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = attention(q, k, v, k_lens=context_lens)
 
         if k_img is not None:
-            img_x = flash_attention(q, k_img, v_img, k_lens=None)
+            img_x = attention(q, k_img, v_img, k_lens=None)
             x = x + img_x
 
         is_vid = src_grid_sizes.shape[1] > 1
@@ -118,7 +228,7 @@ class FusionModel(nn.Module):
         q = rope_apply(q, src_grid_sizes, src_freqs)
         k_target = rope_apply(k_target, target_grid_sizes, target_freqs)
         
-        target_x = flash_attention(q, k_target, v_target, k_lens=target_seq_lens)
+        target_x = attention(q, k_target, v_target, k_lens=target_seq_lens)
         
         x = x + target_x
         if self.use_sp:
@@ -140,7 +250,9 @@ class FusionModel(nn.Module):
                                             target_freqs,
                                             context,
                                             context_lens,
-                                            src_e):
+                                            src_e,
+                                            context_kv=None,
+                                            src_segments=None):
         
         src_seq = src_seq + self.single_fusion_cross_attention_forward(attn_block.cross_attn,
                                                                        attn_block.norm3(src_seq),
@@ -151,57 +263,94 @@ class FusionModel(nn.Module):
                                                                        target_grid_sizes=target_grid_sizes,
                                                                        target_freqs=target_freqs,
                                                                        context=context,
-                                                                       context_lens=context_lens
+                                                                       context_lens=context_lens,
+                                                                       context_kv=context_kv
                                                                        )
-        y = attn_block.ffn(attn_block.norm2(src_seq).bfloat16() * (1 + src_e[4].squeeze(2)) + src_e[3].squeeze(2))
+        y = attn_block.ffn(modulate(attn_block.norm2(src_seq).bfloat16(), src_e[3].squeeze(2), src_e[4].squeeze(2), src_segments))
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            src_seq = src_seq + y * src_e[5].squeeze(2)
+            src_seq = gated_residual(src_seq, y, src_e[5].squeeze(2), src_segments)
         return src_seq
         
-    def single_fusion_block_forward(self,
-                                    vid_block,
-                                    audio_block,
-                                    vid,
-                                    audio,
-                                    vid_e,
-                                    vid_seq_lens,
-                                    vid_grid_sizes,
-                                    vid_freqs,
-                                    vid_context,
-                                    vid_context_lens,
-                                    audio_e,
-                                    audio_seq_lens,
-                                    audio_grid_sizes,
-                                    audio_freqs,
-                                    audio_context,
-                                    audio_context_lens
-                                    ):
+    def single_fusion_self_attention_forward(self,
+                                             vid_block,
+                                             audio_block,
+                                             vid,
+                                             audio,
+                                             vid_e,
+                                             vid_seq_lens,
+                                             vid_grid_sizes,
+                                             vid_freqs,
+                                             audio_e,
+                                             audio_seq_lens,
+                                             audio_grid_sizes,
+                                             audio_freqs,
+                                             vid_segments=None,
+                                             audio_segments=None,
+                                             **kwargs
+                                             ):
         ## audio modulation
         assert audio_e.dtype == torch.bfloat16
-        assert len(audio_e.shape) == 4 and audio_e.size(2) == 6 and audio_e.shape[1] == audio.shape[1], f"{audio_e.shape}, {audio.shape}"
+        assert len(audio_e.shape) == 4 and audio_e.size(2) == 6 and check_time_embedding(audio_e, audio, audio_segments), f"{audio_e.shape}, {audio.shape}"
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
             audio_e = audio_block.modulation(audio_e).chunk(6, dim=2)
         assert audio_e[0].dtype == torch.bfloat16
 
         # audio self-attention
         audio_y = audio_block.self_attn(
-            audio_block.norm1(audio).bfloat16() * (1 + audio_e[1].squeeze(2)) + audio_e[0].squeeze(2), audio_seq_lens, audio_grid_sizes,
+            modulate(audio_block.norm1(audio).bfloat16(), audio_e[0].squeeze(2), audio_e[1].squeeze(2), audio_segments), audio_seq_lens, audio_grid_sizes,
             audio_freqs)
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            audio = audio + audio_y * audio_e[2].squeeze(2)
+            audio = gated_residual(audio, audio_y, audio_e[2].squeeze(2), audio_segments)
 
         ## video modulation
-        assert len(vid_e.shape) == 4 and vid_e.size(2) == 6 and vid_e.shape[1] == vid.shape[1], f"{vid_e.shape}, {vid.shape}"
+        assert len(vid_e.shape) == 4 and vid_e.size(2) == 6 and check_time_embedding(vid_e, vid, vid_segments), f"{vid_e.shape}, {vid.shape}"
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
             vid_e = vid_block.modulation(vid_e).chunk(6, dim=2)
 
         # video self-attention
         vid_y = vid_block.self_attn(
-            vid_block.norm1(vid).bfloat16() * (1 + vid_e[1].squeeze(2)) + vid_e[0].squeeze(2), vid_seq_lens, vid_grid_sizes,
+            modulate(vid_block.norm1(vid).bfloat16(), vid_e[0].squeeze(2), vid_e[1].squeeze(2), vid_segments), vid_seq_lens, vid_grid_sizes,
             vid_freqs)
 
         with torch.amp.autocast('cuda', dtype=torch.bfloat16):
-            vid = vid + vid_y * vid_e[2].squeeze(2)
+            vid = gated_residual(vid, vid_y, vid_e[2].squeeze(2), vid_segments)
+
+        return vid, audio, vid_e, audio_e
+
+    def single_fusion_block_forward(self,
+                                    vid_block,
+                                    audio_block,
+                                    vid,
+                                    audio,
+                                    vid_e,
+                                    vid_seq_lens,
+                                    vid_grid_sizes,
+                                    vid_freqs,
+                                    vid_context,
+                                    vid_context_lens,
+                                    audio_e,
+                                    audio_seq_lens,
+                                    audio_grid_sizes,
+                                    audio_freqs,
+                                    audio_context,
+                                    audio_context_lens,
+                                    vid_context_kv=None,
+                                    audio_context_kv=None,
+                                    vid_segments=None,
+                                    audio_segments=None,
+                                    self_attn_out=None
+                                    ):
+        """
+        self_attn_out: precomputed result of single_fusion_self_attention_forward for these inputs
+                       (see FusionPrefix), only the text-dependent rest of the block runs.
+        """
+        if self_attn_out is None:
+            self_attn_out = self.single_fusion_self_attention_forward(
+                vid_block, audio_block, vid, audio,
+                vid_e, vid_seq_lens, vid_grid_sizes, vid_freqs,
+                audio_e, audio_seq_lens, audio_grid_sizes, audio_freqs,
+                vid_segments=vid_segments, audio_segments=audio_segments)
+        vid, audio, vid_e, audio_e = self_attn_out
 
         og_audio = audio
 
@@ -217,7 +366,9 @@ class FusionModel(nn.Module):
             vid_freqs,
             audio_context,
             audio_context_lens,
-            audio_e
+            audio_e,
+            context_kv=audio_context_kv,
+            src_segments=audio_segments
         )
 
         assert not torch.equal(og_audio, audio), "Audio should be changed after cross-attention!"
@@ -234,7 +385,9 @@ class FusionModel(nn.Module):
             audio_freqs,
             vid_context,
             vid_context_lens,
-            vid_e
+            vid_e,
+            context_kv=vid_context_kv,
+            src_segments=vid_segments
         )
 
         return vid, audio
@@ -252,45 +405,93 @@ class FusionModel(nn.Module):
         clip_fea_audio=None,
         y=None,
         first_frame_is_clean=False,
-        slg_layer=False
+        slg_layer=False,
+        text_cond=None,
+        step_cache=None,
+        prefix=None,
+        audio_clean_prefix=0
     ):  
+        """
+        text_cond: optional (vid_cond, audio_cond) pair from a FusionConditioningCache. When given,
+                   the cached projected context and per-block cross-attention k/v are used
+                   instead of recomputing them from vid_context/audio_context.
+        slg_layer: fusion block to skip (skip layer guidance), or a list with one entry per sample
+                   so that e.g. only the negative sample of a batched CFG pass skips it.
+        step_cache: optional StepCache of this CFG branch, the block stack is skipped and its cached
+                    residual reused while the first block input barely changes between calls.
+        prefix: optional FusionPrefix of vid/audio/t from forward_prefix, shared between CFG branches.
+                The embeddings and the first block's self-attention are taken from it.
+        first_frame_is_clean / audio_clean_prefix: number of leading video latent frames / audio
+                latent tokens that are clean conditioning (t=0), True counts as one frame.
+        """
 
         assert clip_fea is None 
         assert y is None
+        vid_cond, audio_cond = text_cond if text_cond is not None else (None, None)
 
         if vid is None or all([x is None for x in vid]):
+            assert self.block_offloader is None, "Sequential offload only supports the joint audio-video forward"
             assert vid_context is None
             assert vid_seq_len is None
             assert self.audio_model is not None
 
-            return None, self.audio_model(x=audio, t=t, context=audio_context, seq_len=audio_seq_len, clip_fea=clip_fea_audio, y=None)
+            return None, self.audio_model(x=audio, t=t, context=audio_context, seq_len=audio_seq_len, clip_fea=clip_fea_audio, y=None, text_cond=audio_cond)
         
         if audio is None or all([x is None for x in audio]):
+            assert self.block_offloader is None, "Sequential offload only supports the joint audio-video forward"
             assert clip_fea_audio is None
             assert audio_context is None
             assert audio_seq_len is None
             assert self.video_model is not None
 
-            return self.video_model(x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean), None
+            return self.video_model(x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean, text_cond=vid_cond), None
         
-        vid, vid_e, vid_kwargs = self.video_model.prepare_transformer_block_kwargs(
-            x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean
-        )
+        if prefix is not None:
+            vid, vid_e, vid_kwargs = prefix.vid, prefix.vid_e, dict(prefix.vid_kwargs)
+            audio, audio_e, audio_kwargs = prefix.audio, prefix.audio_e, dict(prefix.audio_kwargs)
+            vid_kwargs['context'] = vid_cond.context if vid_cond is not None else self.video_model.embed_context(vid_context, clip_fea)
+            audio_kwargs['context'] = audio_cond.context if audio_cond is not None else self.audio_model.embed_context(audio_context, clip_fea_audio)
+        else:
+            vid, vid_e, vid_kwargs = self.video_model.prepare_transformer_block_kwargs(
+                x=vid, t=t, context=vid_context, seq_len=vid_seq_len, clip_fea=clip_fea, y=y, first_frame_is_clean=first_frame_is_clean, text_cond=vid_cond
+            )
 
-        audio, audio_e, audio_kwargs = self.audio_model.prepare_transformer_block_kwargs(
-            x=audio, t=t, context=audio_context, seq_len=audio_seq_len, clip_fea=clip_fea_audio, y=None, first_frame_is_clean=False
-        )
+            audio, audio_e, audio_kwargs = self.audio_model.prepare_transformer_block_kwargs(
+                x=audio, t=t, context=audio_context, seq_len=audio_seq_len, clip_fea=clip_fea_audio, y=None, first_frame_is_clean=audio_clean_prefix, text_cond=audio_cond
+            )
 
         kwargs = self.merge_kwargs(vid_kwargs, audio_kwargs)
-
-        for i in range(self.num_blocks):
+        # blocks skipped by the whole batch are not run at all
+        run_blocks = [i for i in range(self.num_blocks) if self.slg_skip(slg_layer, i, vid.size(0)) is not True]
+
+        if step_cache is not None:
+            if self.block_offloader is not None:
+                self.block_offloader.acquire(0, next_block=run_blocks[1] if len(run_blocks) > 1 else 0)
+            compute = step_cache.should_compute(
+                self.first_block_input(self.video_model.blocks[0], vid, vid_e, vid_kwargs['segments']),
+                self.first_block_input(self.audio_model.blocks[0], audio, audio_e, audio_kwargs['segments']),
+                group=nccl_info.group if self.use_sp else None)
+            if not compute:
+                if self.block_offloader is not None:
+                    self.block_offloader.release(0)
+                vid = vid + step_cache.vid_residual
+                audio = audio + step_cache.audio_residual
+                vid = self.video_model.post_transformer_block_out(vid, vid_kwargs['grid_sizes'], vid_e, vid_kwargs['segments'])
+                audio = self.audio_model.post_transformer_block_out(audio, audio_kwargs['grid_sizes'], audio_e, audio_kwargs['segments'])
+                return vid, audio
+            vid_blocks_in, audio_blocks_in = vid, audio
+
+        for n, i in enumerate(run_blocks):
             """
             1 fusion block refers to 1 audio block with 1 video block.
             """
-            if slg_layer > 0 and i == slg_layer:
-                continue
+            skip = self.slg_skip(slg_layer, i, vid.size(0))
+            if self.block_offloader is not None:
+                # prefetch the next block that runs, past skipped ones, or block 0 of the next call
+                self.block_offloader.acquire(i, next_block=run_blocks[n + 1] if n + 1 < len(run_blocks) else 0)
             vid_block = self.video_model.blocks[i]
             audio_block = self.audio_model.blocks[i]
+            vid_in, audio_in = vid, audio
             vid, audio = gradient_checkpointing(
                     enabled=(self.training and self.gradient_checkpointing),
                     module=self.single_fusion_block_forward,
@@ -298,14 +499,65 @@ class FusionModel(nn.Module):
                     audio_block=audio_block,
                     vid=vid,
                     audio=audio,
+                    vid_context_kv=vid_cond.context_kv[i] if vid_cond is not None else None,
+                    audio_context_kv=audio_cond.context_kv[i] if audio_cond is not None else None,
+                    self_attn_out=prefix.self_attn_out if prefix is not None and i == 0 else None,
                     **kwargs
                 )
+            if self.block_offloader is not None:
+                self.block_offloader.release(i)
+            if skip is not None:
+                # mixed batch (e.g. batched CFG), samples skipping this block keep their input
+                skip = torch.tensor(skip, device=vid.device).view(-1, 1, 1)
+                vid = torch.where(skip, vid_in, vid)
+                audio = torch.where(skip, audio_in, audio)
+
+        if step_cache is not None:
+            step_cache.store(vid - vid_blocks_in, audio - audio_blocks_in)
 
-        vid = self.video_model.post_transformer_block_out(vid, vid_kwargs['grid_sizes'], vid_e)
-        audio = self.audio_model.post_transformer_block_out(audio, audio_kwargs['grid_sizes'], audio_e)
+        vid = self.video_model.post_transformer_block_out(vid, vid_kwargs['grid_sizes'], vid_e, vid_kwargs['segments'])
+        audio = self.audio_model.post_transformer_block_out(audio, audio_kwargs['grid_sizes'], audio_e, audio_kwargs['segments'])
 
         return vid, audio
 
+    @staticmethod
+    def slg_skip(slg_layer, i, batch_size):
+        """
+        Samples that skip block i under slg_layer: True for the whole batch, None for none of them,
+        otherwise a per-sample list (mixed batch, e.g. batched CFG).
+        """
+        if isinstance(slg_layer, (list, tuple)):
+            assert len(slg_layer) == batch_size, f"{len(slg_layer)} slg layers for batch of {batch_size}"
+            skip = [bool(s) and s > 0 and i == s for s in slg_layer]
+            if all(skip):
+                return True
+            return skip if any(skip) else None
+        return True if slg_layer and slg_layer > 0 and i == slg_layer else None
+
+    def forward_prefix(self, vid, audio, t, vid_seq_len, audio_seq_len, first_frame_is_clean=False, audio_clean_prefix=0):
+        """
+        The text-independent FusionPrefix of a joint forward over vid/audio at t.
+        """
+        vid, vid_e, vid_kwargs = self.video_model.prepare_transformer_block_kwargs(
+            x=vid, t=t, context=None, seq_len=vid_seq_len, first_frame_is_clean=first_frame_is_clean, text_cond=None
+        )
+        audio, audio_e, audio_kwargs = self.audio_model.prepare_transformer_block_kwargs(
+            x=audio, t=t, context=None, seq_len=audio_seq_len, first_frame_is_clean=audio_clean_prefix, text_cond=None
+        )
+
+        if self.block_offloader is not None:
+            # stays resident for the first branch's forward, which releases it
+            self.block_offloader.acquire(0)
+        self_attn_out = self.single_fusion_self_attention_forward(
+            self.video_model.blocks[0], self.audio_model.blocks[0], vid, audio, **self.merge_kwargs(vid_kwargs, audio_kwargs))
+        return FusionPrefix(vid, vid_e, vid_kwargs, audio, audio_e, audio_kwargs, self_attn_out)
+
+    def first_block_input(self, block, x, e, segments):
+        # timestep-modulated input of the first self-attention, the change indicator of StepCache
+        with torch.amp.autocast('cuda', dtype=torch.bfloat16):
+            e = block.modulation(e).chunk(6, dim=2)
+        return modulate(block.norm1(x).bfloat16(), e[0].squeeze(2), e[1].squeeze(2), segments)
+
     def init_weights(self):
         if self.audio_model is not None:
             self.audio_model.init_weights()
@@ -319,6 +571,33 @@ class FusionModel(nn.Module):
                     mod.weight.div_(10.0)
 
     
+    def build_conditioning_cache(self, branches, clip_fea=None, clip_fea_audio=None):
+        """
+        branches: dict of branch name -> (vid_context, audio_context), each a list of [L, C] text embeddings.
+        """
+        cache = FusionConditioningCache()
+        if self.block_offloader is not None:
+            # visit the offloaded block pairs once, in order, for all branches
+            contexts = {
+                branch: (self.video_model.embed_context(vid_context, clip_fea), self.audio_model.embed_context(audio_context, clip_fea_audio))
+                for branch, (vid_context, audio_context) in branches.items()
+            }
+            context_kv = {branch: ([], []) for branch in branches}
+            for i in range(self.num_blocks):
+                self.block_offloader.acquire(i)
+                for branch, (vid_context, audio_context) in contexts.items():
+                    context_kv[branch][0].append(self.video_model.blocks[i].cross_attn.context_kv_fn(vid_context))
+                    context_kv[branch][1].append(self.audio_model.blocks[i].cross_attn.context_kv_fn(audio_context))
+                self.block_offloader.release(i)
+            for branch, (vid_context, audio_context) in contexts.items():
+                cache.add(branch, TextConditioning(vid_context, context_kv[branch][0]), TextConditioning(audio_context, context_kv[branch][1]))
+            return cache
+        for branch, (vid_context, audio_context) in branches.items():
+            vid_cond = self.video_model.build_text_conditioning(vid_context, clip_fea) if self.video_model is not None else None
+            audio_cond = self.audio_model.build_text_conditioning(audio_context, clip_fea_audio) if self.audio_model is not None else None
+            cache.add(branch, vid_cond, audio_cond)
+        return cache
+
     def set_rope_params(self):
         self.video_model.set_rope_params()
         self.audio_model.set_rope_params()
\ No newline at end of file
@@ -8,7 +8,8 @@ import torch.nn.functional as F
 
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.models.modeling_utils import ModelMixin
-from .attention import flash_attention
+from .attention import attention
+from .sparse_attention import local_attention_3d
 from torch.utils.checkpoint import checkpoint
 from ovi.distributed_comms.communications import all_gather, all_to_all_4D
 from ovi.distributed_comms.parallel_states import nccl_info, get_sequence_parallel_state
@@ -34,6 +35,54 @@ def sinusoidal_embedding_1d(dim, position):
     return x
 
 
+def segmented(fn, xs, es, segments=None):
+    r"""
+    Apply fn(*xs, *es) where xs are per-token tensors [B, L, ...] and es hold one entry
+    per timestep segment [B, S, ...]. segments lists the token length of each segment
+    along L; when None, es already broadcast against xs (S == 1 or S == L).
+    """
+    if segments is None or len(segments) == 1:
+        return fn(*xs, *es)
+    xs = [u.split(segments, dim=1) for u in xs]
+    return torch.cat([
+        fn(*[u[j] for u in xs], *[v[:, j:j + 1] for v in es])
+        for j in range(len(segments))
+    ], dim=1)
+
+
+def modulate(x, shift, scale, segments=None):
+    return segmented(lambda x, shift, scale: x * (1 + scale) + shift, (x,), (shift, scale), segments)
+
+
+def gated_residual(x, y, gate, segments=None):
+    return segmented(lambda x, y, gate: x + y * gate, (x, y), (gate,), segments)
+
+
+def check_time_embedding(e, x, segments=None):
+    # e is either per token, shared by all tokens, or one entry per segment
+    if segments is not None:
+        return e.shape[1] == len(segments) and sum(segments) == x.shape[1]
+    return e.shape[1] in (1, x.shape[1])
+
+
+def shard_segments(segments, sp_rank, sp_size):
+    r"""
+    Restrict segments (covering the full, sp-padded sequence) to the chunk of this sp rank.
+    Returns the local segment lengths and the indices of the segments that are kept.
+    """
+    chunk = sum(segments) // sp_size
+    start, end = sp_rank * chunk, (sp_rank + 1) * chunk
+    local, keep = [], []
+    offset = 0
+    for j, n in enumerate(segments):
+        lo, hi = max(offset, start), min(offset + n, end)
+        if hi > lo:
+            local.append(hi - lo)
+            keep.append(j)
+        offset += n
+    return local, keep
+
+
 @amp.autocast('cuda', enabled=False)
 def rope_params(max_seq_len, dim, theta=10000, freqs_scaling=1.0):
     assert dim % 2 == 0
@@ -44,60 +93,87 @@ def rope_params(max_seq_len, dim, theta=10000, freqs_scaling=1.0):
     freqs = torch.polar(torch.ones_like(freqs), freqs)
     return freqs
 
+# cos/sin tables shared by every rope_apply call of a generation, see get_rope_tables
+_ROPE_TABLES = {}
+_ROPE_TABLES_MAX_ENTRIES = 16
+
+
+def clear_rope_cache():
+    _ROPE_TABLES.clear()
+
+
+@amp.autocast('cuda', enabled=False)
+def get_rope_tables(grid_sizes, freqs, seq_len, head_dim):
+    r"""
+    Real-valued rotation tables for rope_apply_tables.
+
+    Args:
+        grid_sizes(Tensor): Shape [B, 3] (F, H, W) for video or [B, 1] (L) for audio
+        freqs(Tensor): Complex rope freqs from rope_params, shape [1024, C_rope]
+        seq_len(int): Padded sequence length of the tensors the tables are applied to
+        head_dim(int): Head dim of q/k, dims beyond the rope freqs are passed through
+
+    Returns:
+        (cos, sin): fp32 tensors of shape [B, seq_len, 1, head_dim // 2]. Padding tokens and
+        pass-through dims get the identity rotation. The tables are cached on
+        (grid_sizes, seq_len, head_dim, freqs, device), so all blocks, q/k and steps share them.
+    """
+    key = (tuple(map(tuple, grid_sizes.tolist())), seq_len, head_dim, freqs.data_ptr(), str(freqs.device))
+    tables = _ROPE_TABLES.get(key)
+    if tables is not None:
+        return tables
+
+    b, c = grid_sizes.size(0), head_dim // 2
+    cos = torch.ones(b, seq_len, c, dtype=torch.float64, device=freqs.device)
+    sin = torch.zeros(b, seq_len, c, dtype=torch.float64, device=freqs.device)
+    if grid_sizes.shape[-1] == 3:
+        # split freqs
+        freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+        for i, (f, h, w) in enumerate(grid_sizes.tolist()):
+            n = f * h * w
+            freqs_i = torch.cat([
+                freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
+                freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+                freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
+            ],
+                                dim=-1).reshape(n, -1)
+            cos[i, :n] = freqs_i.real
+            sin[i, :n] = freqs_i.imag
+    else:
+        c_rope = freqs.shape[1]  # number of complex dims to rotate
+        assert c_rope <= c, "RoPE dimensions cannot exceed half of hidden size"
+        for i, (l, ) in enumerate(grid_sizes.tolist()):
+            cos[i, :l, :c_rope] = freqs[:l].real
+            sin[i, :l, :c_rope] = freqs[:l].imag
+
+    tables = (cos.float().unsqueeze(2), sin.float().unsqueeze(2))
+    if len(_ROPE_TABLES) >= _ROPE_TABLES_MAX_ENTRIES:
+        _ROPE_TABLES.pop(next(iter(_ROPE_TABLES)))
+    _ROPE_TABLES[key] = tables
+    return tables
+
+
+@amp.autocast('cuda', enabled=False)
+def rope_apply_tables(x, cos, sin):
+    r"""
+    Rotate x [B, L, N, D] by the tables of get_rope_tables, batched in fp32.
+    Equivalent to the complex product view_as_complex(x) * freqs.
+    """
+    b, s, n, _ = x.shape
+    x_r, x_i = x.float().reshape(b, s, n, -1, 2).unbind(-1)
+    x = torch.stack([x_r * cos - x_i * sin, x_r * sin + x_i * cos], dim=-1)
+    return x.flatten(3)
+
+
 @amp.autocast('cuda', enabled=False)
 def rope_apply_1d(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2 ## b l h d
-    c_rope = freqs.shape[1]  # number of complex dims to rotate
-    assert c_rope <= c, "RoPE dimensions cannot exceed half of hidden size"
-    
-    # loop over samples
-    output = []
-    for i, (l, ) in enumerate(grid_sizes.tolist()):
-        seq_len = l
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2)) # [l n d//2]
-        x_i_rope = x_i[:, :, :c_rope] * freqs[:seq_len, None, :]  # [L, N, c_rope]
-        x_i_passthrough = x_i[:, :, c_rope:]  # untouched dims
-        x_i = torch.cat([x_i_rope, x_i_passthrough], dim=2)
-
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
-
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).bfloat16()
+    cos, sin = get_rope_tables(grid_sizes, freqs, x.size(1), x.size(3))
+    return rope_apply_tables(x, cos, sin).bfloat16()
 
 @amp.autocast('cuda', enabled=False)
 def rope_apply_3d(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2
-
-    # split freqs
-    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
-    
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
-        freqs_i = torch.cat([
-            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ],
-                            dim=-1).reshape(seq_len, 1, -1)
-
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
-
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).bfloat16()
+    cos, sin = get_rope_tables(grid_sizes, freqs, x.size(1), x.size(3))
+    return rope_apply_tables(x, cos, sin).bfloat16()
 
 @amp.autocast('cuda', enabled=False)
 def rope_apply(x, grid_sizes, freqs):
@@ -219,6 +295,8 @@ class WanSelfAttention(nn.Module):
         self.o = nn.Linear(dim, dim)
         self.norm_q = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.norm_k = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
+        # SparseAttentionConfig for tiled local attention over video tokens, None for dense attention
+        self.sparse_attention = None
         # optional sequence parallelism
         # self.world_size = get_world_size()
         self.use_sp = get_sequence_parallel_state()
@@ -250,12 +328,18 @@ class WanSelfAttention(nn.Module):
             q = all_to_all_4D(q, scatter_dim=2, gather_dim=1)
             k = all_to_all_4D(k, scatter_dim=2, gather_dim=1)
             v = all_to_all_4D(v, scatter_dim=2, gather_dim=1) # [B, L, H/P, C/H]
-        x = flash_attention(
-            q=rope_apply(q, grid_sizes, freqs),
-            k=rope_apply(k, grid_sizes, freqs),
-            v=v,
-            k_lens=seq_lens,
-            window_size=self.window_size)
+        q = rope_apply(q, grid_sizes, freqs)
+        k = rope_apply(k, grid_sizes, freqs)
+        if self.sparse_attention is not None and grid_sizes.shape[1] == 3:
+            # heads are sharded under sp, every rank sees the whole token grid
+            x = local_attention_3d(q, k, v, grid_sizes, self.sparse_attention)
+        else:
+            x = attention(
+                q=q,
+                k=k,
+                v=v,
+                k_lens=seq_lens,
+                window_size=self.window_size)
         if self.use_sp: 
             # print(f"[DEBUG SP] Doing all to all to shard sequence")
             x = all_to_all_4D(x, scatter_dim=1, gather_dim=2) # [B, L/P, H, C/H]
@@ -266,27 +350,38 @@ class WanSelfAttention(nn.Module):
 
 
 class WanT2VCrossAttention(WanSelfAttention):
-    def qkv_fn(self, x, context):
+    def context_kv_fn(self, context):
+        b, n, d = context.size(0), self.num_heads, self.head_dim
+
+        # compute key, value, these only depend on the text context
+        k = self.norm_k(self.k(context)).view(b, -1, n, d)
+        v = self.v(context).view(b, -1, n, d)
+
+        return k, v
+
+    def qkv_fn(self, x, context, context_kv=None):
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        if context_kv is None:
+            context_kv = self.context_kv_fn(context)
+        k, v = context_kv
 
         return q, k, v
 
-    def forward(self, x, context, context_lens):
+    def forward(self, x, context, context_lens, context_kv=None):
         r"""
         Args:
             x(Tensor): Shape [B, L1, C]
             context(Tensor): Shape [B, L2, C]
             context_lens(Tensor): Shape [B]
+            context_kv(Tuple[Tensor], *optional*): Precomputed (k, v) of context, see TextConditioning
         """
-        q, k, v = self.qkv_fn(x, context)
+        q, k, v = self.qkv_fn(x, context, context_kv)
 
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = attention(q, k, v, k_lens=context_lens)
 
         # output
         x = x.flatten(2)
@@ -311,29 +406,40 @@ class WanI2VCrossAttention(WanSelfAttention):
         self.norm_k_img = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.additional_emb_length = additional_emb_length
 
-    def qkv_fn(self, x, context):
+    def context_kv_fn(self, context):
         context_img = context[:, : self.additional_emb_length]
         context = context[:, self.additional_emb_length :]
-        b, n, d = x.size(0), self.num_heads, self.head_dim
+        b, n, d = context.size(0), self.num_heads, self.head_dim
 
-        # compute query, key, value
-        q = self.norm_q(self.q(x)).view(b, -1, n, d)
+        # compute key, value for text and image context
         k = self.norm_k(self.k(context)).view(b, -1, n, d)
         v = self.v(context).view(b, -1, n, d)
         k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
         v_img = self.v_img(context_img).view(b, -1, n, d)
 
+        return k, v, k_img, v_img
+
+    def qkv_fn(self, x, context, context_kv=None):
+        b, n, d = x.size(0), self.num_heads, self.head_dim
+
+        # compute query, key, value
+        q = self.norm_q(self.q(x)).view(b, -1, n, d)
+        if context_kv is None:
+            context_kv = self.context_kv_fn(context)
+        k, v, k_img, v_img = context_kv
+
         return q, k, v, k_img, v_img
 
 
-    def forward(self, x, context, context_lens):
+    def forward(self, x, context, context_lens, context_kv=None):
         r"""
         Args:
             x(Tensor): Shape [B, L1, C]
             context(Tensor): Shape [B, L2, C]
             context_lens(Tensor): Shape [B]
+            context_kv(Tuple[Tensor], *optional*): Precomputed (k, v, k_img, v_img) of context, see TextConditioning
         """
-        q, k, v, k_img, v_img = self.qkv_fn(x, context)
+        q, k, v, k_img, v_img = self.qkv_fn(x, context, context_kv)
 
         if self.use_sp:
             # print(f"[DEBUG SP] Doing all to all to shard head")
@@ -345,9 +451,9 @@ class WanI2VCrossAttention(WanSelfAttention):
             
         # [B, L, H/P, C/H]
         # k_img: [B, L, H, C/H]
-        img_x = flash_attention(q, k_img, v_img, k_lens=None)
+        img_x = attention(q, k_img, v_img, k_lens=None)
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = attention(q, k, v, k_lens=context_lens)
         if self.use_sp: 
             # print(f"[DEBUG SP] Doing all to all to shard sequence")
             x = all_to_all_4D(x, scatter_dim=1, gather_dim=2) # [B, L/P, H, C/H]
@@ -436,35 +542,39 @@ class WanAttentionBlock(nn.Module):
         freqs,
         context,
         context_lens,
+        context_kv=None,
+        segments=None,
     ):
         r"""
         Args:
             x(Tensor): Shape [B, L, C]
-            e(Tensor): Shape [B, L1, 6, C]
+            e(Tensor): Shape [B, S, 6, C], S is 1, L or len(segments)
             seq_lens(Tensor): Shape [B], length of each sequence in batch
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
             freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            context_kv(Tuple[Tensor], *optional*): Cached cross-attention k/v of context for this block
+            segments(List[int], *optional*): Token length of each timestep segment of e
         """
         assert e.dtype == torch.bfloat16
-        assert len(e.shape) == 4 and e.size(2) == 6 and e.shape[1] == x.shape[1], f"{e.shape}, {x.shape}"
+        assert len(e.shape) == 4 and e.size(2) == 6 and check_time_embedding(e, x, segments), f"{e.shape}, {x.shape}"
         with amp.autocast('cuda', dtype=torch.bfloat16):
             e = self.modulation(e).chunk(6, dim=2)
         assert e[0].dtype == torch.bfloat16
 
         # self-attention
         y = self.self_attn(
-            self.norm1(x).bfloat16() * (1 + e[1].squeeze(2)) + e[0].squeeze(2),
+            modulate(self.norm1(x).bfloat16(), e[0].squeeze(2), e[1].squeeze(2), segments),
             seq_lens, grid_sizes, freqs)
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            x = x + y * e[2].squeeze(2)
+            x = gated_residual(x, y, e[2].squeeze(2), segments)
 
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
-            x = x + self.cross_attn(self.norm3(x), context, context_lens)
+            x = x + self.cross_attn(self.norm3(x), context, context_lens, context_kv)
             y = self.ffn(
-                self.norm2(x).bfloat16() * (1 + e[4].squeeze(2)) + e[3].squeeze(2))
+                modulate(self.norm2(x).bfloat16(), e[3].squeeze(2), e[4].squeeze(2), segments))
             with amp.autocast('cuda', dtype=torch.bfloat16):
-                x = x + y * e[5].squeeze(2)
+                x = gated_residual(x, y, e[5].squeeze(2), segments)
             return x
 
         x = cross_attn_ffn(x, context, context_lens, e)
@@ -488,20 +598,49 @@ class Head(nn.Module):
         # modulation
         self.modulation = nn.Parameter(torch.randn(1, 2, dim) / dim**0.5)
 
-    def forward(self, x, e):
+    def forward(self, x, e, segments=None):
         r"""
         Args:
             x(Tensor): Shape [B, L1, C]
-            e(Tensor): Shape [B, L, C]
+            e(Tensor): Shape [B, S, C], S is 1, L1 or len(segments)
+            segments(List[int], *optional*): Token length of each timestep segment of e
         """
         assert e.dtype == torch.bfloat16
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            e = (self.modulation.bfloat16().unsqueeze(0) + e.unsqueeze(2)).chunk(2, dim=2) # 1 1 2 D, B L 1 D -> B L 2 D -> 2 * (B L 1 D)
-            x = (self.head(self.norm(x) * (1 + e[1].squeeze(2)) + e[0].squeeze(2)))
+            e = (self.modulation.bfloat16().unsqueeze(0) + e.unsqueeze(2)).chunk(2, dim=2) # 1 1 2 D, B S 1 D -> B S 2 D -> 2 * (B S 1 D)
+            x = (self.head(modulate(self.norm(x), e[0].squeeze(2), e[1].squeeze(2), segments)))
         return x
 
 
 
+class TextConditioning:
+    r"""
+    Text conditioning of one WanModel for one batch of contexts (e.g. one CFG branch).
+
+    The context is fixed for a whole generation, so the text_embedding projection and the
+    cross-attention k/v of every block are computed once and reused at every sampling step.
+    """
+
+    def __init__(self, context, context_kv):
+        self.context = context          # [B, L2, C], output of text_embedding (+ img_emb)
+        self.context_kv = context_kv    # list over blocks of cross_attn.context_kv_fn(context)
+
+    def nbytes(self):
+        tensors = [self.context] + [u for kv in self.context_kv for u in kv]
+        return sum(u.numel() * u.element_size() for u in tensors)
+
+    @staticmethod
+    def cat(conds):
+        # batch the conditioning of several samples, e.g. requests joining one forward
+        context = torch.cat([c.context for c in conds])
+        context_kv = [tuple(torch.cat(parts) for parts in zip(*kvs)) for kvs in zip(*[c.context_kv for c in conds])]
+        return TextConditioning(context, context_kv)
+
+    def slice(self, start, end):
+        # samples start:end of a batched conditioning, as views
+        return TextConditioning(self.context[start:end], [tuple(u[start:end] for u in kv) for kv in self.context_kv])
+
+
 class MLPProj(torch.nn.Module):
 
     def __init__(self, in_dim, out_dim):
@@ -689,6 +828,36 @@ class WanModel(ModelMixin, ConfigMixin):
     def set_gradient_checkpointing(self, enable: bool):
         self.gradient_checkpointing = enable
 
+    def embed_context(self, context, clip_fea=None):
+        context = self.text_embedding(
+            torch.stack([
+                torch.cat(
+                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
+                for u in context
+            ]))
+
+        if clip_fea is not None:
+            context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
+            context = torch.concat([context_clip, context], dim=1)
+        return context
+
+    def build_text_conditioning(self, context, clip_fea=None):
+        r"""
+        Precompute the projected context and the per-block cross-attention k/v.
+
+        Args:
+            context (List[Tensor]):
+                List of text embeddings each with shape [L, C]
+            clip_fea (Tensor, *optional*):
+                CLIP image features for image-to-video mode
+
+        Returns:
+            TextConditioning
+        """
+        context = self.embed_context(context, clip_fea)
+        context_kv = [block.cross_attn.context_kv_fn(context) for block in self.blocks]
+        return TextConditioning(context, context_kv)
+
     def prepare_transformer_block_kwargs(
         self,
         x,
@@ -698,6 +867,7 @@ class WanModel(ModelMixin, ConfigMixin):
         clip_fea=None,
         y=None,
         first_frame_is_clean=False,
+        text_cond=None,
     ):
 
         # params
@@ -731,22 +901,34 @@ class WanModel(ModelMixin, ConfigMixin):
         ]) # single [B, L, C]
 
         # time embeddings
+        ## instead of one embedding per token, embed each distinct timestep once: e/e0 are
+        ## [B, S, ...] with S == 1 (shared by all tokens), S == len(segments) (contiguous
+        ## token ranges, see segmented()) or S == seq_len (per-token t given by the caller)
+        segments = None
         if t.dim() == 1:
-            if first_frame_is_clean:
+            # first_frame_is_clean may also be the number of clean leading frames (audio: tokens),
+            # e.g. the overlap with the previous window of a long generation
+            _first_images_seq_len = grid_sizes[:, 1:].prod(-1) * int(first_frame_is_clean)
+            if first_frame_is_clean and (_first_images_seq_len == _first_images_seq_len[0]).all():
+                # clean first frame(s) (t=0) followed by everything else (t), padding joins the last segment
+                _first = int(_first_images_seq_len[0])
+                segments = [_first, seq_len - _first]
+                t = torch.stack([torch.zeros_like(t), t], dim=1)
+            elif first_frame_is_clean:
+                # first frames differ in size across the batch, fall back to per-token timesteps
                 t = torch.ones((t.size(0), seq_len), device=t.device, dtype=t.dtype) * t.unsqueeze(1)
-                _first_images_seq_len = grid_sizes[:, 1:].prod(-1)
                 for i in range(t.size(0)):
                     t[i, :_first_images_seq_len[i]] = 0
-                # print(f"zeroing out first {_first_images_seq_len} from t: {t.shape}, {t}")
             else:
-                t = t.unsqueeze(1).expand(t.size(0), seq_len)
+                t = t.unsqueeze(1)
+        per_token = t.size(1) == seq_len and segments is None and seq_len > 1
         with amp.autocast('cuda', dtype=torch.bfloat16):
-            bt = t.size(0)
+            bt, st = t.shape
             t = t.flatten()
             e = self.time_embedding(
                 sinusoidal_embedding_1d(self.freq_dim,
-                                        t).unflatten(0, (bt, seq_len)).bfloat16())
-            e0 = self.time_projection(e).unflatten(2, (6, self.dim)) # [1, 26784, 6, 3072] - B, seq_len, 6, dim
+                                        t).unflatten(0, (bt, st)).bfloat16())
+            e0 = self.time_projection(e).unflatten(2, (6, self.dim)) # B, S, 6, dim
             assert e.dtype == torch.bfloat16 and e0.dtype == torch.bfloat16
 
         
@@ -762,35 +944,36 @@ class WanModel(ModelMixin, ConfigMixin):
                     dtype=x.dtype
                 )
                 x = torch.cat([x, padding], dim=1)
-                e_padding = torch.zeros(
-                    e.shape[0], pad_size, e.shape[2],
-                    device=e.device,
-                    dtype=e.dtype
-                )
-                e = torch.cat([e, e_padding], dim=1)
-                e0_padding = torch.zeros(
-                    e0.shape[0], pad_size, e0.shape[2], e0.shape[3],
-                    device=e0.device,
-                    dtype=e0.dtype
-                )
-                e0 = torch.cat([e0, e0_padding], dim=1)
+                if per_token:
+                    e_padding = torch.zeros(
+                        e.shape[0], pad_size, e.shape[2],
+                        device=e.device,
+                        dtype=e.dtype
+                    )
+                    e = torch.cat([e, e_padding], dim=1)
+                    e0_padding = torch.zeros(
+                        e0.shape[0], pad_size, e0.shape[2], e0.shape[3],
+                        device=e0.device,
+                        dtype=e0.dtype
+                    )
+                    e0 = torch.cat([e0, e0_padding], dim=1)
+                elif segments is not None:
+                    segments[-1] += pad_size
 
             x = torch.chunk(x, self.sp_size, dim=1)[self.sp_rank]
-            e = torch.chunk(e, self.sp_size, dim=1)[self.sp_rank]
-            e0 = torch.chunk(e0, self.sp_size, dim=1)[self.sp_rank] 
+            if per_token:
+                e = torch.chunk(e, self.sp_size, dim=1)[self.sp_rank]
+                e0 = torch.chunk(e0, self.sp_size, dim=1)[self.sp_rank] 
+            elif segments is not None:
+                segments, keep = shard_segments(segments, self.sp_rank, self.sp_size)
+                e, e0 = e[:, keep], e0[:, keep]
             
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
-
-        if clip_fea is not None:
-            context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
-            context = torch.concat([context_clip, context], dim=1)
+        if text_cond is not None:
+            context = text_cond.context
+        elif context is not None:
+            context = self.embed_context(context, clip_fea)
 
         # arguments
         kwargs = dict(
@@ -799,13 +982,14 @@ class WanModel(ModelMixin, ConfigMixin):
             grid_sizes=grid_sizes,
             freqs=self.freqs,
             context=context,
-            context_lens=context_lens)
+            context_lens=context_lens,
+            segments=segments)
 
         return x, e, kwargs
         
-    def post_transformer_block_out(self, x, grid_sizes, e):
+    def post_transformer_block_out(self, x, grid_sizes, e, segments=None):
         # head
-        x = self.head(x, e)
+        x = self.head(x, e, segments)
         if self.use_sp: 
             x = all_gather(x, dim=1)
         # unpatchify
@@ -830,7 +1014,8 @@ class WanModel(ModelMixin, ConfigMixin):
         seq_len,
         clip_fea=None,
         y=None,
-        first_frame_is_clean=False
+        first_frame_is_clean=False,
+        text_cond=None
     ):
         r"""
         Forward pass through the diffusion model
@@ -850,6 +1035,8 @@ class WanModel(ModelMixin, ConfigMixin):
                 CLIP image features for image-to-video mode
             y (List[Tensor], *optional*):
                 Conditional video inputs for image-to-video mode, same shape as x
+            text_cond (TextConditioning, *optional*):
+                Precomputed text conditioning from build_text_conditioning, replaces context
 
         Returns:
             List[Tensor]:
@@ -864,18 +1051,20 @@ class WanModel(ModelMixin, ConfigMixin):
             seq_len=seq_len,
             clip_fea=clip_fea,
             y=y,
-            first_frame_is_clean=first_frame_is_clean
+            first_frame_is_clean=first_frame_is_clean,
+            text_cond=text_cond
         )
 
-        for block in self.blocks:
+        for i, block in enumerate(self.blocks):
             x = gradient_checkpointing(
                     enabled=(self.training and self.gradient_checkpointing),
                     module=block,
                     x=x,
+                    context_kv=text_cond.context_kv[i] if text_cond is not None else None,
                     **kwargs
                 )
 
-        return self.post_transformer_block_out(x, kwargs['grid_sizes'], e)
+        return self.post_transformer_block_out(x, kwargs['grid_sizes'], e, kwargs['segments'])
 
     def unpatchify(self, x, grid_sizes):
         r"""
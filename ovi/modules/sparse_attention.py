@@ -0,0 +1,183 @@
+import copy
+
+import torch
+
+from ovi.modules.attention import attention
+
+__all__ = [
+    'SparseAttentionConfig',
+    'get_tile_layout',
+    'clear_tile_layouts',
+    'local_attention_3d',
+    'local_attention_mask',
+    'local_attention_3d_reference',
+]
+
+# upper bound of the key/value tiles gathered per chunk of query tiles
+SPARSE_ATTENTION_CHUNK_BYTES = 1024 * 1024 * 1024
+# gather indices shared by every block and step of a generation, see get_tile_layout
+_TILE_LAYOUTS = {}
+_TILE_LAYOUTS_MAX_ENTRIES = 16
+
+
+class SparseAttentionConfig:
+    """
+    Spatio-temporal local attention for the video self-attention.
+
+    The (F, H, W) grid of latent tokens is cut into tiles of `tile` tokens. The queries of a tile
+    attend to the box of tiles within `radius` tiles along each axis, plus every token of the first
+    `global_frames` latent frames. The engine sets global_frames per batch to its clean prefix (the
+    i2v first frame or the overlap of a sliding window), see with_global_frames. `blocks` are the
+    video block indices that use it, None for all. The first dense_first_steps and the last
+    dense_last_steps sampling steps run dense attention.
+    """
+
+    def __init__(self, tile=(4, 8, 8), radius=(1, 1, 1), global_frames=0, blocks=None,
+                 dense_first_steps=5, dense_last_steps=5):
+        self.tile = tuple(int(t) for t in tile)
+        self.radius = tuple(int(r) for r in radius)
+        assert len(self.tile) == 3 and min(self.tile) > 0, f"tile must be 3 positive sizes, got {tile}"
+        assert len(self.radius) == 3 and min(self.radius) >= 0, f"radius must be 3 sizes >= 0, got {radius}"
+        self.global_frames = int(global_frames)
+        self.blocks = None if blocks is None else frozenset(int(i) for i in blocks)
+        self.dense_first_steps = int(dense_first_steps)
+        self.dense_last_steps = int(dense_last_steps)
+
+    def uses_block(self, i):
+        return self.blocks is None or i in self.blocks
+
+    def is_sparse_step(self, step, num_steps):
+        return self.dense_first_steps <= step < num_steps - self.dense_last_steps
+
+    def with_global_frames(self, global_frames):
+        if global_frames == self.global_frames:
+            return self
+        config = copy.copy(self)
+        config.global_frames = int(global_frames)
+        return config
+
+    def __repr__(self):
+        blocks = "all" if self.blocks is None else sorted(self.blocks)
+        return (f"SparseAttentionConfig(tile={self.tile}, radius={self.radius}, global_frames={self.global_frames}, "
+                f"blocks={blocks}, dense_first_steps={self.dense_first_steps}, dense_last_steps={self.dense_last_steps})")
+
+
+def _tile_keys(tokens, f0, h0, w0, config):
+    # box of neighbouring tiles, then the global frames in front of it
+    (tf, th, tw), (rf, rh, rw) = config.tile, config.radius
+    first_frame = max(0, f0 - rf * tf)
+    keys = tokens[first_frame:f0 + (rf + 1) * tf,
+                  max(0, h0 - rh * th):h0 + (rh + 1) * th,
+                  max(0, w0 - rw * tw):w0 + (rw + 1) * tw].flatten()
+    num_global = min(config.global_frames, first_frame)
+    if num_global > 0:
+        keys = torch.cat([tokens[:num_global].flatten(), keys])
+    return keys
+
+
+def get_tile_layout(grid, config, device):
+    r"""
+    Gather indices of the local attention over one (F, H, W) token grid.
+
+    Returns:
+        (q_index, q_lens, k_index, k_lens): q_index [T, Mq] and k_index [T, Mk] hold the token
+        indices of the queries and keys of each of the T query tiles, padded with 0 up to the
+        largest tile; q_lens, k_lens [T] are host int32. Cached on (grid, config, device).
+    """
+    grid = tuple(int(s) for s in grid)
+    key = (grid, config.tile, config.radius, config.global_frames, str(device))
+    layout = _TILE_LAYOUTS.get(key)
+    if layout is not None:
+        return layout
+
+    f, h, w = grid
+    tf, th, tw = config.tile
+    tokens = torch.arange(f * h * w).view(f, h, w)
+    q_tiles, k_tiles = [], []
+    for f0 in range(0, f, tf):
+        for h0 in range(0, h, th):
+            for w0 in range(0, w, tw):
+                q_tiles.append(tokens[f0:f0 + tf, h0:h0 + th, w0:w0 + tw].flatten())
+                k_tiles.append(_tile_keys(tokens, f0, h0, w0, config))
+
+    def pad(tiles):
+        lens = torch.tensor([len(t) for t in tiles], dtype=torch.int32)
+        return torch.nn.utils.rnn.pad_sequence(tiles, batch_first=True).to(device), lens
+
+    layout = (*pad(q_tiles), *pad(k_tiles))
+    if len(_TILE_LAYOUTS) >= _TILE_LAYOUTS_MAX_ENTRIES:
+        _TILE_LAYOUTS.pop(next(iter(_TILE_LAYOUTS)))
+    _TILE_LAYOUTS[key] = layout
+    return layout
+
+
+def clear_tile_layouts():
+    _TILE_LAYOUTS.clear()
+
+
+def local_attention_3d(q, k, v, grid_sizes, config, dtype=torch.bfloat16):
+    r"""
+    Tiled local attention of video tokens.
+
+    Args:
+        q, k, v(Tensor): Shape [B, L, N, C], rope already applied, L >= F * H * W
+        grid_sizes(Tensor): Shape [B, 3], the (F, H, W) token grid of each sample
+        config(SparseAttentionConfig): tile, radius and global frames
+
+    Returns:
+        [B, L, N, C]; tokens beyond F * H * W are zero. The query tiles are batched through
+        attention() with their padded lens, so this runs on whichever backend it selects: flash
+        varlen (fa3 / fa2) or sdpa on cuda, the chunked fp32 math backend on cpu.
+    """
+    out = torch.zeros_like(q)
+    for b, grid in enumerate(grid_sizes.tolist()):
+        q_index, q_lens, k_index, k_lens = get_tile_layout(grid, config, q.device)
+        q_valid = torch.arange(q_index.size(1), device=q.device) < q_lens.to(q.device).unsqueeze(1)
+        # bound the memory of the gathered keys and values
+        bytes_per_tile = 2 * k_index.size(1) * k.size(2) * k.size(3) * k.element_size()
+        chunk = max(1, SPARSE_ATTENTION_CHUNK_BYTES // bytes_per_tile)
+        for start in range(0, q_index.size(0), chunk):
+            end = start + chunk
+            x = attention(
+                q=q[b][q_index[start:end]],
+                k=k[b][k_index[start:end]],
+                v=v[b][k_index[start:end]],
+                q_lens=q_lens[start:end],
+                k_lens=k_lens[start:end],
+                dtype=dtype)
+            valid = q_valid[start:end]
+            out[b].index_copy_(0, q_index[start:end][valid], x[valid].to(out.dtype))
+    return out
+
+
+def local_attention_mask(grid, config, device=None):
+    """
+    Boolean [n, n] mask of the local attention over one (F, H, W) grid, True where query i attends
+    to key j. Materializes n^2 entries, for checking local_attention_3d on small grids.
+    """
+    f, h, w = (int(s) for s in grid)
+    tf, th, tw = config.tile
+    tokens = torch.arange(f * h * w).view(f, h, w)
+    mask = torch.zeros(f * h * w, f * h * w, dtype=torch.bool)
+    for f0 in range(0, f, tf):
+        for h0 in range(0, h, th):
+            for w0 in range(0, w, tw):
+                queries = tokens[f0:f0 + tf, h0:h0 + th, w0:w0 + tw].flatten()
+                mask[queries.unsqueeze(1), _tile_keys(tokens, f0, h0, w0, config).unsqueeze(0)] = True
+    return mask.to(device)
+
+
+def local_attention_3d_reference(q, k, v, grid_sizes, config):
+    """
+    Reference of local_attention_3d: fp32 attention of every sample with the explicit
+    local_attention_mask. Runs on any device.
+    """
+    out = torch.zeros_like(q)
+    scale = q.size(-1)**-0.5
+    for b, grid in enumerate(grid_sizes.tolist()):
+        n = grid[0] * grid[1] * grid[2]
+        q_b, k_b, v_b = (u[b, :n].transpose(0, 1).float() for u in (q, k, v))
+        scores = torch.matmul(q_b, k_b.transpose(-1, -2)).mul_(scale)
+        scores.masked_fill_(~local_attention_mask(grid, config, q.device), float('-inf'))
+        out[b, :n] = torch.matmul(scores.softmax(dim=-1), v_b).transpose(0, 1).to(out.dtype)
+    return out
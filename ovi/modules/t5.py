@@ -220,6 +220,10 @@ class T5CrossAttention(nn.Module):
 
 class T5RelativeEmbedding(nn.Module):
 
+    # square biases of these lengths are kept between calls, [1, N, L, L] per layer in the
+    # dtype of the embedding table (the model's); set to the tokenizer's buckets by T5EncoderModel
+    cached_lens = frozenset()
+
     def __init__(self, num_buckets, num_heads, bidirectional, max_dist=128):
         super(T5RelativeEmbedding, self).__init__()
         self.num_buckets = num_buckets
@@ -229,8 +233,23 @@ class T5RelativeEmbedding(nn.Module):
 
         # layers
         self.embedding = nn.Embedding(num_buckets, num_heads)
+        # length -> bias, only valid for the current weights and device
+        self.bias_cache = {}
+
+    def _apply(self, *args, **kwargs):
+        # cached biases would stay behind on the old device (e.g. cpu offload) or dtype
+        self.bias_cache.clear()
+        return super(T5RelativeEmbedding, self)._apply(*args, **kwargs)
 
     def forward(self, lq, lk):
+        if self.training or torch.is_grad_enabled() or lq != lk or lq not in self.cached_lens:
+            return self._forward(lq, lk)
+        bias = self.bias_cache.get(lq)
+        if bias is None:
+            bias = self.bias_cache[lq] = self._forward(lq, lk)
+        return bias
+
+    def _forward(self, lq, lk):
         device = self.embedding.weight.device
         # rel_pos = torch.arange(lk).unsqueeze(0).to(device) - \
         #     torch.arange(lq).unsqueeze(1).to(device)
@@ -501,8 +520,24 @@ class T5EncoderModel:
         elif not cpu_offload:
             self.model.to(self.device)
         # init tokenizer
+        # padding keys are masked out, so shorter padding gives the same trimmed outputs
         self.tokenizer = HuggingfaceTokenizer(
-            name=tokenizer_path, seq_len=text_len, clean='whitespace')
+            name=tokenizer_path, seq_len=text_len, clean='whitespace', buckets=(64, 128, 256))
+        # only the short buckets, a full text_len bias of umt5-xxl is 32 MB per layer
+        for m in self.model.modules():
+            if isinstance(m, T5RelativeEmbedding):
+                m.cached_lens = frozenset(b for b in self.tokenizer.buckets if b <= 256)
+
+    def clear_bias_cache(self):
+        if self.model is None:
+            return
+        for m in self.model.modules():
+            if isinstance(m, T5RelativeEmbedding):
+                m.bias_cache.clear()
+
+    def normalize(self, text):
+        # texts that normalize to the same string get identical embeddings
+        return self.tokenizer._clean(text)
 
     def __call__(self, texts, device):
         ids, mask = self.tokenizer(
@@ -36,11 +36,13 @@ def canonicalize(text, keep_punctuation_exact_string=None):
 
 class HuggingfaceTokenizer:
 
-    def __init__(self, name, seq_len=None, clean=None, **kwargs):
+    def __init__(self, name, seq_len=None, clean=None, buckets=None, **kwargs):
         assert clean in (None, 'whitespace', 'lower', 'canonicalize')
         self.name = name
         self.seq_len = seq_len
         self.clean = clean
+        # pad to the longest sequence rounded up to one of these lengths instead of seq_len
+        self.buckets = sorted(set(b for b in buckets if b < seq_len) | {seq_len}) if buckets and seq_len else None
 
         # init tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(name, **kwargs)
@@ -64,6 +66,9 @@ class HuggingfaceTokenizer:
             sequence = [sequence]
         if self.clean:
             sequence = [self._clean(u) for u in sequence]
+        if self.buckets is not None and _kwargs.get('padding') == 'max_length':
+            lengths = self.tokenizer(sequence, truncation=True, max_length=self.seq_len, return_length=True)['length']
+            _kwargs['max_length'] = next(b for b in self.buckets if b >= max(lengths))
         ids = self.tokenizer(sequence, **_kwargs)
 
         # output
@@ -774,6 +774,9 @@ class WanVAE_(nn.Module):
             self.temperal_upsample,
             dropout,
         )
+        # number of causal convs is fixed, size the feature caches once
+        self._conv_num = count_conv3d(self.decoder)
+        self._enc_conv_num = count_conv3d(self.encoder)
 
     def forward(self, x, scale=[0, 1]):
         mu = self.encode(x, scale)
@@ -809,33 +812,54 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
-    def decode(self, z, scale):
-        self.clear_cache()
-        if isinstance(scale[0], torch.Tensor):
-            z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
-                1, self.z_dim, 1, 1, 1)
-        else:
-            z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
-        x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx,
-                    first_chunk=True,
-                )
+    def decoded_shape(self, z):
+        # z: [b,c,t,h,w] -> shape of the decoded, unpatchified video
+        b, _, t, h, w = z.shape
+        t_scale = 2**sum(self.temperal_upsample)
+        s_scale = 2**(len(self.dim_mult) - 1) * 2
+        return (b, 3, 1 + t_scale * (t - 1), h * s_scale, w * s_scale)
+
+    def decode_stream(self, z, scale):
+        """
+        Yields decoded (unpatchified) frame chunks [b,3,f,H,W] as soon as each latent frame is
+        decoded, 1 frame for the first latent and 4 for every following one. The feature cache is
+        local to the generator, so several streams can be interleaved.
+        z is a latent tensor [b,c,t,h,w] or an iterable of such chunks along t, decoded as one
+        causal sequence, e.g. the windows of a long generation as they are sampled.
+        """
+        chunks = [z] if isinstance(z, torch.Tensor) else z
+        feat_map = [None] * self._conv_num
+        first_chunk = True
+        for z in chunks:
+            if isinstance(scale[0], torch.Tensor):
+                z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
+                    1, self.z_dim, 1, 1, 1)
             else:
-                out_ = self.decoder(
+                z = z / scale[1] + scale[0]
+            x = self.conv2(z)
+            for i in range(z.shape[2]):
+                conv_idx = [0]
+                out = self.decoder(
                     x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx,
+                    feat_cache=feat_map,
+                    feat_idx=conv_idx,
+                    first_chunk=first_chunk,
                 )
-                out = torch.cat([out, out_], 2)
-        out = unpatchify(out, patch_size=2)
-        self.clear_cache()
+                first_chunk = False
+                yield unpatchify(out, patch_size=2)
+
+    def decode(self, z, scale, out=None):
+        """
+        Decode the full clip into `out` (allocated if not given, shape from decoded_shape)
+        instead of concatenating the chunks.
+        """
+        offset = 0
+        for chunk in self.decode_stream(z, scale):
+            if out is None:
+                out = chunk.new_empty(self.decoded_shape(z))
+            out[:, :, offset:offset + chunk.shape[2]] = chunk
+            offset += chunk.shape[2]
+        assert offset == out.shape[2], f"Decoded {offset} frames into a buffer of {out.shape[2]}"
         return out
 
     def reparameterize(self, mu, log_var):
@@ -851,11 +875,9 @@ class WanVAE_(nn.Module):
         return mu + std * torch.randn_like(std)
 
     def clear_cache(self):
-        self._conv_num = count_conv3d(self.decoder)
         self._conv_idx = [0]
         self._feat_map = [None] * self._conv_num
         # cache encode
-        self._enc_conv_num = count_conv3d(self.encoder)
         self._enc_conv_idx = [0]
         self._enc_feat_map = [None] * self._enc_conv_num
 
@@ -1054,13 +1076,28 @@ class Wan2_2_VAE:
         try:
             if not isinstance(zs, torch.Tensor):
                 raise TypeError("zs should be a torch.Tensor")
+            # decode straight into a float32 buffer, no concatenation or full-clip dtype copy
+            out = torch.empty(self.model.decoded_shape(zs), dtype=torch.float32, device=zs.device)
             with amp.autocast('cuda', dtype=self.dtype):
-                return self.model.decode(zs, self.scale).float().clamp_(-1,
-                                                                 1)
+                return self.model.decode(zs, self.scale, out=out).clamp_(-1, 1)
 
         except TypeError as e:
             logging.info(e)
             return None
+
+    def wrapped_decode_stream(self, zs):
+        """
+        Yields float32 frame chunks [b,3,f,H,W] clamped to [-1, 1] while later frames are still
+        decoding. Autocast is entered per chunk so it does not leak into the consumer between yields.
+        zs may also be an iterable of latent chunks along t, see WanVAE_.decode_stream.
+        """
+        stream = self.model.decode_stream(zs, self.scale)
+        while True:
+            with amp.autocast('cuda', dtype=self.dtype):
+                chunk = next(stream, None)
+            if chunk is None:
+                return
+            yield chunk.float().clamp_(-1, 1)
         
     def wrapped_encode(self, video):
         try:
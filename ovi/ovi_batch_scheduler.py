@@ -0,0 +1,295 @@
+import time
+import queue
+import logging
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+from ovi.distributed_comms.parallel_states import get_sequence_parallel_state
+from ovi.modules.fusion import FusionConditioningCache
+from ovi.modules.model import TextConditioning
+from ovi.ovi_fusion_engine import GenerationRequest
+from ovi.utils.checkpoint_utils import load_scheduler_state
+
+
+class ActiveSample:
+    """
+    A request admitted to the running batch, at its own step of its own schedule.
+    """
+
+    def __init__(self, request, future, schedulers, cond):
+        self.request = request
+        self.future = future
+        self.scheduler_video, self.timesteps_video, self.scheduler_audio, self.timesteps_audio = schedulers
+        self.cond = cond                # FusionConditioningCache of this request alone, 'pos' and 'neg',
+                                        # dropped once it is part of its cohort's conditioning
+        self.step = 0
+        self.admitted_at = time.time()
+
+    @property
+    def done(self):
+        return self.step >= len(self.timesteps_video)
+
+
+class ContinuousBatchingScheduler:
+    """
+    Iteration-level batching around an OviFusionEngine.
+
+    Requests are grouped in cohorts of equal latent shape, i2v mode and clean prefix lengths, the
+    only properties that have to match within one fusion forward. Every step, one cohort (round robin) runs a single
+    guided evaluation for all its samples, each at its own timestep, then every sample advances its
+    own scheduler. Between steps new requests are admitted into their cohort and finished ones are
+    decoded and retired, so a request never waits for the slowest member of a static batch.
+
+    Usage:
+        scheduler = ContinuousBatchingScheduler(engine).start()
+        video, audio, image = scheduler.submit(dict(text_prompt=..., ...)).result()
+    """
+
+    def __init__(self, engine, max_batch_size=None, output_type="uint8"):
+        assert not engine.cpu_offload, "Continuous batching keeps all models resident, it does not support cpu_offload"
+        # admission depends on request arrival timing, the ranks of an sp group would form different
+        # cohorts and issue mismatched collectives
+        assert not get_sequence_parallel_state(), "Continuous batching does not support sequence parallelism"
+        self.engine = engine
+        self.max_batch_size = max_batch_size or engine.max_batch_size
+        self.output_type = output_type
+        self.queue = queue.Queue()
+        self.waiting = deque()          # prepared samples whose cohort is full
+        self.cohorts = {}               # cohort_key -> list of ActiveSample
+        self.cohort_conds = {}          # cohort_key -> (samples, FusionConditioningCache)
+        self.next_cohort = 0
+        self.num_steps = 0
+        self.num_sample_steps = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(self, request):
+        """
+        Queue a GenerationRequest (or dict of generate() arguments), returns a Future of (video, audio, image).
+        """
+        if not isinstance(request, GenerationRequest):
+            request = GenerationRequest(**request)
+        future = Future()
+        self.queue.put((request, future))
+        return future
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ovi-batch-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop after the current step. Requests that are still queued, waiting or being sampled fail
+        with a RuntimeError instead of leaving their futures pending.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        error = RuntimeError("ContinuousBatchingScheduler was stopped before the request finished")
+        futures = [sample.future for sample in self.waiting]
+        futures += [sample.future for samples in self.cohorts.values() for sample in samples]
+        while True:
+            try:
+                futures.append(self.queue.get_nowait()[1])
+            except queue.Empty:
+                break
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+        self.waiting.clear()
+        self.cohorts.clear()
+        self.cohort_conds.clear()
+
+    @staticmethod
+    def cohort_key(engine, request):
+        # properties that have to match within one fusion forward
+        return (request.latent_hw, request.is_i2v, engine.clean_prefix_lengths([request]))
+
+    @torch.inference_mode()
+    def run(self):
+        if isinstance(self.engine.device, int) and torch.cuda.is_available():
+            torch.cuda.set_device(self.engine.device)
+        while not self._stop.is_set():
+            self.admit(block=not self.cohorts)
+            if not self.cohorts:
+                continue
+            keys = list(self.cohorts)
+            key = keys[self.next_cohort % len(keys)]
+            self.next_cohort += 1
+            try:
+                self.step(key)
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                for sample in self.cohorts.pop(key):
+                    sample.future.set_exception(e)
+                self.cohort_conds.pop(key, None)
+            self.retire(key)
+
+    def admit(self, block=False):
+        new = []
+        try:
+            new.append(self.queue.get(timeout=0.1) if block else self.queue.get_nowait())
+            while True:
+                new.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if new:
+            for sample in self.prepare(new):
+                if sample.done:
+                    # resumed from a snapshot of the last step, nothing left to sample
+                    self.finish(sample)
+                else:
+                    self.waiting.append(sample)
+
+        # FIFO per cohort, a full cohort does not block requests of other cohorts
+        still_waiting = deque()
+        while self.waiting:
+            sample = self.waiting.popleft()
+            key = self.cohort_key(self.engine, sample.request)
+            cohort = self.cohorts.setdefault(key, [])
+            if len(cohort) < self.max_batch_size:
+                cohort.append(sample)
+            else:
+                still_waiting.append(sample)
+        self.waiting = still_waiting
+
+    def prepare(self, new):
+        # a request that fails to prepare fails its own future only, see OviFusionEngine.run_isolated
+        engine = self.engine
+        requests = [request for request, _ in new]
+        futures = {id(request): future for request, future in new}
+        samples = []
+
+        def prepare_sample(requests):
+            request, = requests
+            engine.init_noise(request)
+            schedulers = []
+            for _ in ("video", "audio"):
+                schedulers += engine.get_scheduler_time_steps(
+                    sampling_steps=request.sample_steps,
+                    device=engine.device,
+                    solver_name=request.solver_name,
+                    shift=request.shift
+                )
+            if request.checkpoint is not None:
+                # resumed latents, continue their schedule where the snapshot left off
+                load_scheduler_state(schedulers[0], request.checkpoint["scheduler_video"], engine.device)
+                load_scheduler_state(schedulers[2], request.checkpoint["scheduler_audio"], engine.device)
+                request.checkpoint = None
+            pos, video_neg, audio_neg = request.text_embeddings
+            cond = engine.model.build_conditioning_cache({
+                'pos': ([pos], [pos]),
+                'neg': ([video_neg], [audio_neg]),
+            })
+            sample = ActiveSample(request, futures[id(request)], schedulers, cond)
+            sample.step = request.start_step
+            samples.append(sample)
+
+        for request in requests:
+            engine.run_isolated(lambda rs: engine.prepare_request(rs[0]), [request])
+        engine.run_isolated(engine.encode_text, requests)
+        engine.run_isolated(engine.encode_first_frames, requests)
+        with torch.amp.autocast('cuda', enabled=engine.target_dtype != torch.float32, dtype=engine.target_dtype):
+            for request in requests:
+                engine.run_isolated(prepare_sample, [request])
+
+        for request, future in new:
+            if request.error is not None:
+                future.set_exception(request.error)
+        return samples
+
+    def sample_conditioning(self, key, sample):
+        # (pos, neg) tower pairs of one sample: its own cache until it joined its cohort's, then its rows there
+        if sample.cond is not None:
+            return sample.cond['pos'], sample.cond['neg']
+        members, cache = self.cohort_conds[key]
+        i, n = members.index(sample), len(members)
+        if self.engine.batched_cfg:
+            return tuple(c.slice(i, i + 1) for c in cache['cfg']), tuple(c.slice(n + i, n + i + 1) for c in cache['cfg'])
+        return tuple(c.slice(i, i + 1) for c in cache['pos']), tuple(c.slice(i, i + 1) for c in cache['neg'])
+
+    def cohort_conditioning(self, key, samples):
+        # concatenated per-request conditioning, rebuilt only when the cohort membership changes
+        cached = self.cohort_conds.get(key)
+        if cached is not None and cached[0] == tuple(samples):
+            return cached[1]
+
+        def cat(conds, tower):
+            return TextConditioning.cat([c[tower] for c in conds])
+
+        pos, neg = zip(*[self.sample_conditioning(key, s) for s in samples])
+        pos, neg = list(pos), list(neg)
+        cache = FusionConditioningCache()
+        if self.engine.batched_cfg:
+            cache.add('cfg', cat(pos + neg, 0), cat(pos + neg, 1))
+        else:
+            cache.add('pos', cat(pos, 0), cat(pos, 1))
+            cache.add('neg', cat(neg, 0), cat(neg, 1))
+        self.cohort_conds[key] = (tuple(samples), cache)
+        # the cross-attention k/v of every block is held once, in the cohort's cache
+        for sample in samples:
+            sample.cond = None
+        return cache
+
+    def step(self, key):
+        engine = self.engine
+        samples = self.cohorts[key]
+        # done samples are retired right after their last step or, if resumed done, at admission
+        assert samples and not any(s.done for s in samples), "cohort without a step left to sample"
+        requests = [s.request for s in samples]
+        video_noise = [r.video_noise for r in requests]
+        audio_noise = [r.audio_noise for r in requests]
+        # every sample is at its own step of its own schedule
+        timestep_input = torch.stack([s.timesteps_video[s.step] for s in samples]).to(engine.device)
+
+        with torch.amp.autocast('cuda', enabled=engine.target_dtype != torch.float32, dtype=engine.target_dtype):
+            cond_cache = self.cohort_conditioning(key, samples)
+            engine.set_sparse_attention_steps(requests, [s.step for s in samples])
+            pred_video_guided, pred_audio_guided = engine.guided_predictions(
+                requests, video_noise, audio_noise, timestep_input, cond_cache)
+
+            for sample, r, pred_video, pred_audio in zip(samples, requests, pred_video_guided, pred_audio_guided):
+                r.video_noise = sample.scheduler_video.step(
+                    pred_video.unsqueeze(0), sample.timesteps_video[sample.step], r.video_noise.unsqueeze(0), return_dict=False
+                )[0].squeeze(0)
+                r.audio_noise = sample.scheduler_audio.step(
+                    pred_audio.unsqueeze(0), sample.timesteps_audio[sample.step], r.audio_noise.unsqueeze(0), return_dict=False
+                )[0].squeeze(0)
+                sample.step += 1
+
+        self.num_steps += 1
+        self.num_sample_steps += len(samples)
+
+    def retire(self, key):
+        samples = self.cohorts.get(key)
+        if samples is None:
+            return
+        done = [s for s in samples if s.done]
+        if not done:
+            return
+        self.cohorts[key] = [s for s in samples if not s.done]
+        if not self.cohorts[key]:
+            del self.cohorts[key]
+            self.cohort_conds.pop(key, None)
+
+        for sample in done:
+            self.finish(sample)
+
+    def finish(self, sample):
+        r = sample.request
+        try:
+            self.engine.pin_clean_prefix(r, r.video_noise, r.audio_noise)
+            generated_video, generated_audio = self.engine.decode_latents(r, self.output_type)
+            sample.future.set_result((generated_video, generated_audio, r.image))
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            sample.future.set_exception(e)
+        logging.info(f"Retired request after {time.time() - sample.admitted_at:.1f}s, "
+                     f"average batch size {self.num_sample_steps / max(self.num_steps, 1):.2f}")
@@ -1,15 +1,27 @@
 import os
 import sys
+import math
 import uuid
 import cv2
 import glob
 import torch
+import time
+import queue
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import indent
 import torch.nn as nn
 from diffusers import FluxPipeline
 from tqdm import tqdm
 from ovi.distributed_comms.parallel_states import get_sequence_parallel_state, nccl_info
+from ovi.modules.attention import set_attention_backend
+from ovi.modules.fusion import StepCache
+from ovi.modules.model import clear_rope_cache
+from ovi.modules.sparse_attention import SparseAttentionConfig, clear_tile_layouts
+from ovi.utils.checkpoint_utils import load_sampling_checkpoint, load_scheduler_state, save_sampling_checkpoint
+from ovi.utils.io_utils import mux_video
+from ovi.utils.offload_utils import BlockOffloader
+from ovi.utils.text_cache_utils import TextEmbeddingCache, TextEmbeddingStore
 from ovi.utils.model_loading_utils import init_fusion_score_model_ovi, init_text_model, init_mmaudio_vae, init_wan_vae_2_2, load_fusion_checkpoint
 from ovi.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
 from diffusers import FlowMatchEulerDiscreteScheduler
@@ -48,13 +60,87 @@ NAME_TO_MODEL_SPECS_MAP = {
 }
 
 
+class GenerationRequest:
+    """
+    Parameters of one sample plus the state it accumulates through the stages of
+    OviFusionEngine.generate_batch (first frame, text embeddings, latents).
+    """
+
+    def __init__(self,
+                    text_prompt,
+                    image_path=None,
+                    video_frame_height_width=None,
+                    seed=100,
+                    solver_name="unipc",
+                    sample_steps=50,
+                    shift=5.0,
+                    video_guidance_scale=5.0,
+                    audio_guidance_scale=4.0,
+                    slg_layer=9,
+                    video_negative_prompt="",
+                    audio_negative_prompt="",
+                    checkpoint_path=None,
+                    checkpoint_every=0
+                ):
+        self.text_prompt = text_prompt
+        self.image_path = image_path
+        self.video_frame_height_width = video_frame_height_width
+        self.seed = seed
+        self.solver_name = solver_name
+        self.sample_steps = sample_steps
+        self.shift = shift
+        self.video_guidance_scale = video_guidance_scale
+        self.audio_guidance_scale = audio_guidance_scale
+        self.slg_layer = slg_layer
+        self.video_negative_prompt = video_negative_prompt
+        self.audio_negative_prompt = audio_negative_prompt
+        # sampling snapshot, written every checkpoint_every steps and after the last one, resumed from if present
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+
+        self.is_i2v = image_path is not None
+        self.first_frame = None         # [1, 3, H, W] conditioning frame for i2v and t2i2v
+        self.image = None               # PIL first frame generated in t2i2v mode
+        self.latent_hw = None           # video latent (h, w)
+        self.latents_images = None      # [c, k, h, w] clean leading video latents, of first_frame (k=1) or a previous window
+        self.audio_prefix = None        # [m, c] clean leading audio latents of a previous window
+        self.text_embeddings = None     # (positive, video negative, audio negative) T5 embeddings
+        self.video_noise = None         # [c, f, h, w] video latents being denoised
+        self.audio_noise = None         # [l, c] audio latents being denoised
+        self.checkpoint = None          # loaded snapshot to resume sampling from
+        self.start_step = 0             # sampling steps already done according to checkpoint
+        self.error = None               # exception of the stage this request failed in, see generate_batch
+
+
 class OviFusionEngine:
     def __init__(self, config=DEFAULT_CONFIG, device=0, target_dtype=torch.bfloat16):
         # Load fusion model
         self.device = device
         self.target_dtype = target_dtype
         meta_init = True
-        self.cpu_offload = config.get("cpu_offload", False) or config.get("mode") == "t2i2v"
+        # keep the fusion blocks in pinned host memory and stream them to the GPU one pair at a time
+        self.sequential_offload = config.get("sequential_offload", False)
+        self.cpu_offload = config.get("cpu_offload", False) or config.get("mode") == "t2i2v" or self.sequential_offload
+        # run positive and negative CFG passes as a single forward with batch size 2
+        self.batched_cfg = config.get("batched_cfg", False)
+        # upper bound on the samples per fusion forward in generate_batch
+        self.max_batch_size = config.get("max_batch_size", 4)
+        # reuse the cached block stack residual while the accumulated input change stays below this, 0 disables
+        self.step_cache_threshold = config.get("step_cache_threshold", 0)
+        # T5 embeddings of recent prompts on the host, text_cache_gb 0 disables, text_cache_dir adds a persistent tier
+        text_cache_gb = config.get("text_cache_gb", 1.0)
+        self.text_cache = TextEmbeddingCache(int(text_cache_gb * 1024**3), config.get("text_cache_dir", None)) if text_cache_gb > 0 else None
+        # pre-encoded embeddings, see pre_encode_texts
+        self.text_store = None
+        # attention kernel for the fusion model, "auto" picks fa3 > fa2 > sdpa by device and shape
+        set_attention_backend(config.get("attention_backend", "auto"))
+        # tiled local attention in the video self-attention of some blocks and steps, None keeps it dense
+        sparse_attention = config.get("sparse_attention", None)
+        self.sparse_attention = SparseAttentionConfig(**sparse_attention) if sparse_attention else None
+        if self.sparse_attention is not None:
+            logging.info(f"Sparse video self-attention: {self.sparse_attention}")
+        # pinned host buffers for generate(reuse_output_buffer=True), keyed on (shape, dtype)
+        self.host_buffers = {}
         if self.cpu_offload:
             logging.info("CPU offloading is enabled. Initializing all models aside from VAEs on CPU")
 
@@ -62,6 +148,8 @@ class OviFusionEngine:
 
         fp8 = config.get("fp8", False)
         int8 = config.get("qint8", False)
+        if int8:
+            assert not self.sequential_offload, "Sequential offload is not supported with qint8 quantization."
         if fp8:
             assert not config.get("mode") == "t2i2v", "Image generation with FluxPipeline is not supported with fp8 quantization. This is because if you are unable to run the bf16 model, you likely cannot run image gen model"
 
@@ -73,23 +161,6 @@ class OviFusionEngine:
                 .eval()
             )
 
-        # Load VAEs
-        vae_model_video = init_wan_vae_2_2(config.ckpt_dir, rank=device)
-        vae_model_video.model.requires_grad_(False).eval()
-        vae_model_video.model = vae_model_video.model.bfloat16()
-        self.vae_model_video = vae_model_video
-
-        vae_model_audio = init_mmaudio_vae(config.ckpt_dir, rank=device)
-        vae_model_audio.requires_grad_(False).eval()
-        self.vae_model_audio = vae_model_audio.bfloat16()
-
-        # Load T5 text model
-        self.text_model = init_text_model(config.ckpt_dir, rank=device, cpu_offload=self.cpu_offload)
-        if config.get("shard_text_model", False):
-            raise NotImplementedError("Sharding text model is not implemented yet.")
-        if self.cpu_offload:
-            self.offload_to_cpu(self.text_model.model)
-
         # Find fusion ckpt in the same dir used by other components
         model_name = config.get("model_name", "960x960_5s")
         self.model_name = model_name
@@ -108,18 +179,67 @@ class OviFusionEngine:
 
         if not os.path.exists(checkpoint_path):
             raise RuntimeError(f"REQUIRED fusion checkpoint not found in {config.ckpt_dir}, please download...")
+        if config.get("shard_text_model", False):
+            raise NotImplementedError("Sharding text model is not implemented yet.")
 
-        load_fusion_checkpoint(model, checkpoint_path=checkpoint_path, from_meta=meta_init)
+        def load_video_vae():
+            vae_model_video = init_wan_vae_2_2(config.ckpt_dir, rank=device)
+            vae_model_video.model.requires_grad_(False).eval()
+            vae_model_video.model = vae_model_video.model.bfloat16()
+            return vae_model_video
 
-        if meta_init:
-            if not fp8:
-                model = model.to(dtype=target_dtype)
-            model = model.to(device=device if not self.cpu_offload else "cpu").eval()
-            model.set_rope_params()
-        self.model = model
+        def load_audio_vae():
+            vae_model_audio = init_mmaudio_vae(config.ckpt_dir, rank=device)
+            vae_model_audio.requires_grad_(False).eval()
+            return vae_model_audio.bfloat16()
+
+        def load_text_model():
+            text_model = init_text_model(config.ckpt_dir, rank=device, cpu_offload=self.cpu_offload)
+            if self.cpu_offload:
+                self.offload_to_cpu(text_model.model)
+            return text_model
+
+        def load_fusion_model():
+            # tensors are streamed straight into the target dtype and device, fp8 checkpoints keep their dtype
+            load_fusion_checkpoint(model, checkpoint_path=checkpoint_path, from_meta=meta_init,
+                                   device=device if not self.cpu_offload else "cpu",
+                                   dtype=None if fp8 else target_dtype)
+            if meta_init:
+                model.eval()
+                model.set_rope_params()
+            return model
+
+        def timed(name, load_fn):
+            # the current cuda device is per thread
+            if isinstance(device, int) and torch.cuda.is_available():
+                torch.cuda.set_device(device)
+            start = time.time()
+            component = load_fn()
+            logging.info(f"Loaded {name} in {time.time() - start:.1f}s")
+            return component
+
+        # the components are independent, overlap their disk reads and deserialization
+        start = time.time()
+        loaders = {
+            "video VAE": load_video_vae,
+            "audio VAE": load_audio_vae,
+            "T5 text model": load_text_model,
+            "fusion model": load_fusion_model,
+        }
+        with ThreadPoolExecutor(max_workers=len(loaders)) as pool:
+            futures = {name: pool.submit(timed, name, load_fn) for name, load_fn in loaders.items()}
+            components = {name: future.result() for name, future in futures.items()}
+        logging.info(f"Loaded all components in {time.time() - start:.1f}s")
+
+        self.vae_model_video = components["video VAE"]
+        self.vae_model_audio = components["audio VAE"]
+        self.text_model = components["T5 text model"]
+        self.model = components["fusion model"]
         if int8:
             quantize(self.model, qint8)
             freeze(self.model)
+        if self.sequential_offload:
+            self.model.block_offloader = BlockOffloader(self.model, device)
 
         ## Load t2i as part of pipeline
         self.image_model = None
@@ -153,207 +273,714 @@ class OviFusionEngine:
                     audio_guidance_scale=4.0,
                     slg_layer=9,
                     video_negative_prompt="",
-                    audio_negative_prompt=""
+                    audio_negative_prompt="",
+                    output_type="float",
+                    reuse_output_buffer=False,
+                    checkpoint_path=None,
+                    checkpoint_every=0
+                ):
+        """
+        output_type: "float" returns video as float32 (C, F, H, W) in [-1, 1] and audio as float32 in [-1, 1].
+                     "uint8" converts on the device and returns video as uint8 (F, H, W, C) and audio as int16,
+                     ready for save_video, with a single compact device to host copy each.
+        reuse_output_buffer: copy the outputs into pinned host buffers owned by the engine, which are
+                     overwritten by the next generate call with the same output shapes.
+        checkpoint_path: file for sampling snapshots (latents and scheduler state), written every
+                     checkpoint_every steps (0: only the final latents). If it already holds a snapshot
+                     of the same generation, sampling resumes from it; a final snapshot is only decoded.
+        """
+        request = GenerationRequest(
+            text_prompt=text_prompt,
+            image_path=image_path,
+            video_frame_height_width=video_frame_height_width,
+            seed=seed,
+            solver_name=solver_name,
+            sample_steps=sample_steps,
+            shift=shift,
+            video_guidance_scale=video_guidance_scale,
+            audio_guidance_scale=audio_guidance_scale,
+            slg_layer=slg_layer,
+            video_negative_prompt=video_negative_prompt,
+            audio_negative_prompt=audio_negative_prompt,
+            checkpoint_path=checkpoint_path,
+            checkpoint_every=checkpoint_every,
+        )
+        try:
+            # failures are logged by generate_batch, the failed sample's output is None
+            return self.generate_batch([request], output_type=output_type, reuse_output_buffer=reuse_output_buffer)[0]
+
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            return None
+
+    @torch.inference_mode()
+    def generate_batch(self, requests, output_type="float", reuse_output_buffer=False, max_batch_size=None):
+        """
+        Generate several samples, batching those that share latent shape, i2v mode and sample steps
+        into single forwards of the fusion model. Every sample keeps its own seed, scheduler,
+        guidance scales, slg layer and first frame.
+
+        requests: list of GenerationRequest, or dicts of generate() arguments.
+        max_batch_size: upper bound on the samples per forward, defaults to the engine config.
+        Returns a list of (video, audio, image) in the order of requests, see generate() for the formats.
+        A request that fails (e.g. a bad image path) gets None and its exception in request.error,
+        the other samples are still generated.
+        """
+        assert output_type in ("float", "uint8"), f"Invalid output_type {output_type}, must be one of ['float', 'uint8']"
+        assert not reuse_output_buffer or len(requests) == 1, "reuse_output_buffer would overwrite the outputs of earlier samples of the batch"
+        requests = [r if isinstance(r, GenerationRequest) else GenerationRequest(**r) for r in requests]
+        max_batch_size = max_batch_size or self.max_batch_size
+
+        # rope tables and sparse attention layouts are cached per grid size, start each generation from a clean cache
+        clear_rope_cache()
+        clear_tile_layouts()
+        for request in requests:
+            self.run_isolated(lambda rs: self.prepare_request(rs[0]), [request])
+        self.run_isolated(self.encode_text, requests)
+        self.run_isolated(self.encode_first_frames, requests)
+        for request in requests:
+            self.run_isolated(lambda rs: self.init_noise(rs[0]), [request])
+
+        # same latent shape, i2v mode, number of steps, resume step and clean prefix -> one batched sampling loop
+        groups = {}
+        for request in requests:
+            if request.error is None:
+                key = (request.latent_hw, request.is_i2v, request.sample_steps, request.start_step, self.clean_prefix_lengths([request]))
+                groups.setdefault(key, []).append(request)
+        batches = [group[i:i + max_batch_size] for group in groups.values() for i in range(0, len(group), max_batch_size)]
+        logging.info(f"Sampling {sum(len(b) for b in batches)} request(s) in {len(batches)} batch(es): {[len(b) for b in batches]}")
+
+        if self.cpu_offload:
+            self.offload_to_cpu(self.vae_model_video.model)
+            self.offload_to_cpu(self.vae_model_audio)
+            if not self.sequential_offload:
+                self.model = self.model.to(self.device)
+        for batch in batches:
+            try:
+                self.denoise(batch)
+            except Exception as e:
+                # sampling state is partly updated, the batch is not retried request by request
+                for request in batch:
+                    self.fail_request(request, e)
+        if self.sequential_offload:
+            self.model.block_offloader.clear()
+        elif self.cpu_offload:
+            self.offload_to_cpu(self.model)
+
+        if self.cpu_offload:
+            self.vae_model_video.model = self.vae_model_video.model.to(
+                self.device
+            )
+            self.vae_model_audio = self.vae_model_audio.to(self.device)
+        outputs = []
+        for request in requests:
+            output = []
+            self.run_isolated(lambda rs: output.append(self.decode_latents(rs[0], output_type, reuse_output_buffer) + (rs[0].image,)), [request])
+            outputs.append(output[0] if output else None)
+        if self.cpu_offload:
+            self.offload_to_cpu(self.vae_model_video.model)
+            self.offload_to_cpu(self.vae_model_audio)
+        return outputs
+
+    def run_isolated(self, fn, requests):
+        """
+        fn(requests) on the requests that have not failed yet. If it raises for several requests it is
+        retried one request at a time, so only the requests it fails for are marked failed.
+        """
+        requests = [r for r in requests if r.error is None]
+        if not requests:
+            return
+        try:
+            fn(requests)
+            return
+        except Exception as e:
+            if len(requests) == 1:
+                self.fail_request(requests[0], e)
+                return
+        for request in requests:
+            try:
+                fn([request])
+            except Exception as e:
+                self.fail_request(request, e)
+
+    @staticmethod
+    def fail_request(request, error):
+        request.error = error
+        logging.error(f"Request failed, prompt {request.text_prompt[:80]!r}, seed {request.seed}:\n"
+                      + "".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    @torch.inference_mode()
+    def generate_long(self,
+                    text_prompt,
+                    num_windows,
+                    overlap_frames=8,
+                    output_path=None,
+                    image_path=None,
+                    video_frame_height_width=None,
+                    seed=100,
+                    fps=24,
+                    sample_rate=16000,
+                    **sampling_kwargs
                 ):
+        """
+        Long video (and audio) as a sequence of overlapping windows of the model's native length.
+
+        Window w > 0 is conditioned on the last overlap_frames video latent frames and the matching
+        audio latents of window w - 1, which are pinned as a clean prefix the same way the first
+        frame is in i2v. Only the new latent frames of every window are streamed into a single
+        causal VAE decode and on to ffmpeg, so peak memory stays at one window and the cost grows
+        linearly with num_windows. The clip has 1 + 4 * (F - 1) + 4 * (num_windows - 1) * (F - overlap_frames)
+        frames for F = video_latent_length, and exactly frames * sample_rate / fps audio samples.
+
+        text_prompt: one prompt for all windows or a list with one prompt per window.
+        sampling_kwargs: solver_name, sample_steps, shift, guidance scales, slg_layer and negative
+                         prompts as in generate().
+        Returns output_path, or the MP4 bytes if output_path is None; None on the other ranks of an sp group.
+        """
+        assert not self.cpu_offload, "Long generation keeps all models resident, it does not support cpu_offload"
+        assert 0 < overlap_frames < self.video_latent_length - 1, f"overlap_frames must be in [1, {self.video_latent_length - 2}]"
+        assert hasattr(os, "mkfifo"), "Long generation streams its audio through a named pipe"
+        prompts = [text_prompt] * num_windows if isinstance(text_prompt, str) else list(text_prompt)
+        assert len(prompts) == num_windows, f"Got {len(prompts)} prompts for {num_windows} windows"
+        # a window decodes to 1 + 4 * (F - 1) frames, of which only the 4 * (F - overlap_frames) new ones are
+        # kept; the audio overlap is what remains of the window's audio after the new frames' duration
+        window_frames = 1 + 4 * (self.video_latent_length - 1)
+        new_frames = 4 * (self.video_latent_length - overlap_frames)
+        overlap_audio = self.audio_latent_length - round(new_frames * self.audio_latent_length / window_frames)
+        audio_chunks = queue.Queue()
+        clear_rope_cache()
+
+        def sample_window(w, previous):
+            request = GenerationRequest(text_prompt=prompts[w],
+                                        image_path=image_path if w == 0 else None,
+                                        video_frame_height_width=video_frame_height_width,
+                                        seed=seed + w,
+                                        **sampling_kwargs)
+            if previous is None:
+                self.prepare_request(request)
+                self.encode_first_frames([request])
+            else:
+                # continuation: same latent size, the previous window's tail is the clean prefix
+                request.text_prompt = self.text_formatter(request.text_prompt)
+                request.latent_hw = previous.latent_hw
+                request.is_i2v = True
+                request.latents_images = previous.video_noise[:, -overlap_frames:].clone()
+                request.audio_prefix = previous.audio_noise[-overlap_audio:].clone()
+            self.encode_text([request])
+            self.init_noise(request)
+            logging.info(f"Sampling window {w + 1}/{num_windows}")
+            self.denoise([request])
+            return request
+
+        def latent_windows():
+            try:
+                previous = None
+                num_frames = num_samples = 0
+                for w in range(num_windows):
+                    request = sample_window(w, previous)
+                    # audio of the whole window decodes with its context, only the part of the new frames is kept:
+                    # the window's tail, sized so that the audio emitted so far always matches the frames so far
+                    with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
+                        audio = self.vae_model_audio.wrapped_decode(request.audio_noise.unsqueeze(0).transpose(1, 2)).squeeze().float()
+                    num_frames += window_frames if previous is None else new_frames
+                    needed = round(num_frames * sample_rate / fps) - num_samples
+                    audio = audio[:needed] if previous is None else audio[-needed:]
+                    if w == num_windows - 1 and audio.shape[-1] < needed:
+                        # a window's audio can be a few ms shorter than its frames, a shortfall of an earlier
+                        # window is taken from the next one, the last one is padded with silence
+                        audio = torch.nn.functional.pad(audio, (0, needed - audio.shape[-1]))
+                    num_samples += audio.shape[-1]
+                    audio_chunks.put((audio.clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy())
+                    # put before the frames: ffmpeg never waits for audio while the frames producer samples
+                    yield (request.video_noise if previous is None else request.video_noise[:, overlap_frames:]).unsqueeze(0)
+                    request.text_embeddings = request.first_frame = None
+                    previous = request
+                # mux_video pads the audio to the frames, an audio track that falls behind would end in silence
+                assert num_samples == round(num_frames * sample_rate / fps), \
+                    f"{num_samples} audio samples for {num_frames} frames at {fps} fps and {sample_rate} Hz"
+            finally:
+                # ends the audio iterator of mux_video, also when a window or the decode fails
+                audio_chunks.put(None)
+
+        if nccl_info.rank_within_group != 0:
+            # every rank samples, only the first rank of the group decodes and muxes
+            for _ in latent_windows():
+                pass
+            return None
+
+        def frames():
+            try:
+                for chunk in self.vae_model_video.wrapped_decode_stream(latent_windows()):
+                    # b, c, f, h, w -> f, h, w, c
+                    yield ((chunk[0].clamp(-1, 1) + 1) / 2 * 255).to(torch.uint8).permute(1, 2, 3, 0).contiguous().cpu().numpy()
+            finally:
+                # a failed video decode leaves latent_windows suspended before its own finally
+                audio_chunks.put(None)
 
+        return mux_video(output_path, frames(), iter(audio_chunks.get, None),
+                         sample_rate=sample_rate, fps=fps, audio_channels=1,
+                         num_frames=window_frames + (num_windows - 1) * new_frames)
+
+    def estimate_cost(self, request):
+        """
+        Relative sampling cost of a GenerationRequest (fusion tokens x steps), for job scheduling only.
+        """
+        if request.is_i2v or request.video_frame_height_width is None:
+            # first frames are resized to the model's target area
+            video_h, video_w = math.sqrt(self.target_area), math.sqrt(self.target_area)
+        else:
+            video_h, video_w = snap_hw_to_multiple_of_32(*request.video_frame_height_width, area=self.target_area)
+        # 16x VAE downsampling, 2x2 patches
+        video_tokens = self.video_latent_length * (video_h // 32) * (video_w // 32)
+        return request.sample_steps * (video_tokens + self.audio_latent_length)
+
+    def prepare_request(self, request):
         params = {
-            "Text Prompt": text_prompt,
-            "Image Path": image_path if image_path else "None (T2V mode)",
-            "Frame Height Width": video_frame_height_width,
-            "Seed": seed,
-            "Solver": solver_name,
-            "Sample Steps": sample_steps,
-            "Shift": shift,
-            "Video Guidance Scale": video_guidance_scale,
-            "Audio Guidance Scale": audio_guidance_scale,
-            "SLG Layer": slg_layer,
-            "Video Negative Prompt": video_negative_prompt,
-            "Audio Negative Prompt": audio_negative_prompt,
+            "Text Prompt": request.text_prompt,
+            "Image Path": request.image_path if request.image_path else "None (T2V mode)",
+            "Frame Height Width": request.video_frame_height_width,
+            "Seed": request.seed,
+            "Solver": request.solver_name,
+            "Sample Steps": request.sample_steps,
+            "Shift": request.shift,
+            "Video Guidance Scale": request.video_guidance_scale,
+            "Audio Guidance Scale": request.audio_guidance_scale,
+            "SLG Layer": request.slg_layer,
+            "Video Negative Prompt": request.video_negative_prompt,
+            "Audio Negative Prompt": request.audio_negative_prompt,
         }
 
         pretty = "\n".join(f"{k:>24}: {v}" for k, v in params.items())
         logging.info("\n========== Generation Parameters ==========\n"
                     f"{pretty}\n"
                     "==========================================")
-        try:
+
+        # text and image checks
+        formatted_text_prompt = self.text_formatter(request.text_prompt)
+        if formatted_text_prompt != request.text_prompt:
+            logging.info(f"Wrong audio description format detected! Please use <AUDCAP>...<ENDAUDCAP> tags for 720x720_5s model and Audio: ... for 960x960 models.\n \
+                         Original prompt: {request.text_prompt}\nFormatted prompt: {formatted_text_prompt}")
+            request.text_prompt = formatted_text_prompt
+
+        if request.is_i2v and not self.image_model:
+            # Load first frame from path
+            request.first_frame = preprocess_image_tensor(request.image_path, self.device, self.target_dtype, resize_total_area=self.target_area)
+            request.latent_hw = (request.first_frame.shape[-2] // 16, request.first_frame.shape[-1] // 16)
+        else:
+            assert request.video_frame_height_width is not None, f"If mode=t2v or t2i2v, video_frame_height_width must be provided."
+
+            # input resolution should be at least 0.9x of video area of model spec
+            input_area = request.video_frame_height_width[0] * request.video_frame_height_width[1]
+            if input_area < 0.9 * self.target_area or input_area > 1.1 * self.target_area:
+                logging.warning(f"[Detected model: {self.model_name}] Input video frame area {input_area} is more than 10\% smaller or larger than model's target area {self.target_area}. This may lead to suboptimal results, please refer to readme for best resolutions or use the right model. DEFAULTING TO MODEL'S TARGET AREA while preserving given aspect ratio.")
+
+            video_h, video_w = request.video_frame_height_width
+            video_h, video_w = snap_hw_to_multiple_of_32(video_h, video_w, area = self.target_area)
+            request.latent_hw = (video_h // 16, video_w // 16)
+            if self.image_model is not None:
+                # this already means t2v mode with image model
+                image_h, image_w = scale_hw_to_area_divisible(video_h, video_w, area = 1024 * 1024)
+                request.image = self.image_model(
+                    clean_text(request.text_prompt),
+                    height=image_h,
+                    width=image_w,
+                    guidance_scale=4.5,
+                    generator=torch.Generator().manual_seed(request.seed)
+                ).images[0]
+                request.first_frame = preprocess_image_tensor(request.image, self.device, self.target_dtype, resize_total_area=self.target_area)
+                request.is_i2v = True
+            else:
+                print(f"Pure T2V mode: calculated video latent size: {request.latent_hw[0]} x {request.latent_hw[1]}")
+
+    def encode_text(self, requests):
+        # one T5 pass over the distinct prompts of all requests, negative prompts are usually shared
+        texts = list(dict.fromkeys(text for r in requests for text in (r.text_prompt, r.video_negative_prompt, r.audio_negative_prompt)))
+        keys = {text: self.text_key(text) for text in texts}
+        text_embeddings = {}
+        for text in texts:
+            embedding = self.lookup_text_embedding(keys[text])
+            if embedding is not None:
+                text_embeddings[text] = embedding
+
+        # T5 (and its offload round trip) only runs when some text missed the cache
+        missing = [text for text in texts if text not in text_embeddings]
+        if missing:
+            if self.text_model.model is None:
+                raise KeyError(f"{len(missing)} text(s) were not pre-encoded and the T5 model was released, e.g. {missing[0]!r}")
+            for text, embedding in zip(missing, self.run_text_model(missing)):
+                text_embeddings[text] = self.text_cache.put(keys[text], embedding) if self.text_cache is not None else embedding
+        text_embeddings = {text: embedding.to(self.device, non_blocking=True) for text, embedding in text_embeddings.items()}
+
+        for r in requests:
+            # positive prompt is shared by both towers
+            r.text_embeddings = (text_embeddings[r.text_prompt], text_embeddings[r.video_negative_prompt], text_embeddings[r.audio_negative_prompt])
+
+    def text_key(self, text):
+        # cache and store key: the T5 checkpoint and dtypes the embedding depends on, then the normalized text
+        return (f"{os.path.basename(self.text_model.checkpoint_path)}|{self.text_model.dtype}|{self.target_dtype}\n"
+                f"{self.text_model.normalize(text)}")
+
+    def lookup_text_embedding(self, key):
+        embedding = self.text_store.get(key) if self.text_store is not None else None
+        if embedding is None and self.text_cache is not None:
+            embedding = self.text_cache.get(key)
+        return embedding
+
+    def run_text_model(self, texts, batch_size=None, to_host=False):
+        """
+        T5 embeddings of texts in target_dtype, in batches of batch_size (all at once by default).
+        """
+        batch_size = batch_size or len(texts)
+        if self.cpu_offload:
+            self.text_model.model = self.text_model.model.to(self.device)
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            for embedding in self.text_model(texts[start:start + batch_size], self.text_model.device):
+                embedding = embedding.to(self.target_dtype)
+                embeddings.append(embedding.cpu() if to_host else embedding)
+        if self.cpu_offload:
+            self.text_model.clear_bias_cache()
+            self.offload_to_cpu(self.text_model.model)
+        return embeddings
+
+    @torch.inference_mode()
+    def pre_encode_texts(self, texts, path, batch_size=32, release_text_model=True, encode=True):
+        """
+        Encode every distinct text in large T5 batches into a memory-mapped safetensors store at path,
+        which encode_text reads from from then on. Texts already in an existing store are kept.
+        With release_text_model the T5 weights are freed afterwards, only the tokenizer stays to
+        normalize lookups. Texts must be given as they reach T5, i.e. after the model's prompt formatter.
+        With encode=False the store at path is only opened, e.g. on the ranks that did not write it.
+        """
+        texts = {self.text_key(text): text for text in texts} if encode else {}
+        embeddings = {}
+        if encode and os.path.exists(path):
+            existing = TextEmbeddingStore(path)
+            for key in texts:
+                embedding = existing.get(key)
+                if embedding is not None:
+                    embeddings[key] = embedding
+        missing = [key for key in texts if key not in embeddings]
+        if missing:
+            start = time.time()
+            for key, embedding in zip(missing, self.run_text_model([texts[key] for key in missing], batch_size, to_host=True)):
+                embeddings[key] = embedding
+            TextEmbeddingStore.write(path, embeddings)
+            logging.info(f"Pre-encoded {len(missing)} texts in {time.time() - start:.1f}s into {path}, {len(texts) - len(missing)} were already there")
+        self.text_store = TextEmbeddingStore(path)
+
+        if release_text_model:
+            self.text_model.clear_bias_cache()
+            self.text_model.model = None
+            torch.cuda.empty_cache()
+            logging.info(f"Released the T5 model. GPU VRAM allocated: {torch.cuda.memory_allocated(self.device)/1e9:.2f} GB")
+
+    def encode_first_frames(self, requests):
+        requests = [r for r in requests if r.is_i2v]
+        if not requests:
+            return
+        if self.cpu_offload:
+            self.vae_model_video.model = self.vae_model_video.model.to(
+                self.device
+            )
+        for r in requests:
+            with torch.no_grad():
+                latents_images = self.vae_model_video.wrapped_encode(r.first_frame[:, :, None]).to(self.target_dtype).squeeze(0) # c 1 h w 
+            r.latents_images = latents_images.to(self.target_dtype)
+            r.latent_hw = (latents_images.shape[2], latents_images.shape[3])
+        if self.cpu_offload:
+            self.offload_to_cpu(self.vae_model_video.model)
+
+    def init_noise(self, request):
+        video_latent_h, video_latent_w = request.latent_hw
+        request.video_noise = torch.randn((self.video_latent_channel, self.video_latent_length, video_latent_h, video_latent_w), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(request.seed))  # c, f, h, w
+        request.audio_noise = torch.randn((self.audio_latent_length, self.audio_latent_channel), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(request.seed))  # 1, l c -> l, c
+
+        request.checkpoint = load_sampling_checkpoint(request.checkpoint_path, request, self.sampling_settings()) if request.checkpoint_path else None
+        if request.checkpoint is not None:
+            request.start_step = request.checkpoint["step"]
+            request.video_noise = request.checkpoint["video_noise"].to(self.device, self.target_dtype)
+            request.audio_noise = request.checkpoint["audio_noise"].to(self.device, self.target_dtype)
+            logging.info(f"Resuming from {request.checkpoint_path} at step {request.start_step}/{request.sample_steps}")
+
+    def denoise(self, requests):
+        """
+        Batched sampling loop over requests sharing latent shape, i2v mode and sample steps.
+        Updates request.video_noise / request.audio_noise to the final latents.
+        """
+        sample_steps = requests[0].sample_steps
+        start_step = requests[0].start_step
+        assert all(r.start_step == start_step for r in requests), "Requests of one batch must resume from the same step"
+        if start_step >= sample_steps:
+            # final latents restored from the checkpoint, nothing left to sample
+            return
+        schedulers = []
+        for r in requests:
             scheduler_video, timesteps_video = self.get_scheduler_time_steps(
-                sampling_steps=sample_steps,
+                sampling_steps=r.sample_steps,
                 device=self.device,
-                solver_name=solver_name,
-                shift=shift
+                solver_name=r.solver_name,
+                shift=r.shift
             )
             scheduler_audio, timesteps_audio = self.get_scheduler_time_steps(
-                sampling_steps=sample_steps,
+                sampling_steps=r.sample_steps,
                 device=self.device,
-                solver_name=solver_name,
-                shift=shift
+                solver_name=r.solver_name,
+                shift=r.shift
             )
+            if r.checkpoint is not None:
+                load_scheduler_state(scheduler_video, r.checkpoint["scheduler_video"], self.device)
+                load_scheduler_state(scheduler_audio, r.checkpoint["scheduler_audio"], self.device)
+                r.checkpoint = None
+            schedulers.append((scheduler_video, timesteps_video, scheduler_audio, timesteps_audio))
 
-            is_t2v = image_path is None
-            is_i2v = not is_t2v
+        video_noise = [r.video_noise for r in requests]
+        audio_noise = [r.audio_noise for r in requests]
 
-            first_frame = None
-            image = None
+        with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
+            # text context is fixed for the whole generation, project it and the per-block cross-attn k/v once
+            cond_cache = self.build_conditioning_cache(requests)
+            logging.info(f"Built text conditioning cache: {cond_cache.nbytes()/1e6:.1f} MB")
+            # per-branch residual caches, the last step is always computed
+            step_caches = {branch: StepCache(self.step_cache_threshold) for branch in cond_cache.branches} if self.step_cache_threshold else {}
 
-            # text and image checks
-            formatted_text_prompt = self.text_formatter(text_prompt)
-            if formatted_text_prompt != text_prompt:
-                logging.info(f"Wrong audio description format detected! Please use <AUDCAP>...<ENDAUDCAP> tags for 720x720_5s model and Audio: ... for 960x960 models.\n \
-                             Original prompt: {text_prompt}\nFormatted prompt: {formatted_text_prompt}")
-                text_prompt = formatted_text_prompt
-
-            if is_i2v and not self.image_model:
-                # Load first frame from path
-                first_frame = preprocess_image_tensor(image_path, self.device, self.target_dtype, resize_total_area=self.target_area)
-            else:
-                assert video_frame_height_width is not None, f"If mode=t2v or t2i2v, video_frame_height_width must be provided."
-
-                # input resolution should be at least 0.9x of video area of model spec
-                input_area = video_frame_height_width[0] * video_frame_height_width[1]
-                if input_area < 0.9 * self.target_area or input_area > 1.1 * self.target_area:
-                    logging.warning(f"[Detected model: {self.model_name}] Input video frame area {input_area} is more than 10\% smaller or larger than model's target area {self.target_area}. This may lead to suboptimal results, please refer to readme for best resolutions or use the right model. DEFAULTING TO MODEL'S TARGET AREA while preserving given aspect ratio.")
-
-                video_h, video_w = video_frame_height_width
-                video_h, video_w = snap_hw_to_multiple_of_32(video_h, video_w, area = self.target_area)
-                video_latent_h, video_latent_w = video_h // 16, video_w // 16
-                if self.image_model is not None:
-                    # this already means t2v mode with image model
-                    image_h, image_w = scale_hw_to_area_divisible(video_h, video_w, area = 1024 * 1024)
-                    image = self.image_model(
-                        clean_text(text_prompt),
-                        height=image_h,
-                        width=image_w,
-                        guidance_scale=4.5,
-                        generator=torch.Generator().manual_seed(seed)
-                    ).images[0]
-                    first_frame = preprocess_image_tensor(image, self.device, self.target_dtype, resize_total_area=self.target_area)
-                    is_i2v = True
-                else:
-                    print(f"Pure T2V mode: calculated video latent size: {video_latent_h} x {video_latent_w}")
-
-            
-            if self.cpu_offload:
-                self.text_model.model = self.text_model.model.to(self.device)
-            text_embeddings = self.text_model([text_prompt, video_negative_prompt, audio_negative_prompt], self.text_model.device)
-            text_embeddings = [emb.to(self.target_dtype).to(self.device) for emb in text_embeddings]
+            for i in tqdm(range(start_step, sample_steps), initial=start_step, total=sample_steps):
+                # every sample has its own schedule, e.g. different shift
+                timestep_input = torch.stack([s[1][i] for s in schedulers]).to(self.device)
+                use_step_cache = i < sample_steps - 1
+                self.set_sparse_attention_steps(requests, [i] * len(requests))
 
-            if self.cpu_offload:
-                self.offload_to_cpu(self.text_model.model)
-
-            # Split embeddings
-            text_embeddings_audio_pos = text_embeddings[0]
-            text_embeddings_video_pos = text_embeddings[0] 
-
-            text_embeddings_video_neg = text_embeddings[1]
-            text_embeddings_audio_neg = text_embeddings[2]
-
-            if is_i2v:
-                if self.cpu_offload:
-                    self.vae_model_video.model = self.vae_model_video.model.to(
-                        self.device
-                    )
-                with torch.no_grad():
-                    latents_images = self.vae_model_video.wrapped_encode(first_frame[:, :, None]).to(self.target_dtype).squeeze(0) # c 1 h w 
-                latents_images = latents_images.to(self.target_dtype)
-                video_latent_h, video_latent_w = latents_images.shape[2], latents_images.shape[3]
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.vae_model_video.model)
-
-            video_noise = torch.randn((self.video_latent_channel, self.video_latent_length, video_latent_h, video_latent_w), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(seed))  # c, f, h, w
-            audio_noise = torch.randn((self.audio_latent_length, self.audio_latent_channel), device=self.device, dtype=self.target_dtype, generator=torch.Generator(device=self.device).manual_seed(seed))  # 1, l c -> l, c
-            
-            # Calculate sequence lengths from actual latents
-            max_seq_len_audio = audio_noise.shape[0]  # L dimension from latents_audios shape [1, L, D]
-            _patch_size_h, _patch_size_w = self.model.video_model.patch_size[1], self.model.video_model.patch_size[2]
-            max_seq_len_video = video_noise.shape[1] * video_noise.shape[2] * video_noise.shape[3] // (_patch_size_h*_patch_size_w) # f * h * w from [1, c, f, h, w]
-            
-            # Sampling loop
-            if self.cpu_offload:
-                self.offload_to_cpu(self.vae_model_video.model)
-                self.offload_to_cpu(self.vae_model_audio)
-                self.model = self.model.to(self.device)
-            with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
-                for i, (t_v, t_a) in tqdm(enumerate(zip(timesteps_video, timesteps_audio))):
-                    timestep_input = torch.full((1,), t_v, device=self.device)
-
-                    if is_i2v:
-                        video_noise[:, :1] = latents_images
-
-                    # Positive (conditional) forward pass
-                    pos_forward_args = {
-                        'audio_context': [text_embeddings_audio_pos],
-                        'vid_context': [text_embeddings_video_pos],
-                        'vid_seq_len': max_seq_len_video,
-                        'audio_seq_len': max_seq_len_audio,
-                        'first_frame_is_clean': is_i2v
-                    }
-
-                    pred_vid_pos, pred_audio_pos = self.model(
-                        vid=[video_noise],
-                        audio=[audio_noise],
-                        t=timestep_input,
-                        **pos_forward_args
-                    )
-                    
-                    # Negative (unconditional) forward pass  
-                    neg_forward_args = {
-                        'audio_context': [text_embeddings_audio_neg],
-                        'vid_context': [text_embeddings_video_neg],
-                        'vid_seq_len': max_seq_len_video,
-                        'audio_seq_len': max_seq_len_audio,
-                        'first_frame_is_clean': is_i2v,
-                        'slg_layer': slg_layer
-                    }
-                    
-                    pred_vid_neg, pred_audio_neg = self.model(
-                        vid=[video_noise],
-                        audio=[audio_noise],
-                        t=timestep_input,
-                        **neg_forward_args
-                    )
-
-                    # Apply classifier-free guidance
-                    pred_video_guided = pred_vid_neg[0] + video_guidance_scale * (pred_vid_pos[0] - pred_vid_neg[0])
-                    pred_audio_guided = pred_audio_neg[0] + audio_guidance_scale * (pred_audio_pos[0] - pred_audio_neg[0])
+                pred_video_guided, pred_audio_guided = self.guided_predictions(
+                    requests, video_noise, audio_noise, timestep_input, cond_cache,
+                    step_caches=step_caches if use_step_cache else None)
 
+                for b, (scheduler_video, timesteps_video, scheduler_audio, timesteps_audio) in enumerate(schedulers):
                     # Update noise using scheduler
-                    video_noise = scheduler_video.step(
-                        pred_video_guided.unsqueeze(0), t_v, video_noise.unsqueeze(0), return_dict=False
+                    video_noise[b] = scheduler_video.step(
+                        pred_video_guided[b].unsqueeze(0), timesteps_video[i], video_noise[b].unsqueeze(0), return_dict=False
                     )[0].squeeze(0)
 
-                    audio_noise = scheduler_audio.step(
-                        pred_audio_guided.unsqueeze(0), t_a, audio_noise.unsqueeze(0), return_dict=False
+                    audio_noise[b] = scheduler_audio.step(
+                        pred_audio_guided[b].unsqueeze(0), timesteps_audio[i], audio_noise[b].unsqueeze(0), return_dict=False
                     )[0].squeeze(0)
 
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.model)
-                    self.vae_model_video.model = self.vae_model_video.model.to(
-                        self.device
-                    )
-                    self.vae_model_audio = self.vae_model_audio.to(self.device)
-
-                if is_i2v:
-                    video_noise[:, :1] = latents_images
-
-                # Decode audio
-                audio_latents_for_vae = audio_noise.unsqueeze(0).transpose(1, 2)  # 1, c, l
-                generated_audio = self.vae_model_audio.wrapped_decode(audio_latents_for_vae)
-                generated_audio = generated_audio.squeeze().cpu().float().numpy()
-                
-                # Decode video  
-                video_latents_for_vae = video_noise.unsqueeze(0)  # 1, c, f, h, w
-                generated_video = self.vae_model_video.wrapped_decode(video_latents_for_vae)
-                generated_video = generated_video.squeeze(0).cpu().float().numpy()  # c, f, h, w
-                if self.cpu_offload:
-                    self.offload_to_cpu(self.vae_model_video.model)
-                    self.offload_to_cpu(self.vae_model_audio)
-            return generated_video, generated_audio, image
+                if i + 1 < sample_steps:
+                    self.save_checkpoints(requests, video_noise, audio_noise, schedulers, i + 1)
 
+            if step_caches:
+                num_skipped = sum(c.num_skipped for c in step_caches.values())
+                num_calls = num_skipped + sum(c.num_computed for c in step_caches.values())
+                logging.info(f"Step cache skipped {num_skipped}/{num_calls} block stack passes (threshold {self.step_cache_threshold})")
+            del cond_cache, step_caches
 
-        except Exception as e:
-            logging.error(traceback.format_exc())
-            return None
+        for r, v, a in zip(requests, video_noise, audio_noise):
+            self.pin_clean_prefix(r, v, a)
+            r.video_noise, r.audio_noise = v, a
+        # final latents, so decode and mux can be redone without sampling
+        self.save_checkpoints(requests, video_noise, audio_noise, schedulers, sample_steps)
+
+    def set_sparse_attention_steps(self, requests, steps):
+        """
+        Switch the configured video blocks to local self-attention for the next forward of requests,
+        at sampling steps `steps`, if every sample of the batch is inside the sparse step range, back
+        to dense attention otherwise. Every query attends to the batch's clean prefix frames.
+        """
+        if self.sparse_attention is None:
+            return
+        sparse = all(self.sparse_attention.is_sparse_step(step, r.sample_steps) for step, r in zip(steps, requests))
+        config = self.sparse_attention.with_global_frames(self.clean_prefix_lengths(requests)[0]) if sparse else None
+        for i, block in enumerate(self.model.video_model.blocks):
+            block.self_attn.sparse_attention = config if sparse and config.uses_block(i) else None
+
+    def save_checkpoints(self, requests, video_noise, audio_noise, schedulers, step):
+        if nccl_info.rank_within_group != 0:
+            # every rank of an sp group holds the same latents
+            return
+        for r, v, a, (scheduler_video, _, scheduler_audio, _) in zip(requests, video_noise, audio_noise, schedulers):
+            if r.checkpoint_path is None:
+                continue
+            if step < r.sample_steps and not (r.checkpoint_every and step % r.checkpoint_every == 0):
+                continue
+            r.video_noise, r.audio_noise = v, a
+            save_sampling_checkpoint(r.checkpoint_path, r, step, scheduler_video, scheduler_audio, self.sampling_settings())
+
+    def sampling_settings(self):
+        # engine configuration that changes the sampling path, snapshots taken under other settings are not resumed
+        return {
+            "model_name": self.model_name,
+            "step_cache_threshold": self.step_cache_threshold,
+            "sparse_attention": repr(self.sparse_attention) if self.sparse_attention is not None else None,
+        }
+
+    def build_conditioning_cache(self, requests):
+        """
+        FusionConditioningCache of the CFG branches of a batch of requests, 'cfg' (positive samples
+        then negative samples) with batched_cfg, 'pos' and 'neg' otherwise.
+        """
+        text_embeddings_video_pos = [r.text_embeddings[0] for r in requests]
+        text_embeddings_audio_pos = [r.text_embeddings[0] for r in requests]
+        text_embeddings_video_neg = [r.text_embeddings[1] for r in requests]
+        text_embeddings_audio_neg = [r.text_embeddings[2] for r in requests]
+        if self.batched_cfg:
+            cond_branches = {
+                'cfg': (text_embeddings_video_pos + text_embeddings_video_neg, text_embeddings_audio_pos + text_embeddings_audio_neg),
+            }
+        else:
+            cond_branches = {
+                'pos': (text_embeddings_video_pos, text_embeddings_audio_pos),
+                'neg': (text_embeddings_video_neg, text_embeddings_audio_neg),
+            }
+        return self.model.build_conditioning_cache(cond_branches)
+
+    def guided_predictions(self, requests, video_noise, audio_noise, timestep_input, cond_cache, step_caches=None):
+        """
+        One classifier-free guided evaluation of the fusion model for a batch of requests sharing
+        latent shape and i2v mode, at per-sample timesteps timestep_input [B].
+        Returns the lists of guided video and audio predictions.
+        """
+        batch_size = len(requests)
+        step_caches = step_caches or {}
+
+        # Calculate sequence lengths from actual latents
+        max_seq_len_audio = audio_noise[0].shape[0]  # L dimension from latents_audios shape [1, L, D]
+        _patch_size_h, _patch_size_w = self.model.video_model.patch_size[1], self.model.video_model.patch_size[2]
+        max_seq_len_video = video_noise[0].shape[1] * video_noise[0].shape[2] * video_noise[0].shape[3] // (_patch_size_h*_patch_size_w) # f * h * w from [1, c, f, h, w]
+
+        text_embeddings_video_pos = [r.text_embeddings[0] for r in requests]
+        text_embeddings_audio_pos = [r.text_embeddings[0] for r in requests]
+        text_embeddings_video_neg = [r.text_embeddings[1] for r in requests]
+        text_embeddings_audio_neg = [r.text_embeddings[2] for r in requests]
+        slg_layers = [r.slg_layer for r in requests]
+
+        num_clean_frames, num_clean_audio = self.clean_prefix_lengths(requests)
+        for r, v, a in zip(requests, video_noise, audio_noise):
+            self.pin_clean_prefix(r, v, a)
+
+        # both branches see the same latents and timesteps, compute the embeddings and the first
+        # block's self-attention once; with step caching each branch decides on its own whether to run
+        prefix = None
+        if not step_caches:
+            prefix = self.model.forward_prefix(
+                vid=video_noise, audio=audio_noise, t=timestep_input,
+                vid_seq_len=max_seq_len_video, audio_seq_len=max_seq_len_audio,
+                first_frame_is_clean=num_clean_frames, audio_clean_prefix=num_clean_audio)
+
+        if self.batched_cfg:
+            # Positive and negative passes as one batch, only the negative samples skip slg_layer
+            cfg_forward_args = {
+                'audio_context': text_embeddings_audio_pos + text_embeddings_audio_neg,
+                'vid_context': text_embeddings_video_pos + text_embeddings_video_neg,
+                'vid_seq_len': max_seq_len_video,
+                'audio_seq_len': max_seq_len_audio,
+                'first_frame_is_clean': num_clean_frames,
+                'audio_clean_prefix': num_clean_audio,
+                'slg_layer': [False] * batch_size + slg_layers,
+                'text_cond': cond_cache['cfg'],
+                'step_cache': step_caches.get('cfg'),
+                'prefix': prefix.repeat(2) if prefix is not None else None
+            }
+
+            pred_vid, pred_audio = self.model(
+                vid=video_noise + video_noise,
+                audio=audio_noise + audio_noise,
+                t=torch.cat([timestep_input, timestep_input]),
+                **cfg_forward_args
+            )
+            pred_vid_pos, pred_vid_neg = pred_vid[:batch_size], pred_vid[batch_size:]
+            pred_audio_pos, pred_audio_neg = pred_audio[:batch_size], pred_audio[batch_size:]
+        else:
+            # Positive (conditional) forward pass
+            pos_forward_args = {
+                'audio_context': text_embeddings_audio_pos,
+                'vid_context': text_embeddings_video_pos,
+                'vid_seq_len': max_seq_len_video,
+                'audio_seq_len': max_seq_len_audio,
+                'first_frame_is_clean': num_clean_frames,
+                'audio_clean_prefix': num_clean_audio,
+                'text_cond': cond_cache['pos'],
+                'step_cache': step_caches.get('pos'),
+                'prefix': prefix
+            }
+
+            pred_vid_pos, pred_audio_pos = self.model(
+                vid=video_noise,
+                audio=audio_noise,
+                t=timestep_input,
+                **pos_forward_args
+            )
+            
+            # Negative (unconditional) forward pass  
+            neg_forward_args = {
+                'audio_context': text_embeddings_audio_neg,
+                'vid_context': text_embeddings_video_neg,
+                'vid_seq_len': max_seq_len_video,
+                'audio_seq_len': max_seq_len_audio,
+                'first_frame_is_clean': num_clean_frames,
+                'audio_clean_prefix': num_clean_audio,
+                'slg_layer': slg_layers,
+                'text_cond': cond_cache['neg'],
+                'step_cache': step_caches.get('neg'),
+                'prefix': prefix
+            }
             
+            pred_vid_neg, pred_audio_neg = self.model(
+                vid=video_noise,
+                audio=audio_noise,
+                t=timestep_input,
+                **neg_forward_args
+            )
+
+        # Apply classifier-free guidance
+        pred_video_guided = [neg + r.video_guidance_scale * (pos - neg) for r, pos, neg in zip(requests, pred_vid_pos, pred_vid_neg)]
+        pred_audio_guided = [neg + r.audio_guidance_scale * (pos - neg) for r, pos, neg in zip(requests, pred_audio_pos, pred_audio_neg)]
+        return pred_video_guided, pred_audio_guided
+
+    @staticmethod
+    def clean_prefix_lengths(requests):
+        # clean leading video latent frames and audio latent tokens, shared by a batch
+        num_frames = {r.latents_images.shape[1] if r.is_i2v else 0 for r in requests}
+        num_audio = {r.audio_prefix.shape[0] if r.audio_prefix is not None else 0 for r in requests}
+        assert len(num_frames) == 1 and len(num_audio) == 1, "Requests of one batch must have the same clean prefix lengths"
+        return num_frames.pop(), num_audio.pop()
+
+    @staticmethod
+    def pin_clean_prefix(request, video_noise, audio_noise):
+        if request.is_i2v:
+            video_noise[:, :request.latents_images.shape[1]] = request.latents_images
+        if request.audio_prefix is not None:
+            audio_noise[:request.audio_prefix.shape[0]] = request.audio_prefix
+
+    def decode_latents(self, request, output_type="float", reuse_output_buffer=False):
+        with torch.amp.autocast('cuda', enabled=self.target_dtype != torch.float32, dtype=self.target_dtype):
+            # Decode audio
+            audio_latents_for_vae = request.audio_noise.unsqueeze(0).transpose(1, 2)  # 1, c, l
+            generated_audio = self.vae_model_audio.wrapped_decode(audio_latents_for_vae).squeeze()
+            if output_type == "uint8":
+                generated_audio = (generated_audio.float().clamp(-1, 1) * 32767).to(torch.int16)
+            generated_audio = self.to_host(generated_audio.float() if output_type == "float" else generated_audio, reuse_output_buffer)
+            
+            # Decode video  
+            video_latents_for_vae = request.video_noise.unsqueeze(0)  # 1, c, f, h, w
+            generated_video = self.vae_model_video.wrapped_decode(video_latents_for_vae).squeeze(0)  # c, f, h, w
+            if output_type == "uint8":
+                # same truncation as save_video, c, f, h, w -> f, h, w, c
+                generated_video = ((generated_video.float().clamp(-1, 1) + 1) / 2 * 255).to(torch.uint8).permute(1, 2, 3, 0).contiguous()
+            generated_video = self.to_host(generated_video.float() if output_type == "float" else generated_video, reuse_output_buffer)
+        return generated_video, generated_audio
+
+    def to_host(self, tensor, reuse_buffer=False):
+        if not reuse_buffer:
+            return tensor.cpu().numpy()
+        key = (tuple(tensor.shape), tensor.dtype)
+        buffer = self.host_buffers.get(key)
+        if buffer is None:
+            if len(self.host_buffers) >= 4:
+                self.host_buffers.clear()
+            buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+            self.host_buffers[key] = buffer
+        buffer.copy_(tensor)
+        return buffer.numpy()
+
     def offload_to_cpu(self, model):
         model = model.cpu()
         torch.cuda.synchronize()
@@ -0,0 +1,206 @@
+import time
+import queue
+import logging
+import threading
+import traceback
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+import torch
+
+from ovi.distributed_comms.parallel_states import get_sequence_parallel_state, nccl_info
+from ovi.ovi_fusion_engine import GenerationRequest
+from ovi.utils.io_utils import save_video
+
+_STOP = object()
+
+
+class PipelineJob:
+    """
+    A request travelling through the stages of a PipelineExecutor.
+    """
+
+    def __init__(self, request, future, output_path):
+        self.request = request
+        self.future = future
+        self.output_path = output_path  # None to return the MP4 bytes
+        self.event = None               # recorded on the producing stage's stream when the job is handed on
+        self.video = None
+        self.audio = None
+        self.timings = {}
+        self.submitted_at = time.time()
+
+
+class PipelineExecutor:
+    """
+    Staged execution of generations around an OviFusionEngine:
+
+        text   T5 embeddings, i2v first frame VAE encode, initial noise
+        denoise   the sampling loop, up to max_batch_size compatible requests per batch
+        decode    audio and video VAE decode to uint8 on the host
+        mux       ffmpeg encode to an MP4 file or bytes
+
+    Each stage runs in its own thread (and CUDA stream for the GPU stages) and the stages are
+    connected by bounded queues, so the decode and mux of request N overlap with the denoising of
+    request N + 1 while the text stage encodes the requests after it. Under steady load the
+    throughput is set by the denoise stage.
+
+    Usage:
+        pipeline = PipelineExecutor(engine).start()
+        mp4_bytes = pipeline.submit(dict(text_prompt=..., ...)).result()
+        pipeline.stop()
+    """
+
+    def __init__(self, engine, max_queue_size=2, max_batch_size=None, fps=24, sample_rate=16000):
+        assert not engine.cpu_offload, "The pipeline keeps all models resident, it does not support cpu_offload"
+        # denoise batches depend on queue timing, the ranks of an sp group would form different
+        # batches and issue mismatched collectives
+        assert not get_sequence_parallel_state(), "The pipeline does not support sequence parallelism"
+        self.engine = engine
+        self.max_batch_size = max_batch_size or engine.max_batch_size
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.inputs = queue.Queue()
+        # bounded: a stage that runs ahead blocks instead of piling up latents on the device
+        self.encoded = queue.Queue(maxsize=max_queue_size)
+        self.denoised = queue.Queue(maxsize=max_queue_size)
+        self.decoded = queue.Queue(maxsize=max_queue_size)
+        # the video VAE is used by the text (i2v encode) and decode stages, its caches are not thread safe
+        self.vae_lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, request, output_path=None):
+        """
+        Queue a GenerationRequest (or dict of generate() arguments). Returns a Future of output_path,
+        or of the MP4 bytes if output_path is None.
+        """
+        if not isinstance(request, GenerationRequest):
+            request = GenerationRequest(**request)
+        future = Future()
+        self.inputs.put(PipelineJob(request, future, output_path))
+        return future
+
+    def start(self):
+        stages = [
+            ("text", self.inputs, self.encoded, self.text_stage),
+            ("denoise", self.encoded, self.denoised, self.denoise_stage),
+            ("decode", self.denoised, self.decoded, self.decode_stage),
+            ("mux", self.decoded, None, self.mux_stage),
+        ]
+        for name, in_queue, out_queue, fn in stages:
+            thread = threading.Thread(target=self.run_stage, args=(name, in_queue, out_queue, fn),
+                                      name=f"ovi-pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        """
+        Finish every submitted job, then stop the stage threads.
+        """
+        self.inputs.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    @torch.inference_mode()
+    def run_stage(self, name, in_queue, out_queue, fn):
+        if isinstance(self.engine.device, int) and torch.cuda.is_available():
+            torch.cuda.set_device(self.engine.device)
+        stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+        while True:
+            jobs = self.take(in_queue, name)
+            stop = jobs[-1] is _STOP
+            jobs = [job for job in jobs if job is not _STOP]
+            if jobs:
+                with torch.cuda.stream(stream) if stream is not None else nullcontext():
+                    for job in jobs:
+                        if job.event is not None:
+                            # inputs of this job were produced on another stage's stream
+                            torch.cuda.current_stream().wait_event(job.event)
+                            record_request_stream(job.request, torch.cuda.current_stream())
+                    start = time.time()
+                    try:
+                        fn(jobs)
+                    except Exception as e:
+                        logging.error(traceback.format_exc())
+                        for job in jobs:
+                            job.future.set_exception(e)
+                        jobs = []
+                    if stream is not None:
+                        for job in jobs:
+                            job.event = torch.cuda.Event()
+                            job.event.record(stream)
+                for job in jobs:
+                    job.timings[name] = time.time() - start
+                    if out_queue is not None:
+                        out_queue.put(job)
+            if stop:
+                if out_queue is not None:
+                    out_queue.put(_STOP)
+                return
+
+    def take(self, in_queue, name):
+        jobs = [in_queue.get()]
+        if name != "denoise" or jobs[0] is _STOP:
+            return jobs
+        # batch whatever compatible work is already waiting, never wait for more
+        key = self.batch_key(jobs[0].request)
+        while len(jobs) < self.max_batch_size and in_queue.qsize():
+            # only this thread takes from the queue, peeking at its head is safe
+            job = in_queue.queue[0]
+            if job is _STOP or self.batch_key(job.request) != key:
+                break
+            jobs.append(in_queue.get_nowait())
+        return jobs
+
+    @staticmethod
+    def batch_key(request):
+        # requests of one denoise batch must also resume from the same step
+        return (request.latent_hw, request.is_i2v, request.sample_steps, request.start_step)
+
+    def text_stage(self, jobs):
+        engine = self.engine
+        requests = [job.request for job in jobs]
+        for request in requests:
+            engine.prepare_request(request)
+        engine.encode_text(requests)
+        with self.vae_lock:
+            engine.encode_first_frames(requests)
+        for request in requests:
+            engine.init_noise(request)
+
+    def denoise_stage(self, jobs):
+        self.engine.denoise([job.request for job in jobs])
+
+    def decode_stage(self, jobs):
+        for job in jobs:
+            if nccl_info.rank_within_group != 0:
+                # only the group leader writes outputs
+                job.request.video_noise = job.request.audio_noise = job.request.text_embeddings = None
+                continue
+            with self.vae_lock:
+                job.video, job.audio = self.engine.decode_latents(job.request, output_type="uint8")
+            # latents and conditioning are no longer needed
+            job.request.video_noise = job.request.audio_noise = job.request.text_embeddings = None
+
+    def mux_stage(self, jobs):
+        for job in jobs:
+            if nccl_info.rank_within_group != 0:
+                job.future.set_result(None)
+                continue
+            output = save_video(job.output_path, job.video, job.audio, fps=self.fps, sample_rate=self.sample_rate)
+            job.video = job.audio = None
+            job.timings["total"] = time.time() - job.submitted_at
+            logging.info("Pipeline job done: " + ", ".join(f"{k} {v:.1f}s" for k, v in job.timings.items()))
+            job.future.set_result(output)
+
+
+def record_request_stream(request, stream):
+    # device tensors of a request are handed between stage streams, keep their memory alive for this one
+    tensors = [request.first_frame, request.latents_images, request.video_noise, request.audio_noise]
+    tensors += list(request.text_embeddings or [])
+    for tensor in tensors:
+        if isinstance(tensor, torch.Tensor) and tensor.is_cuda:
+            tensor.record_stream(stream)
+
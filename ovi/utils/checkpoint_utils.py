@@ -0,0 +1,91 @@
+import os
+import logging
+
+import torch
+
+from ovi.utils.job_utils import file_sha1
+
+CHECKPOINT_VERSION = 2
+
+# mutable sampling state of FlowUniPCMultistepScheduler, FlowDPMSolverMultistepScheduler and
+# FlowMatchEulerDiscreteScheduler, everything else is rebuilt by set_timesteps
+SCHEDULER_STATE_KEYS = ("model_outputs", "timestep_list", "lower_order_nums", "last_sample", "this_order",
+                        "_step_index", "_begin_index")
+
+
+def _map_tensors(value, fn):
+    if isinstance(value, torch.Tensor):
+        return fn(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_tensors(u, fn) for u in value)
+    return value
+
+
+def scheduler_state(scheduler):
+    return {key: _map_tensors(getattr(scheduler, key), lambda t: t.detach().cpu())
+            for key in SCHEDULER_STATE_KEYS if hasattr(scheduler, key)}
+
+
+def load_scheduler_state(scheduler, state, device):
+    for key, value in state.items():
+        setattr(scheduler, key, _map_tensors(value, lambda t: t.to(device)))
+
+
+def request_fingerprint(request, engine_settings=None):
+    """
+    Everything the sampling trajectory depends on, a snapshot of a different request is not resumed:
+    the sampling parameters, the content of the first frame image and engine_settings, a dict of the
+    engine configuration that changes the sampling path (model, step caching, sparse attention).
+    """
+    return {
+        "text_prompt": request.text_prompt,
+        "image": file_sha1(request.image_path) if request.image_path else None,
+        "seed": request.seed,
+        "solver_name": request.solver_name,
+        "sample_steps": request.sample_steps,
+        "shift": request.shift,
+        "video_guidance_scale": request.video_guidance_scale,
+        "audio_guidance_scale": request.audio_guidance_scale,
+        "slg_layer": request.slg_layer,
+        "video_negative_prompt": request.video_negative_prompt,
+        "audio_negative_prompt": request.audio_negative_prompt,
+        "latent_hw": list(request.latent_hw),
+        "engine": engine_settings or {},
+    }
+
+
+def save_sampling_checkpoint(path, request, step, scheduler_video, scheduler_audio, engine_settings=None):
+    """
+    Snapshot of a request after `step` completed sampling steps: its latents and the state of both
+    schedulers. With step == sample_steps it holds the final latents, ready to be decoded again.
+    """
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "step": step,
+        "request": request_fingerprint(request, engine_settings),
+        "video_noise": request.video_noise.detach().cpu(),
+        "audio_noise": request.audio_noise.detach().cpu(),
+        "scheduler_video": scheduler_state(scheduler_video),
+        "scheduler_audio": scheduler_state(scheduler_audio),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # write then rename, a preemption during the save keeps the previous snapshot
+    tmp_path = f"{path}.tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_sampling_checkpoint(path, request, engine_settings=None):
+    """
+    The snapshot at path if it exists and was written for this request and engine_settings, None otherwise.
+    """
+    if not os.path.exists(path):
+        return None
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        logging.warning(f"Ignoring sampling checkpoint {path} of version {checkpoint.get('version')}")
+        return None
+    if checkpoint["request"] != request_fingerprint(request, engine_settings):
+        logging.warning(f"Ignoring sampling checkpoint {path}, it was written for different generation parameters")
+        return None
+    return checkpoint
@@ -1,9 +1,184 @@
+import os
+import time
+import errno
+import shutil
 import tempfile
-from typing import Optional
+import threading
+import subprocess
+from typing import Iterable, Optional, Union
 
 import numpy as np
-from moviepy.editor import ImageSequenceClip, AudioFileClip
-from scipy.io import wavfile
+
+
+def find_ffmpeg() -> str:
+    path = shutil.which("ffmpeg")
+    if path is None:
+        try:
+            # shipped with moviepy/imageio
+            import imageio_ffmpeg
+            path = imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            raise RuntimeError("ffmpeg was not found on PATH and imageio_ffmpeg is not installed")
+    return path
+
+
+def audio_to_int16(audio_numpy: np.ndarray) -> np.ndarray:
+    """
+    Interleaved (N, channels) int16 samples from a 1D array or a (channels, N) / (N, channels) array,
+    float audio must be in range [-1, 1].
+    """
+    if audio_numpy.ndim == 1:
+        audio_numpy = audio_numpy[:, None]
+    elif audio_numpy.shape[0] < audio_numpy.shape[1]:
+        audio_numpy = audio_numpy.T
+    if audio_numpy.dtype != np.int16:
+        assert np.abs(audio_numpy).max() <= 1.0, "audio_numpy values must be in range [-1, 1]"
+        audio_numpy = (audio_numpy * 32767).astype(np.int16)
+    return np.ascontiguousarray(audio_numpy)
+
+
+def _write_fifo(path, data, proc):
+    # non-blocking open so a crashed ffmpeg that never opens the pipe does not hang the thread
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO or proc.poll() is not None:
+                return
+            time.sleep(0.01)
+    os.set_blocking(fd, True)
+    with os.fdopen(fd, "wb") as f:
+        try:
+            for chunk in ([data] if isinstance(data, bytes) else data):
+                f.write(chunk)
+        except BrokenPipeError:
+            pass
+
+
+def _drain(stream, out):
+    for chunk in iter(lambda: stream.read(1 << 16), b""):
+        out.append(chunk)
+
+
+def mux_video(
+    output_path: Optional[str],
+    frames: Union[np.ndarray, Iterable[np.ndarray]],
+    audio_numpy: Optional[Union[np.ndarray, Iterable[np.ndarray]]] = None,
+    sample_rate: int = 16000,
+    fps: int = 24,
+    preset: str = "medium",
+    crf: Optional[int] = None,
+    threads: Optional[int] = None,
+    audio_channels: int = 1,
+    num_frames: Optional[int] = None,
+) -> Union[str, bytes]:
+    """
+    Encode uint8 frames and an optional audio track into an H.264/AAC MP4 with a single ffmpeg process.
+
+    Frames are piped as raw rgb24 through stdin, the audio as s16le through a named pipe (a temporary
+    raw file where named pipes are not available), so nothing is re-encoded or staged as WAV.
+
+    Args:
+        output_path (Optional[str]): Path to the output MP4 file, None to return the MP4 as bytes
+                                     (fragmented MP4, which does not need a seekable output).
+        frames: uint8 array of shape (F, H, W, 3), or an iterable of (H, W, 3) frames or (f, H, W, 3) chunks.
+        audio_numpy: Audio samples, float in range [-1, 1] or int16. May also be an iterable of sample
+                     chunks that is consumed while encoding, e.g. produced along with the frames.
+        sample_rate (int): Sample rate of the audio in Hz.
+        fps (int): Frames per second for the video.
+        preset (str): x264 preset.
+        crf (Optional[int]): x264 constant rate factor, None keeps the x264 default.
+        threads (Optional[int]): Encoder threads, None lets ffmpeg decide.
+        audio_channels (int): Number of channels of chunked audio, an array's own shape is used otherwise.
+        num_frames (Optional[int]): Number of frames of an iterable of frames. The audio is padded with
+                                    silence or cut to the duration of the frames when it is known, the
+                                    video is never cut to the audio.
+
+    Returns:
+        output_path, or the encoded MP4 bytes if output_path is None.
+    """
+    if isinstance(frames, np.ndarray):
+        num_frames = frames.shape[0]
+    frames = iter(frames)
+    first = np.asarray(next(frames))
+    assert first.dtype == np.uint8 and first.shape[-1] == 3, "frames must be uint8 with shape (..., H, W, 3)"
+    height, width = first.shape[-3], first.shape[-2]
+
+    cmd = [find_ffmpeg(), "-y", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0"]
+
+    tmp_dir = None
+    audio_bytes = None
+    if audio_numpy is not None:
+        use_fifo = hasattr(os, "mkfifo")
+        if isinstance(audio_numpy, np.ndarray):
+            audio_numpy = audio_to_int16(audio_numpy)
+            audio_channels = audio_numpy.shape[1]
+            audio_bytes = audio_numpy.tobytes()
+        else:
+            # chunks are converted as the fifo writer reaches them
+            audio_bytes = (audio_to_int16(chunk).tobytes() for chunk in audio_numpy)
+            if not use_fifo:
+                audio_bytes = b"".join(audio_bytes)
+        tmp_dir = tempfile.mkdtemp(prefix="ovi_mux_")
+        audio_path = os.path.join(tmp_dir, "audio.s16le")
+        if use_fifo:
+            os.mkfifo(audio_path)
+        else:
+            with open(audio_path, "wb") as f:
+                f.write(audio_bytes)
+        cmd += ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(audio_channels), "-i", audio_path]
+
+    cmd += ["-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p"]
+    if crf is not None:
+        cmd += ["-crf", str(crf)]
+    if threads is not None:
+        cmd += ["-threads", str(threads)]
+    if audio_numpy is not None:
+        if num_frames is not None:
+            # exactly the samples of num_frames / fps seconds
+            num_samples = round(num_frames * sample_rate / fps)
+            cmd += ["-af", f"apad=whole_len={num_samples},atrim=end_sample={num_samples}"]
+        cmd += ["-c:a", "aac"]
+    if output_path is None:
+        cmd += ["-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"]
+    else:
+        cmd += [output_path]
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = [], []
+    workers = [threading.Thread(target=_drain, args=(proc.stdout, stdout), daemon=True),
+               threading.Thread(target=_drain, args=(proc.stderr, stderr), daemon=True)]
+    if audio_bytes is not None and use_fifo:
+        workers.append(threading.Thread(target=_write_fifo, args=(audio_path, audio_bytes, proc), daemon=True))
+    for worker in workers:
+        worker.start()
+
+    finished = False
+    try:
+        try:
+            proc.stdin.write(np.ascontiguousarray(first).data)
+            for chunk in frames:
+                proc.stdin.write(np.ascontiguousarray(chunk, dtype=np.uint8).data)
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+        finished = proc.wait() == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        # the audio writer of a failed mux can be stuck on its producer, do not wait for it forever
+        for worker in workers:
+            worker.join(timeout=None if finished else 10)
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with code {proc.returncode}: {b''.join(stderr).decode(errors='replace')}")
+    return output_path if output_path is not None else b"".join(stdout)
 
 
 def save_video(
@@ -12,17 +187,23 @@ def save_video(
     audio_numpy: Optional[np.ndarray] = None,
     sample_rate: int = 16000,
     fps: int = 24,
-) -> str:
+    preset: str = "medium",
+    crf: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> Union[str, bytes]:
     """
     Combine a sequence of video frames with an optional audio track and save as an MP4.
 
     Args:
-        output_path (str): Path to the output MP4 file.
+        output_path (str): Path to the output MP4 file, None to return the MP4 as bytes.
         video_numpy (np.ndarray): Numpy array of frames. Shape (C, F, H, W).
                                   Values can be in range [-1, 1] or [0, 255].
-        audio_numpy (Optional[np.ndarray]): 1D or 2D numpy array of audio samples, range [-1, 1].
+                                  uint8 frames of shape (F, H, W, 3), e.g. from generate(output_type="uint8"),
+                                  are passed to ffmpeg as they are.
+        audio_numpy (Optional[np.ndarray]): 1D or 2D numpy array of audio samples, range [-1, 1], or int16.
         sample_rate (int): Sample rate of the audio in Hz. Defaults to 16000.
         fps (int): Frames per second for the video. Defaults to 24.
+        preset, crf, threads: x264 encoder settings, see mux_video.
 
     Returns:
         str: Path to the saved MP4 file.
@@ -30,46 +211,30 @@ def save_video(
 
     # Validate inputs
     assert isinstance(video_numpy, np.ndarray), "video_numpy must be a numpy array"
-    assert video_numpy.ndim == 4, "video_numpy must have shape (C, F, H, W)"
-    assert video_numpy.shape[0] in {1, 3}, "video_numpy must have 1 or 3 channels"
-
     if audio_numpy is not None:
         assert isinstance(audio_numpy, np.ndarray), "audio_numpy must be a numpy array"
-        assert np.abs(audio_numpy).max() <= 1.0, "audio_numpy values must be in range [-1, 1]"
-
-    # Reorder dimensions: (C, F, H, W) → (F, H, W, C)
-    video_numpy = video_numpy.transpose(1, 2, 3, 0)
-
-    # Normalize frames if values are in [-1, 1]
-    if video_numpy.max() <= 1.0:
-        video_numpy = np.clip(video_numpy, -1, 1)
-        video_numpy = ((video_numpy + 1) / 2 * 255).astype(np.uint8)
-    else:
-        video_numpy = video_numpy.astype(np.uint8)
 
-    # Convert numpy array to a list of frames
-    frames = list(video_numpy)
+    if video_numpy.dtype == np.uint8 and video_numpy.ndim == 4 and video_numpy.shape[-1] == 3:
+        return mux_video(output_path, video_numpy, audio_numpy, sample_rate=sample_rate, fps=fps,
+                         preset=preset, crf=crf, threads=threads)
 
-    # Create video clip
-    clip = ImageSequenceClip(frames, fps=fps)
+    assert video_numpy.ndim == 4, "video_numpy must have shape (C, F, H, W)"
+    assert video_numpy.shape[0] in {1, 3}, "video_numpy must have 1 or 3 channels"
 
-    # Add audio if provided
-    if audio_numpy is not None:
-        with tempfile.NamedTemporaryFile(suffix=".wav", mode='wb', delete=False) as temp_audio_file:
-            wavfile.write(
-                temp_audio_file.name,
-                sample_rate,
-                (audio_numpy * 32767).astype(np.int16),
-            )
-            audio_clip = AudioFileClip(temp_audio_file.name)
-            final_clip = clip.set_audio(audio_clip)
-    else:
-        final_clip = clip
+    # Normalize frames if values are in [-1, 1]
+    normalize = video_numpy.max() <= 1.0
 
-    # Write final video to disk
-    final_clip.write_videofile(
-        output_path, codec="libx264", audio_codec="aac", fps=fps, verbose=False, logger=None
-    )
-    final_clip.close()
+    def frames():
+        # one frame at a time: (C, H, W) -> (H, W, 3) uint8
+        for i in range(video_numpy.shape[1]):
+            frame = video_numpy[:, i].transpose(1, 2, 0)
+            if normalize:
+                frame = ((np.clip(frame, -1, 1) + 1) / 2 * 255).astype(np.uint8)
+            else:
+                frame = frame.astype(np.uint8)
+            if frame.shape[-1] == 1:
+                frame = np.repeat(frame, 3, axis=-1)
+            yield frame
 
-    return output_path
\ No newline at end of file
+    return mux_video(output_path, frames(), audio_numpy, sample_rate=sample_rate, fps=fps,
+                     preset=preset, crf=crf, threads=threads, num_frames=video_numpy.shape[1])
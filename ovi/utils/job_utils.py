@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+from collections.abc import Mapping, Sequence
+
+from ovi.utils.processing_utils import format_prompt_for_filename
+
+# request fields that change the generated sample
+JOB_HASH_FIELDS = ("text_prompt", "video_frame_height_width", "seed", "solver_name", "sample_steps", "shift",
+                   "video_guidance_scale", "audio_guidance_scale", "slg_layer",
+                   "video_negative_prompt", "audio_negative_prompt")
+# engine config keys that change the generated sample
+JOB_CONFIG_FIELDS = ("model_name", "mode", "step_cache_threshold", "sparse_attention", "batched_cfg", "fp8", "qint8",
+                     "attention_backend")
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def plain(value):
+    # config values (e.g. OmegaConf containers) as json serializable python objects
+    if isinstance(value, Mapping):
+        return {str(k): plain(v) for k, v in value.items()}
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        return [plain(v) for v in value]
+    return value
+
+
+def job_hash(request, config):
+    """
+    Content hash of a generate() request dict: prompt, image content, seed and sampling parameters,
+    plus the JOB_CONFIG_FIELDS of the engine config (model, mode, quantization, attention and step
+    caching settings). Independent of the CSV order, the rank and the world size.
+    """
+    content = {field: request.get(field) for field in JOB_HASH_FIELDS}
+    content["video_frame_height_width"] = list(content["video_frame_height_width"] or []) or None
+    content["image"] = file_sha1(request["image_path"]) if request.get("image_path") else None
+    content["config"] = {field: plain(config.get(field)) for field in JOB_CONFIG_FIELDS}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def job_output_path(output_dir, request, job_id):
+    # readable prefix, the hash keeps names unique and stable across runs
+    return os.path.join(output_dir, f"{format_prompt_for_filename(request['text_prompt'])}_{request['seed']}_{job_id[:12]}.mp4")
+
+
+class JobManifest:
+    """
+    Append-only JSONL record of finished jobs, shared by all ranks through an exclusive file lock.
+
+    A job counts as done if its last record is "done" and its output still exists with the recorded
+    size, so deleted or truncated outputs are generated again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.reload()
+
+    def reload(self):
+        self.records = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn last line of a killed writer
+                        continue
+                    self.records[record["job_id"]] = record
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_done(self, job_id):
+        record = self.records.get(job_id)
+        if record is None or record.get("status") != "done":
+            return False
+        output_path = record.get("output_path")
+        return output_path is not None and os.path.isfile(output_path) and os.path.getsize(output_path) == record.get("bytes")
+
+    def append(self, job_id, status, **fields):
+        record = {"job_id": job_id, "status": status, "time": time.time(), **fields}
+        line = json.dumps(record) + "\n"
+        with open(self.path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.records[job_id] = record
+        return record
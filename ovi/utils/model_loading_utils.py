@@ -1,7 +1,8 @@
 import torch 
 import os
 import json
-from safetensors.torch import load_file
+import time
+from safetensors import safe_open
 
 from ovi.modules.fusion import FusionModel
 from ovi.modules.t5 import T5EncoderModel
@@ -77,25 +78,71 @@ def init_text_model(ckpt_dir, rank, cpu_offload=False):
     return text_encoder
 
 
-def load_fusion_checkpoint(model, checkpoint_path, from_meta=False):
+def assign_tensor(model, key, tensor, from_meta=False):
+    module_name, _, name = key.rpartition(".")
+    module = model.get_submodule(module_name)
+    if name in module._parameters:
+        param = module._parameters[name]
+        assert param.shape == tensor.shape, f"Shape mismatch for {key}: checkpoint {tuple(tensor.shape)}, model {tuple(param.shape)}"
+        if from_meta:
+            module._parameters[name] = torch.nn.Parameter(tensor, requires_grad=param.requires_grad)
+        else:
+            param.data = tensor
+    elif name in module._buffers:
+        assert module._buffers[name].shape == tensor.shape, f"Shape mismatch for {key}"
+        module._buffers[name] = tensor
+    else:
+        raise RuntimeError(f"Unexpected key {key} in fusion checkpoint")
+
+
+def load_fusion_checkpoint(model, checkpoint_path, from_meta=False, device="cpu", dtype=None):
+    """
+    Load the fusion checkpoint tensor by tensor, each one is cast to `dtype` (floating point tensors
+    only, None keeps the checkpoint dtype e.g. for fp8) and moved to `device` before the next one is
+    read. Safetensors checkpoints are memory-mapped, so host memory never holds more than one tensor
+    on top of the page cache. Works with a meta-initialized model.
+    """
     if checkpoint_path and os.path.exists(checkpoint_path):
+        expected = set(model.state_dict().keys())
+
+        def materialize(tensor):
+            if dtype is not None and tensor.is_floating_point():
+                return tensor.to(device=device, dtype=dtype)
+            return tensor.to(device=device)
+
+        start = time.time()
+        num_bytes = 0
         if checkpoint_path.endswith(".safetensors"): 
-            df = load_file(checkpoint_path, device="cpu")
+            with safe_open(checkpoint_path, framework="pt", device="cpu") as f:
+                keys = list(f.keys())
+                for i, key in enumerate(keys):
+                    tensor = materialize(f.get_tensor(key))
+                    num_bytes += tensor.numel() * tensor.element_size()
+                    assign_tensor(model, key, tensor, from_meta)
+                    expected.discard(key)
+                    if (i + 1) % max(1, len(keys) // 10) == 0 or i + 1 == len(keys):
+                        elapsed = time.time() - start
+                        print(f"Loaded {i + 1}/{len(keys)} tensors, {num_bytes / 1e9:.2f} GB in {elapsed:.1f}s ({num_bytes / 1e9 / max(elapsed, 1e-6):.2f} GB/s)")
         elif checkpoint_path.endswith(".pt"):
             try:
-                df = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+                df = torch.load(checkpoint_path, map_location="cpu", weights_only=False, mmap=True)
                 df = df['module'] if 'module' in df else df
             except Exception as e:
-                df = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+                df = torch.load(checkpoint_path, map_location="cpu", weights_only=True, mmap=True)
                 df = df['app']['model']
+            for key in list(df.keys()):
+                tensor = materialize(df.pop(key))
+                num_bytes += tensor.numel() * tensor.element_size()
+                assign_tensor(model, key, tensor, from_meta)
+                expected.discard(key)
+            del df
         else: 
             raise RuntimeError("We only support .safetensors and .pt checkpoints")
 
-        missing, unexpected = model.load_state_dict(df, strict=True, assign=from_meta)
+        if expected:
+            raise RuntimeError(f"Missing keys in fusion checkpoint {checkpoint_path}: {sorted(expected)}")
 
-        del df
-        import gc
-        gc.collect()
-        print(f"Successfully loaded fusion checkpoint from {checkpoint_path}")
+        elapsed = time.time() - start
+        print(f"Successfully loaded fusion checkpoint from {checkpoint_path}, {num_bytes / 1e9:.2f} GB in {elapsed:.1f}s ({num_bytes / 1e9 / max(elapsed, 1e-6):.2f} GB/s)")
     else: 
-        raise RuntimeError("{checkpoint=} does not exists'")
\ No newline at end of file
+        raise RuntimeError(f"{checkpoint_path=} does not exists'")
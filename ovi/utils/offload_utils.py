@@ -0,0 +1,98 @@
+import time
+import itertools
+import logging
+import torch
+
+
+class BlockOffloader:
+    """
+    Sequential offload of the FusionModel transformer blocks.
+
+    The block pairs (video_model.blocks[i], audio_model.blocks[i]) stay in pinned host memory and
+    are uploaded on a side stream right before they run, while block i runs block i + 1 is
+    prefetched. Parameters are swapped in place through `p.data`, so the modules themselves never
+    move. Everything outside the blocks (patch/text/time embeddings, heads) lives on the device.
+    Peak VRAM is about two block pairs plus activations.
+    """
+
+    def __init__(self, model, device):
+        self.device = torch.device("cuda", device) if isinstance(device, int) else torch.device(device)
+        assert self.device.type == "cuda", "Sequential offload needs a cuda device"
+        self.num_blocks = model.num_blocks
+
+        start = time.time()
+        self.params = []
+        self.host_tensors = []
+        block_param_ids = set()
+        for vid_block, audio_block in zip(model.video_model.blocks, model.audio_model.blocks):
+            params = list(itertools.chain(vid_block.parameters(), vid_block.buffers(),
+                                          audio_block.parameters(), audio_block.buffers()))
+            host_tensors = []
+            for p in params:
+                host = p.data.cpu().pin_memory()
+                p.data = host
+                host_tensors.append(host)
+                block_param_ids.add(id(p))
+            self.params.append(params)
+            self.host_tensors.append(host_tensors)
+
+        for p in itertools.chain(model.parameters(), model.buffers()):
+            if id(p) not in block_param_ids:
+                p.data = p.data.to(self.device)
+
+        self.stream = torch.cuda.Stream(device=self.device)
+        # block index -> (device tensors, event recorded after their upload)
+        self.pending = {}
+        # block indices currently swapped in
+        self.resident = set()
+        self.transferred_bytes = 0
+        block_bytes = sum(t.numel() * t.element_size() for t in self.host_tensors[0])
+        logging.info(f"Sequential offload: {self.num_blocks} block pairs pinned on host, {block_bytes / 1e9:.2f} GB per pair, set up in {time.time() - start:.1f}s")
+
+    def prefetch(self, i):
+        if i in self.pending or i in self.resident:
+            return
+        # plain tensors even under inference_mode, they are swapped into nn.Parameters
+        with torch.inference_mode(False), torch.cuda.stream(self.stream):
+            tensors = [t.to(self.device, non_blocking=True) for t in self.host_tensors[i]]
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self.transferred_bytes += sum(t.numel() * t.element_size() for t in tensors)
+        self.pending[i] = (tensors, event)
+
+    def acquire(self, i, next_block=None):
+        """
+        Make block pair i resident on the device and start uploading next_block, i + 1 by default.
+        Callers that skip blocks (e.g. skip layer guidance) pass the next block that actually runs.
+        """
+        if next_block is None:
+            next_block = (i + 1) % self.num_blocks
+        if i in self.resident:
+            self.prefetch(next_block)
+            return
+        self.prefetch(i)
+        tensors, event = self.pending.pop(i)
+        # uploads behind i were for blocks that were skipped, the ones ahead may still run
+        for j in [j for j in self.pending if j < i and j != next_block]:
+            del self.pending[j]
+
+        compute_stream = torch.cuda.current_stream(self.device)
+        compute_stream.wait_event(event)
+        for p, t in zip(self.params[i], tensors):
+            # allocated on the side stream, keep the memory alive until compute is done with it
+            t.record_stream(compute_stream)
+            p.data = t
+        self.resident.add(i)
+        self.prefetch(next_block)
+
+    def release(self, i):
+        """
+        Point block pair i back at its pinned host copy, the device copy is freed.
+        """
+        for p, host in zip(self.params[i], self.host_tensors[i]):
+            p.data = host
+        self.resident.discard(i)
+
+    def clear(self):
+        # drop the prefetch of the next step's first block, e.g. before decoding
+        self.pending.clear()
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+
+def key_name(key):
+    # file and tensor name of a key
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def to_host(embedding):
+    # pinned when a device is around, so the copies back to it are asynchronous
+    embedding = embedding.detach().cpu().contiguous()
+    return embedding.pin_memory() if torch.cuda.is_available() else embedding
+
+
+class TextEmbeddingCache:
+    """
+    LRU cache of T5 text embeddings. Keys are the tokenizer-normalized text prefixed with the T5
+    checkpoint and dtypes (see OviFusionEngine.text_key), so a shared cache_dir never serves
+    embeddings of a different text model.
+
+    Embeddings ([L, C], already trimmed to the prompt length) are kept in pinned host memory and the
+    memory tier is bounded by max_bytes. With cache_dir, every embedding is also written to
+    <cache_dir>/<sha1 of key>.safetensors and looked up there on a memory miss.
+    """
+
+    def __init__(self, max_bytes=1024**3, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key_name(key) + ".safetensors")
+
+    def get(self, key):
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+        if self.cache_dir is not None and os.path.exists(self.path(key)):
+            embedding = to_host(load_file(self.path(key))["embedding"])
+            self._insert(key, embedding)
+            with self.lock:
+                self.hits += 1
+            return embedding
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        embedding = to_host(embedding)
+        self._insert(key, embedding)
+        if self.cache_dir is not None and not os.path.exists(self.path(key)):
+            # write then rename, concurrent workers may share the directory
+            tmp_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            save_file({"embedding": embedding}, tmp_path)
+            os.replace(tmp_path, self.path(key))
+        return embedding
+
+    def _insert(self, key, embedding):
+        size = embedding.numel() * embedding.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = embedding
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.numel() * evicted.element_size()
+
+    def log_stats(self):
+        logging.info(f"Text embedding cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries, {self.nbytes / 1e6:.1f} MB")
+
+
+class TextEmbeddingStore:
+    """
+    Read-only embeddings of a pre-encoded prompt set in a single safetensors file.
+
+    The file is memory-mapped, an embedding is only read from disk when it is looked up.
+    Keys are as in TextEmbeddingCache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = safe_open(path, framework="pt", device="cpu")
+        self.names = set(self.file.keys())
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, key):
+        name = key_name(key)
+        if name not in self.names:
+            return None
+        with self.lock:
+            return self.file.get_tensor(name)
+
+    @staticmethod
+    def write(path, embeddings):
+        """
+        Write a dict of key -> [L, C] embedding.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        save_file({key_name(key): embedding.detach().cpu().contiguous() for key, embedding in embeddings.items()}, tmp_path)
+        os.replace(tmp_path, path)
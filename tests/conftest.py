@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the ovi package from the repository root, also when pytest is started elsewhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
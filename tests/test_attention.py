@@ -0,0 +1,95 @@
+import pytest
+import torch
+
+from ovi.modules import attention as attention_module
+from ovi.modules.attention import ATTENTION_BACKENDS, attention, dense_lens, pad_packed, set_attention_backend
+
+
+def reference_attention(q, k, v, q_lens, k_lens):
+    # direct softmax attention of every sample over its valid keys, padded query rows are zero
+    out = torch.zeros(*q.shape[:3], v.size(-1), dtype=torch.float64)
+    for b in range(q.size(0)):
+        lq, lk = int(q_lens[b]), int(k_lens[b])
+        q_b, k_b, v_b = (u.transpose(0, 1).double() for u in (q[b, :lq], k[b, :lk], v[b, :lk]))
+        scores = torch.matmul(q_b, k_b.transpose(-1, -2)) * q.size(-1)**-0.5
+        out[b, :lq] = torch.matmul(scores.softmax(dim=-1), v_b).transpose(0, 1)
+    return out
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    set_attention_backend(None)
+
+
+@pytest.mark.parametrize("chunk_bytes", [None, 4096])
+def test_math_backend_matches_softmax_attention(monkeypatch, chunk_bytes):
+    if chunk_bytes is not None:
+        # several query chunks per call
+        monkeypatch.setattr(attention_module, "MATH_ATTENTION_CHUNK_BYTES", chunk_bytes)
+    torch.manual_seed(0)
+    q = torch.randn(2, 11, 2, 8)
+    k = torch.randn(2, 13, 2, 8)
+    v = torch.randn(2, 13, 2, 8)
+    q_lens = torch.tensor([11, 6], dtype=torch.int32)
+    k_lens = torch.tensor([9, 13], dtype=torch.int32)
+    set_attention_backend('math')
+    out = attention(q, k, v, q_lens=q_lens, k_lens=k_lens, dtype=torch.float32)
+    torch.testing.assert_close(out.double(), reference_attention(q, k, v, q_lens, k_lens), atol=1e-5, rtol=1e-5)
+
+
+def test_math_backend_repeats_kv_heads():
+    torch.manual_seed(0)
+    q = torch.randn(1, 5, 4, 8)
+    k = torch.randn(1, 7, 2, 8)
+    v = torch.randn(1, 7, 2, 8)
+    set_attention_backend('math')
+    out = attention(q, k, v, dtype=torch.float32)
+    expected = reference_attention(q, k.repeat_interleave(2, dim=2), v.repeat_interleave(2, dim=2),
+                                   torch.tensor([5]), torch.tensor([7]))
+    torch.testing.assert_close(out.double(), expected, atol=1e-5, rtol=1e-5)
+
+
+def test_sdpa_backend_matches_math():
+    torch.manual_seed(0)
+    q = torch.randn(2, 10, 2, 8)
+    k = torch.randn(2, 10, 2, 8)
+    v = torch.randn(2, 10, 2, 8)
+    q_lens = torch.tensor([10, 4], dtype=torch.int32)
+    k_lens = torch.tensor([7, 10], dtype=torch.int32)
+    set_attention_backend('sdpa')
+    out = attention(q, k, v, q_lens=q_lens, k_lens=k_lens, dtype=torch.float32)
+    torch.testing.assert_close(out.double(), reference_attention(q, k, v, q_lens, k_lens), atol=1e-5, rtol=1e-5)
+
+
+def test_cpu_padded_batches_fall_back_to_math():
+    # automatic selection on cpu: sdpa for dense batches, math once keys are masked
+    torch.manual_seed(0)
+    q = torch.randn(2, 6, 2, 8)
+    k_lens = torch.tensor([6, 3], dtype=torch.int32)
+    out = attention(q, q, q, k_lens=k_lens, dtype=torch.float32)
+    expected = reference_attention(q, q, q, torch.tensor([6, 6]), k_lens)
+    torch.testing.assert_close(out.double(), expected, atol=1e-5, rtol=1e-5)
+
+
+def test_registry_and_forced_backend():
+    assert {'fa3', 'fa2', 'sdpa', 'math'} <= set(ATTENTION_BACKENDS)
+    with pytest.raises(AssertionError):
+        set_attention_backend('does-not-exist')
+
+
+def test_dense_lens():
+    assert dense_lens(None, 4) is None
+    # lens covering the whole sequence do not mask anything
+    assert dense_lens(torch.tensor([4, 4]), 4) is None
+    lens = torch.tensor([4, 2])
+    assert dense_lens(lens, 4) is lens
+
+
+def test_pad_packed():
+    lens = torch.tensor([2, 3], dtype=torch.int32)
+    packed = torch.arange(5, dtype=torch.float32).view(5, 1, 1) + 1
+    out = pad_packed(packed, lens, 2, 4)
+    assert out.shape == (2, 4, 1, 1)
+    assert out[0, :, 0, 0].tolist() == [1, 2, 0, 0]
+    assert out[1, :, 0, 0].tolist() == [3, 4, 5, 0]
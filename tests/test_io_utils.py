@@ -0,0 +1,57 @@
+import subprocess
+
+import numpy as np
+import pytest
+
+from ovi.utils.io_utils import find_ffmpeg, mux_video, save_video
+
+SAMPLE_RATE = 16000
+FPS = 24
+
+
+@pytest.fixture(scope="module")
+def ffmpeg():
+    try:
+        return find_ffmpeg()
+    except RuntimeError:
+        pytest.skip("ffmpeg is not available")
+
+
+def decode(ffmpeg, path, stream, fmt):
+    # raw frames or mono samples of one stream of an MP4
+    args = ["-pix_fmt", "rgb24"] if stream == "v" else ["-ac", "1", "-ar", str(SAMPLE_RATE)]
+    cmd = [ffmpeg, "-loglevel", "error", "-i", path, "-map", f"0:{stream}", "-f", fmt, *args, "pipe:1"]
+    return subprocess.run(cmd, check=True, capture_output=True).stdout
+
+
+def random_frames(num_frames, height=32, width=48):
+    return np.random.default_rng(0).integers(0, 256, (num_frames, height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("audio_seconds", [0.5, 2.5])
+def test_mux_keeps_every_frame(ffmpeg, tmp_path, audio_seconds):
+    # 49 frames (~2 s) with shorter and longer audio: the video is never cut, the audio follows the frames
+    frames = random_frames(49)
+    audio = np.zeros(int(audio_seconds * SAMPLE_RATE), dtype=np.float32)
+    output_path = mux_video(str(tmp_path / "out.mp4"), frames, audio, sample_rate=SAMPLE_RATE, fps=FPS)
+    assert len(decode(ffmpeg, output_path, "v", "rawvideo")) == frames.nbytes
+    num_samples = len(decode(ffmpeg, output_path, "a", "s16le")) // 2
+    # within one aac frame of the video duration
+    assert abs(num_samples - round(49 * SAMPLE_RATE / FPS)) <= 1024
+
+
+def test_mux_streamed_frames_and_audio(ffmpeg, tmp_path):
+    frames = random_frames(33)
+    audio = np.zeros(SAMPLE_RATE, dtype=np.int16)
+    output_path = mux_video(str(tmp_path / "out.mp4"), iter(np.split(frames, [9, 17])),
+                            iter(np.split(audio, 4)), sample_rate=SAMPLE_RATE, fps=FPS, num_frames=33)
+    assert len(decode(ffmpeg, output_path, "v", "rawvideo")) == frames.nbytes
+
+
+def test_save_video_to_bytes(ffmpeg, tmp_path):
+    # float (C, F, H, W) frames in [-1, 1], fragmented MP4 bytes
+    video = np.zeros((3, 17, 32, 48), dtype=np.float32)
+    data = save_video(None, video, np.zeros(8000, dtype=np.float32), sample_rate=SAMPLE_RATE, fps=FPS)
+    path = tmp_path / "out.mp4"
+    path.write_bytes(data)
+    assert len(decode(ffmpeg, str(path), "v", "rawvideo")) == 17 * 32 * 48 * 3
@@ -0,0 +1,87 @@
+import os
+
+from omegaconf import OmegaConf
+
+from ovi.utils.job_utils import JobManifest, job_hash, job_output_path
+
+CONFIG = {"model_name": "960x960_5s", "mode": "t2v", "step_cache_threshold": 0, "sparse_attention": None,
+          "batched_cfg": False, "fp8": False, "qint8": False, "attention_backend": "auto"}
+
+
+def make_request(**overrides):
+    request = dict(text_prompt="A cat plays piano. Audio: soft piano.", image_path=None,
+                   video_frame_height_width=[704, 1280], seed=100, solver_name="unipc", sample_steps=50, shift=5.0,
+                   video_guidance_scale=4.0, audio_guidance_scale=3.0, slg_layer=11,
+                   video_negative_prompt="jitter", audio_negative_prompt="robotic")
+    request.update(overrides)
+    return request
+
+
+def test_job_hash_is_stable():
+    assert job_hash(make_request(), CONFIG) == job_hash(make_request(), dict(CONFIG))
+    # OmegaConf configs hash like plain dicts
+    assert job_hash(make_request(), OmegaConf.create(CONFIG)) == job_hash(make_request(), CONFIG)
+
+
+def test_job_hash_covers_request_and_config():
+    base = job_hash(make_request(), CONFIG)
+    assert job_hash(make_request(seed=101), CONFIG) != base
+    assert job_hash(make_request(video_frame_height_width=[960, 960]), CONFIG) != base
+    for field, value in [("mode", "t2i2v"), ("model_name", "720x720_5s"), ("step_cache_threshold", 0.1),
+                         ("sparse_attention", {"tile": [4, 8, 8]}), ("batched_cfg", True), ("fp8", True),
+                         ("qint8", True), ("attention_backend", "sdpa")]:
+        assert job_hash(make_request(), dict(CONFIG, **{field: value})) != base, field
+
+
+def test_job_hash_uses_image_content(tmp_path):
+    image = tmp_path / "first_frame.png"
+    image.write_bytes(b"first")
+    first = job_hash(make_request(image_path=str(image)), CONFIG)
+    image.write_bytes(b"second")
+    assert job_hash(make_request(image_path=str(image)), CONFIG) != first
+
+
+def finish_job(manifest, output_dir, request, content=b"mp4 bytes"):
+    job_id = job_hash(request, CONFIG)
+    output_path = job_output_path(str(output_dir), request, job_id)
+    with open(output_path, "wb") as f:
+        f.write(content)
+    manifest.append(job_id, "done", output_path=output_path, bytes=len(content))
+    return job_id, output_path
+
+
+def test_manifest_skips_done_jobs(tmp_path):
+    manifest = JobManifest(str(tmp_path / "manifest.jsonl"))
+    job_id, _ = finish_job(manifest, tmp_path, make_request())
+    assert manifest.is_done(job_id)
+    assert not manifest.is_done(job_hash(make_request(seed=7), CONFIG))
+    # a new run reads the records back
+    assert JobManifest(manifest.path).is_done(job_id)
+
+
+def test_manifest_reruns_failed_and_changed_outputs(tmp_path):
+    manifest = JobManifest(str(tmp_path / "manifest.jsonl"))
+    job_id, output_path = finish_job(manifest, tmp_path, make_request())
+
+    # truncated output, the size no longer matches the record
+    with open(output_path, "wb") as f:
+        f.write(b"mp4")
+    assert not JobManifest(manifest.path).is_done(job_id)
+
+    # deleted output
+    job_id, output_path = finish_job(manifest, tmp_path, make_request(seed=1))
+    os.remove(output_path)
+    assert not JobManifest(manifest.path).is_done(job_id)
+
+    # the last record wins
+    job_id, _ = finish_job(manifest, tmp_path, make_request(seed=2))
+    manifest.append(job_id, "failed")
+    assert not JobManifest(manifest.path).is_done(job_id)
+
+
+def test_manifest_ignores_torn_lines(tmp_path):
+    manifest = JobManifest(str(tmp_path / "manifest.jsonl"))
+    job_id, _ = finish_job(manifest, tmp_path, make_request())
+    with open(manifest.path, "a") as f:
+        f.write('{"job_id": "abc", "sta')
+    assert JobManifest(manifest.path).is_done(job_id)
@@ -0,0 +1,93 @@
+import pytest
+import torch
+
+from ovi.modules.model import clear_rope_cache, get_rope_tables, rope_apply_tables, rope_params
+
+
+def reference_rope_apply_3d(x, grid_sizes, freqs):
+    # complex rotation of the valid tokens as in the original Wan rope_apply, padding passed through
+    n, c = x.size(2), x.size(3) // 2
+    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+    output = []
+    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
+        seq_len = f * h * w
+        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(seq_len, n, -1, 2))
+        freqs_i = torch.cat([
+            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
+            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
+        ], dim=-1).reshape(seq_len, 1, -1)
+        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
+        output.append(torch.cat([x_i, x[i, seq_len:].to(torch.float64)]))
+    return torch.stack(output)
+
+
+def reference_rope_apply_1d(x, grid_sizes, freqs):
+    n, c_rope = x.size(2), freqs.shape[1]
+    output = []
+    for i, (l, ) in enumerate(grid_sizes.tolist()):
+        x_i = torch.view_as_complex(x[i, :l].to(torch.float64).reshape(l, n, -1, 2))
+        x_i = torch.cat([x_i[:, :, :c_rope] * freqs[:l, None, :], x_i[:, :, c_rope:]], dim=2)
+        output.append(torch.cat([torch.view_as_real(x_i).flatten(2), x[i, l:].to(torch.float64)]))
+    return torch.stack(output)
+
+
+def video_freqs(head_dim):
+    d = head_dim
+    return torch.cat([
+        rope_params(1024, d - 4 * (d // 6)),
+        rope_params(1024, 2 * (d // 6)),
+        rope_params(1024, 2 * (d // 6))
+    ], dim=1)
+
+
+def test_rope_tables_match_complex_rope_3d():
+    clear_rope_cache()
+    torch.manual_seed(0)
+    head_dim = 24
+    # second sample is shorter, its tail is padding
+    grid_sizes = torch.tensor([[3, 4, 5], [2, 3, 5]])
+    x = torch.randn(2, 64, 2, head_dim)
+    cos, sin = get_rope_tables(grid_sizes, video_freqs(head_dim), x.size(1), head_dim)
+    out = rope_apply_tables(x, cos, sin)
+    torch.testing.assert_close(out.double(), reference_rope_apply_3d(x, grid_sizes, video_freqs(head_dim)),
+                               atol=1e-5, rtol=1e-5)
+
+
+def test_rope_tables_match_complex_rope_1d():
+    clear_rope_cache()
+    torch.manual_seed(0)
+    head_dim = 16
+    # fewer rope dims than head_dim // 2, the rest is passed through
+    freqs = rope_params(1024, 12)
+    grid_sizes = torch.tensor([[10], [7]])
+    x = torch.randn(2, 12, 2, head_dim)
+    cos, sin = get_rope_tables(grid_sizes, freqs, x.size(1), head_dim)
+    out = rope_apply_tables(x, cos, sin)
+    torch.testing.assert_close(out.double(), reference_rope_apply_1d(x, grid_sizes, freqs), atol=1e-5, rtol=1e-5)
+
+
+def test_rope_tables_are_cached():
+    clear_rope_cache()
+    grid_sizes = torch.tensor([[2, 2, 2]])
+    freqs = video_freqs(24)
+    assert get_rope_tables(grid_sizes, freqs, 8, 24) is get_rope_tables(grid_sizes, freqs, 8, 24)
+
+
+@pytest.mark.parametrize("sp_size", [2, 3])
+def test_context_parallel_rope_slices_tables(monkeypatch, sp_size):
+    xdit = pytest.importorskip("ovi.distributed_comms.distributed.xdit_context_parallel")
+    clear_rope_cache()
+    torch.manual_seed(0)
+    head_dim = 24
+    freqs = video_freqs(head_dim)
+    grid_sizes = torch.tensor([[3, 4, 5]])
+    # full sequence padded to a multiple of sp_size, each rank holds one chunk
+    s = -(-60 // sp_size) + 1
+    x = torch.randn(1, s * sp_size, 2, head_dim)
+    expected = reference_rope_apply_3d(x, grid_sizes, freqs)
+    monkeypatch.setattr(xdit, "get_sequence_parallel_world_size", lambda: sp_size)
+    for rank in range(sp_size):
+        monkeypatch.setattr(xdit, "get_sequence_parallel_rank", lambda: rank)
+        out = xdit.rope_apply(x[:, rank * s:(rank + 1) * s], grid_sizes, freqs)
+        torch.testing.assert_close(out.double(), expected[:, rank * s:(rank + 1) * s], atol=1e-5, rtol=1e-5)
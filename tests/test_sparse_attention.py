@@ -0,0 +1,85 @@
+import pytest
+import torch
+
+from ovi.modules import sparse_attention as sparse_attention_module
+from ovi.modules.attention import set_attention_backend
+from ovi.modules.sparse_attention import (SparseAttentionConfig, clear_tile_layouts, get_tile_layout,
+                                          local_attention_3d, local_attention_3d_reference, local_attention_mask)
+
+
+@pytest.fixture(autouse=True)
+def math_backend():
+    set_attention_backend('math')
+    clear_tile_layouts()
+    yield
+    set_attention_backend(None)
+
+
+def random_qkv(grid_sizes, seq_len, num_heads=2, head_dim=8):
+    torch.manual_seed(0)
+    shape = (grid_sizes.size(0), seq_len, num_heads, head_dim)
+    return torch.randn(shape), torch.randn(shape), torch.randn(shape)
+
+
+@pytest.mark.parametrize("global_frames", [0, 2])
+def test_local_attention_matches_reference(global_frames):
+    # tiles do not divide the grid, the edge tiles are smaller; the second sample is padded
+    config = SparseAttentionConfig(tile=(2, 2, 3), radius=(1, 0, 1), global_frames=global_frames)
+    grid_sizes = torch.tensor([[5, 5, 7], [4, 3, 7]])
+    q, k, v = random_qkv(grid_sizes, seq_len=5 * 5 * 7 + 3)
+    out = local_attention_3d(q, k, v, grid_sizes, config, dtype=torch.float32)
+    expected = local_attention_3d_reference(q, k, v, grid_sizes, config)
+    torch.testing.assert_close(out, expected, atol=1e-5, rtol=1e-5)
+    # tokens beyond the grid are zero
+    assert out[1, 4 * 3 * 7:].abs().max() == 0
+
+
+def test_local_attention_in_chunks_matches_reference(monkeypatch):
+    # a few query tiles per gathered key/value chunk
+    monkeypatch.setattr(sparse_attention_module, "SPARSE_ATTENTION_CHUNK_BYTES", 64 * 1024)
+    config = SparseAttentionConfig(tile=(2, 2, 2), radius=(1, 1, 1), global_frames=1)
+    grid_sizes = torch.tensor([[5, 4, 5]])
+    q, k, v = random_qkv(grid_sizes, seq_len=100)
+    out = local_attention_3d(q, k, v, grid_sizes, config, dtype=torch.float32)
+    torch.testing.assert_close(out, local_attention_3d_reference(q, k, v, grid_sizes, config), atol=1e-5, rtol=1e-5)
+
+
+def test_covering_radius_is_dense_attention():
+    config = SparseAttentionConfig(tile=(2, 2, 2), radius=(3, 3, 3))
+    grid = (5, 4, 3)
+    assert local_attention_mask(grid, config).all()
+    grid_sizes = torch.tensor([grid])
+    q, k, v = random_qkv(grid_sizes, seq_len=60)
+    scores = torch.einsum('blnc,bsnc->bnls', q, k) * q.size(-1)**-0.5
+    dense = torch.einsum('bnls,bsnc->blnc', scores.softmax(dim=-1), v)
+    out = local_attention_3d(q, k, v, grid_sizes, config, dtype=torch.float32)
+    torch.testing.assert_close(out, dense, atol=1e-5, rtol=1e-5)
+
+
+def test_mask_neighbourhood_and_global_frames():
+    config = SparseAttentionConfig(tile=(1, 2, 2), radius=(1, 0, 0), global_frames=1)
+    mask = local_attention_mask((4, 2, 4), config)
+    tokens = torch.arange(4 * 2 * 4).view(4, 2, 4)
+    query = tokens[3, 0, 0]
+    # frames 2 and 3 of the query's spatial tile, and all of the global frame 0
+    expected = torch.zeros(32, dtype=torch.bool)
+    expected[tokens[2:4, :, :2].flatten()] = True
+    expected[tokens[0].flatten()] = True
+    assert torch.equal(mask[query], expected)
+
+
+def test_tile_layout_is_cached_per_global_frames():
+    config = SparseAttentionConfig(tile=(2, 2, 2), radius=(1, 1, 1))
+    layout = get_tile_layout((4, 4, 4), config, 'cpu')
+    assert get_tile_layout((4, 4, 4), config, 'cpu') is layout
+    with_prefix = config.with_global_frames(2)
+    assert with_prefix is not config and with_prefix.global_frames == 2 and config.global_frames == 0
+    assert get_tile_layout((4, 4, 4), with_prefix, 'cpu') is not layout
+    assert config.with_global_frames(0) is config
+
+
+def test_sparse_step_range_and_blocks():
+    config = SparseAttentionConfig(blocks=[3, 5], dense_first_steps=2, dense_last_steps=1)
+    assert [config.is_sparse_step(step, 6) for step in range(6)] == [False, False, True, True, True, False]
+    assert config.uses_block(3) and not config.uses_block(4)
+    assert SparseAttentionConfig().uses_block(29)